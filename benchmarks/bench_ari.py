@@ -0,0 +1,218 @@
+"""
+Load benchmarks of Ari client against mock ARI server
+
+* events: events/sec through Ari.on_message -> send_callback
+* rest: REST requests/sec through Ari.send_request
+* calls: max sustained concurrent calls of CallManager
+
+Usage:
+    python3 -m benchmarks.bench_ari [events|rest|calls ...] [--output result.json]
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from call_sender import CallManager
+from libraries.ari.ari import Ari
+from benchmarks.bench_codec import load_frames
+from benchmarks.mock_ari import MockAriServer
+
+
+def create_ari(url, **kwargs):
+    return Ari(url, "user", "secret", "bench", {}, **kwargs)
+
+
+def bench_events(frames_count, shards):
+    """
+    Recorded call events are decoded and dispatched to callbacks, without network
+    """
+    frames = load_frames()
+    result = {}
+    for lazy_events in (False, True):
+        ari = create_ari("127.0.0.1:1", dispatch_shards=shards, lazy_events=lazy_events)
+        ari.ws_running = True
+        received = [0]
+        received_cs = threading.Lock()
+        done = threading.Event()
+
+        def on_event(ari, event):
+            with received_cs:
+                received[0] += 1
+                if received[0] >= frames_count:
+                    done.set()
+        for event_type in set(json.loads(frame)["type"] for frame in frames):
+            ari.append_callback(event_type, on_event)
+
+        # inline: decode and send callbacks in the same thread
+        started = time.perf_counter()
+        sent = 0
+        while sent < frames_count:
+            for frame in frames:
+                event = ari.decode_event(frame)
+                if event is not None:
+                    ari.send_callback(event)
+            sent += len(frames)
+        inline_rate = sent / (time.perf_counter() - started)
+
+        # dispatched: on_message puts events to sharded dispatcher
+        received[0] = 0
+        done.clear()
+        ari._dispatcher.start()
+        started = time.perf_counter()
+        sent = 0
+        while sent < frames_count:
+            for frame in frames:
+                ari.on_message(None, frame)
+            sent += len(frames)
+        done.wait(60)
+        dispatched_rate = received[0] / (time.perf_counter() - started)
+        ari.close()
+        ari.join_threads()
+        prefix = "lazy_" if lazy_events else ""
+        result[prefix + "inline_events_per_sec"] = inline_rate
+        result[prefix + "dispatched_events_per_sec"] = dispatched_rate
+    result["shards"] = shards
+    return result
+
+
+def bench_rest(requests_count, threads, rest_latency):
+    server = MockAriServer(rest_latency=rest_latency)
+    server.start()
+    ari = create_ari(server.url, pool_size=threads)
+    # Bridges are created once, so every request has the same response size
+    for _ in range(10):
+        ari.create_bridge()
+    per_thread = requests_count // threads
+
+    def worker():
+        for _ in range(per_thread):
+            ari.bridges()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    duration = time.perf_counter() - started
+    result = {
+        "requests": per_thread * threads,
+        "threads": threads,
+        "rest_latency": rest_latency,
+        "requests_per_sec": per_thread * threads / duration,
+        "pool": ari.pool_stat(),
+    }
+    ari.close()
+    server.stop()
+    return result
+
+
+def run_calls(server, count, duration, shards):
+    """
+    Runs CallManager with count simultaneous calls
+    :return: dict with average live calls and finished calls per second
+    """
+    ari = create_ari(server.url, dispatch_shards=shards, pool_size=max(10, count // 5))
+    ari.run()
+    while not ari._opened:
+        time.sleep(0.01)
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as config:
+        config.write("[calls]\ncount=%d\ndriver=SIP\nphone=79000000004\ncallerid=79000000003\ntrunk=mock\n" % count)
+    manager = CallManager(ari, config.name)
+    os.unlink(config.name)
+    live = [0]
+    finished = [0]
+
+    def started(ari, event):
+        if event.channel.protocol == "SIP":
+            live[0] += 1
+
+    def destroyed(ari, event):
+        if event.channel.protocol == "SIP":
+            live[0] -= 1
+            finished[0] += 1
+    ari.append_callback("StasisStart", started)
+    ari.append_callback("ChannelDestroyed", destroyed)
+    manager.run_async()
+    samples = []
+    # The first playback duration is a ramp up
+    time.sleep(server.state.playback_duration)
+    finished_before = finished[0]
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        samples.append(live[0])
+        time.sleep(0.05)
+    finished_calls = finished[0] - finished_before
+    manager.terminate()
+    ari.terminate()
+    return {
+        "target": count,
+        "live_avg": sum(samples) / float(len(samples)),
+        "live_max": max(samples),
+        "finished_per_sec": finished_calls / duration,
+    }
+
+
+def bench_calls(levels, duration, playback_duration, shards, sustain=0.9, rest_latency=0.0):
+    """
+    Increases simultaneous calls until average live calls fall below sustain * target
+    """
+    runs = []
+    max_sustained = 0
+    for count in levels:
+        # Every level starts with channel ids from 1, so it gets a fresh server
+        server = MockAriServer(rest_latency=rest_latency, playback_duration=playback_duration)
+        server.start()
+        result = run_calls(server, count, duration, shards)
+        server.stop()
+        runs.append(result)
+        logging.info("calls benchmark %s" % result)
+        if result["live_avg"] < count * sustain:
+            break
+        max_sustained = count
+    return {
+        "playback_duration": playback_duration,
+        "rest_latency": rest_latency,
+        "shards": shards,
+        "sustain": sustain,
+        "max_sustained_calls": max_sustained,
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", default=["events", "rest", "calls"])
+    parser.add_argument("--events", type=int, default=50000, help="events to dispatch")
+    parser.add_argument("--requests", type=int, default=5000, help="REST requests to send")
+    parser.add_argument("--threads", type=int, default=8, help="threads sending REST requests")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="mock server REST latency")
+    parser.add_argument("--shards", type=int, default=4, help="Ari dispatch_shards")
+    parser.add_argument("--levels", default="25,50,100,200,400", help="simultaneous calls to try")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of every calls level")
+    parser.add_argument("--playback-duration", type=float, default=1.0, help="mock playback seconds")
+    parser.add_argument("--sustain", type=float, default=0.9, help="min live calls share of target to count level as sustained")
+    parser.add_argument("--output", help="write json result to file")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    result = {"time": time.time()}
+    if "events" in args.benchmarks:
+        result["events"] = bench_events(args.events, args.shards)
+    if "rest" in args.benchmarks:
+        result["rest"] = bench_rest(args.requests, args.threads, args.rest_latency)
+    if "calls" in args.benchmarks:
+        levels = [int(level) for level in args.levels.split(",")]
+        result["calls"] = bench_calls(levels, args.duration, args.playback_duration, args.shards,
+                                      args.sustain, args.rest_latency)
+    output = json.dumps(result, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
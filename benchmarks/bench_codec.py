@@ -0,0 +1,69 @@
+"""
+Frames/sec of every installed JSON codec on recorded ARI events
+
+Usage:
+    python3 -m benchmarks.bench_codec [--frames N] [--json]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from libraries.ari.ari import Ari
+from libraries.ari.codec import available_codecs
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "call_events.jsonl")
+
+
+def load_frames(path=DATA_FILE):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def rate(func, frames, count):
+    started = time.perf_counter()
+    done = 0
+    while done < count:
+        for frame in frames:
+            func(frame)
+        done += len(frames)
+    return done / (time.perf_counter() - started)
+
+
+def run(count, lazy_events=False):
+    frames = load_frames()
+    frames_bytes = [frame.encode() for frame in frames]
+    results = []
+    for codec in available_codecs():
+        ari = Ari("127.0.0.1:8088", "user", "secret", "ari_test", {}, codec=codec, lazy_events=lazy_events)
+        ari.ws_running = True
+        results.append({
+            "codec": codec.name,
+            "loads_str": rate(codec.loads, frames, count),
+            "loads_bytes": rate(codec.loads, frames_bytes, count),
+            "decode_event": rate(ari.decode_event, frames, count),
+        })
+        ari.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=100000, help="frames to decode by every codec")
+    parser.add_argument("--lazy", action="store_true", help="decode events with lazy_events=True")
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    results = run(args.frames, args.lazy)
+    if args.json:
+        print(json.dumps(results))
+        return
+    print("%-8s %14s %14s %14s" % ("codec", "loads str/s", "loads bytes/s", "decode_event/s"))
+    for result in results:
+        print("%-8s %14d %14d %14d" % (result["codec"], result["loads_str"], result["loads_bytes"],
+                                       result["decode_event"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""
+Hash functions and resize policies of asterisk hashtab.c on channel keys
+
+Keys are channel unique ids, channel names and bridge ids of the recorded ARI event stream
+(benchmarks/data/call_events.jsonl or a log of record_events) in order of appearance.
+Synthetic keys in the recorded formats extend the recording up to --extend calls (default 20000),
+they are reported separately from the recorded ones. Key kinds with less than --min-keys keys
+are not reported, a short recording alone says nothing about the key distribution.
+Keys are replayed with churn in order of appearance: every key is inserted and the key
+2 * `live` keys before it is removed (a call has 2 keys of every kind), so tables grow
+like asterisk tables under load.
+Hash functions (ast_hashtab_hash_string, _sax, _nocase) are computed for all keys at once
+with NumPy, tables are simulated for every resize policy:
+* java - resize when load factor > 0.75, new size is the next prime after 2 * size
+* tight - resize when elements > size, new size is the next prime after 3 * size
+* none - never resize
+Reported: resizes, elements rehashed under the write lock, bucket lengths and probes
+of a successful lookup at the peak of live keys.
+
+Requires NumPy: pip3 install numpy
+
+Usage:
+    python3 -m benchmarks.bench_hashtab [--events FILE] [--extend N] [--min-keys N] [--live N] [--json]
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+import uuid
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from libraries.ari.recorder import read_frames
+from benchmarks.bench_codec import DATA_FILE
+
+HASHES = ("string", "sax", "nocase")
+POLICIES = ("java", "tight", "none")
+KEY_KINDS = ("uniqueid", "name", "bridge")
+KEYS_PER_CALL = 2
+# Bucket lengths of the distribution table, the last one is "or more"
+BUCKET_LENGTHS = 8
+
+
+def hash_string(key):
+    """
+    Reference ast_hashtab_hash_string, char is signed as in the C code
+    """
+    total = 0
+    for char in key.encode():
+        if char > 127:
+            char -= 256
+        total = (total * 13 + char) & 0xFFFFFFFF
+    return total
+
+
+def hash_string_sax(key):
+    total = 0
+    for char in key.encode():
+        total = (total ^ (((total << 5) + (total >> 2) + (total << 10) + char) & 0xFFFFFFFF)) & 0xFFFFFFFF
+    return total
+
+
+def hash_string_nocase(key):
+    total = 0
+    for char in key.encode():
+        if 97 <= char <= 122:
+            char -= 32
+        total = (total * 13 + char) & 0xFFFFFFFF
+    return total
+
+
+REFERENCE = {
+    "string": hash_string,
+    "sax": hash_string_sax,
+    "nocase": hash_string_nocase,
+}
+
+
+def key_matrix(keys):
+    """
+    :return: uint8 matrix of keys padded by NUL, a row per key
+    """
+    encoded = [key.encode() for key in keys]
+    width = max(len(key) for key in encoded)
+    return numpy.array(encoded, dtype="S%d" % width).view(numpy.uint8).reshape(len(encoded), width)
+
+
+def hash_keys(matrix, name):
+    """
+    Computes hash function of hashtab.c for every row of key_matrix, column by column
+    :return: uint32 array
+    """
+    total = numpy.zeros(matrix.shape[0], dtype=numpy.uint32)
+    for column in range(matrix.shape[1]):
+        chars = matrix[:, column]
+        # Keys are NUL terminated, short keys keep their hash on padding columns
+        present = chars != 0
+        if name == "string":
+            # (unsigned int)(*str) of signed char
+            value = chars.view(numpy.int8).astype(numpy.uint32)
+            updated = total * numpy.uint32(13) + value
+        elif name == "nocase":
+            value = chars.astype(numpy.uint32)
+            value = numpy.where((chars >= 97) & (chars <= 122), value - numpy.uint32(32), value)
+            updated = total * numpy.uint32(13) + value
+        elif name == "sax":
+            value = chars.astype(numpy.uint32)
+            updated = total ^ ((total << numpy.uint32(5)) + (total >> numpy.uint32(2)) +
+                               (total << numpy.uint32(10)) + value)
+        else:
+            raise ValueError("unknown hash %s" % name)
+        total = numpy.where(present, updated, total)
+    return total
+
+
+def is_prime(num):
+    # ast_is_prime
+    if not num & 1:
+        return False
+    divisor = 3
+    limit = num
+    while divisor < limit:
+        if num % divisor == 0:
+            return False
+        limit = num // divisor
+        divisor += 2
+    return True
+
+
+def next_prime(num):
+    while not is_prime(num):
+        num += 1
+    return num
+
+
+def needs_resize(policy, elements, size):
+    if policy == "java":
+        return elements > size * 0.75
+    if policy == "tight":
+        return elements > size
+    return numpy.zeros_like(elements, dtype=bool)
+
+
+def new_size(policy, size):
+    if policy == "java":
+        return next_prime(size << 1)
+    if policy == "tight":
+        return next_prime(size + (size << 1))
+    return size
+
+
+def parse_keys(path):
+    """
+    :param path: jsonl of events or event log of recorder.EventRecorder
+    :return: dict kind -> keys of the recorded event stream in order of appearance
+    """
+    keys = dict((kind, []) for kind in KEY_KINDS)
+    seen = set()
+    with open(path, "rb") as events_file:
+        is_log = events_file.read(2) == b"\x1f\x8b"
+    if is_log:
+        frames = read_frames(path)
+    else:
+        with open(path) as events_file:
+            frames = [line for line in events_file if line.strip()]
+    for frame in frames:
+        event = json.loads(frame)
+        for kind, model, field in (("uniqueid", "channel", "id"), ("name", "channel", "name"),
+                                   ("bridge", "bridge", "id")):
+            value = event.get(model, {}).get(field)
+            if value is not None and (kind, value) not in seen:
+                seen.add((kind, value))
+                keys[kind].append(value)
+    return keys
+
+
+def generate_keys(recorded, calls, seed=1):
+    """
+    Synthesizes keys of calls calls after the recorded ones by asterisk formats:
+    unique id "<epoch>.<sequence>", name "<tech>/<peer>-<sequence in 8 hex digits>" and a Snoop channel
+    per call, bridge uuid4 id (two bridges per call). Sequences continue the recorded ones
+    :return: dict kind -> synthetic keys in call order, every call has 2 keys of every kind
+    """
+    epoch = 1760702400
+    prefix = "SIP/local"
+    sequence = 0
+    for unique_id in recorded["uniqueid"]:
+        match = re.match(r"(\d+)\.(\d+)$", unique_id)
+        if match:
+            epoch = int(match.group(1))
+            sequence = max(sequence, int(match.group(2)))
+    for name in recorded["name"]:
+        match = re.match(r"(\w+/[^/]+)-([0-9a-f]{8})$", name)
+        if match:
+            if not name.startswith("Snoop/"):
+                prefix = match.group(1)
+            sequence = max(sequence, int(match.group(2), 16))
+    rnd = uuid.UUID(int=seed).int
+    keys = dict((kind, []) for kind in KEY_KINDS)
+    for _ in range(calls):
+        channel_id = "%d.%d" % (epoch, sequence + 1)
+        snoop_id = "%d.%d" % (epoch, sequence + 2)
+        keys["uniqueid"].extend((channel_id, snoop_id))
+        keys["name"].extend(("%s-%08x" % (prefix, sequence + 1), "Snoop/%s-%08x" % (channel_id, sequence + 2)))
+        for _ in range(2):
+            rnd = (rnd * 6364136223846793005 + 1442695040888963407) % (1 << 128)
+            keys["bridge"].append(str(uuid.UUID(int=rnd, version=4)))
+        sequence += 2
+    return keys
+
+
+def churn(keys_count, live_keys):
+    """
+    :return: op key index and insert flag arrays: every key is inserted,
+    then the key live_keys keys before it is removed
+    """
+    op_keys = []
+    op_insert = []
+    for key in range(keys_count):
+        op_keys.append(key)
+        op_insert.append(True)
+        if key >= live_keys:
+            op_keys.append(key - live_keys)
+            op_insert.append(False)
+    return numpy.array(op_keys, dtype=numpy.int64), numpy.array(op_insert, dtype=bool)
+
+
+def simulate(hashes, op_keys, op_insert, policy, initial):
+    """
+    Replays inserts and removes on a table of policy
+    :return: dict of resize stats and bucket lengths at the peak of live keys
+    """
+    elements = numpy.cumsum(numpy.where(op_insert, 1, -1))
+    size = next_prime(initial)
+    position = 0
+    resizes = []
+    while policy != "none":
+        # Resize is checked after every insert
+        candidates = op_insert[position:] & needs_resize(policy, elements[position:], size)
+        if not candidates.any():
+            break
+        position += int(numpy.argmax(candidates))
+        resized = new_size(policy, size)
+        resizes.append({"op": position, "elements": int(elements[position]), "from": size, "to": resized})
+        size = resized
+        position += 1
+    peak = int(numpy.argmax(elements))
+    # Size of the table at the peak
+    peak_size = next_prime(initial)
+    for resize in resizes:
+        if resize["op"] <= peak:
+            peak_size = resize["to"]
+    inserted = numpy.full(len(hashes), len(op_keys), dtype=numpy.int64)
+    removed = numpy.full(len(hashes), len(op_keys), dtype=numpy.int64)
+    inserted[op_keys[op_insert]] = numpy.nonzero(op_insert)[0]
+    removed[op_keys[~op_insert]] = numpy.nonzero(~op_insert)[0]
+    alive = (inserted <= peak) & (removed > peak)
+    lengths = numpy.bincount(hashes[alive] % numpy.uint32(peak_size), minlength=peak_size)
+    live = int(lengths.sum())
+    return {
+        "policy": policy,
+        "peak_live": live,
+        "buckets": peak_size,
+        "final_buckets": size,
+        "resizes": len(resizes),
+        # Every resize rehashes all elements and walks the old and new bucket arrays under the write lock
+        "rehashed": sum(resize["elements"] for resize in resizes),
+        "max_resize_work": max([resize["elements"] + resize["from"] + resize["to"] for resize in resizes] or [0]),
+        "load": live / float(peak_size),
+        "largest_bucket": int(lengths.max()),
+        "empty": float((lengths == 0).mean()),
+        # A successful lookup walks half of the chain on average, a miss walks the whole chain
+        "probe_hit": float((lengths * (lengths + 1) / 2.0).sum() / max(live, 1)),
+        "probe_miss": float(lengths.mean()),
+        "distribution": numpy.bincount(numpy.minimum(lengths, BUCKET_LENGTHS),
+                                       minlength=BUCKET_LENGTHS + 1).tolist(),
+    }
+
+
+def check(keys, count=1000):
+    """
+    Compares vectorized hashes with reference implementations
+    """
+    sample = keys[:count]
+    matrix = key_matrix(sample)
+    for name in HASHES:
+        vectorized = hash_keys(matrix, name).tolist()
+        expected = [REFERENCE[name](key) for key in sample]
+        if vectorized != expected:
+            raise AssertionError("vectorized %s hash differs from reference" % name)
+
+
+def run(events, extend, live, initial, hashes=HASHES, policies=POLICIES, min_keys=1000):
+    """
+    :param extend: calls to reach with synthetic keys, 0 - only recorded keys
+    :param min_keys: key kinds with less keys are skipped
+    """
+    recorded = parse_keys(events)
+    synthetic = dict((kind, []) for kind in KEY_KINDS)
+    recorded_calls = max(len(values) for values in recorded.values()) // KEYS_PER_CALL
+    if extend > recorded_calls:
+        synthetic = generate_keys(recorded, extend - recorded_calls)
+    results = []
+    skipped = []
+    for kind in KEY_KINDS:
+        keys = recorded[kind] + synthetic[kind]
+        if len(keys) < max(min_keys, 1):
+            skipped.append(kind)
+            continue
+        op_keys, op_insert = churn(len(keys), live * KEYS_PER_CALL)
+        check(keys)
+        matrix = key_matrix(keys)
+        for name in hashes:
+            started = time.perf_counter()
+            hashed = hash_keys(matrix, name)
+            elapsed = time.perf_counter() - started
+            distinct = len(numpy.unique(hashed)) / float(len(hashed))
+            for policy in policies:
+                result = simulate(hashed, op_keys, op_insert, policy, initial)
+                result.update({
+                    "keys": kind,
+                    "recorded": len(recorded[kind]),
+                    "synthetic": len(synthetic[kind]),
+                    "hash": name,
+                    "hash_mkeys_per_sec": len(hashed) / elapsed / 1e6,
+                    "distinct_hashes": distinct,
+                })
+                results.append(result)
+    return {
+        "events": events,
+        "recorded_keys": dict((kind, len(values)) for kind, values in recorded.items()),
+        "synthetic_keys": dict((kind, len(values)) for kind, values in synthetic.items()),
+        "extend": extend,
+        "min_keys": min_keys,
+        "skipped": skipped,
+        "live": live,
+        "initial": initial,
+        "results": results,
+    }
+
+
+def print_tables(report):
+    print("recorded keys %s, %d live calls, initial %d buckets" % (
+        report["recorded_keys"], report["live"], report["initial"]))
+    if any(report["synthetic_keys"].values()):
+        print("synthetic keys %s in recorded formats extend the recording to %d calls" % (
+            report["synthetic_keys"], report["extend"]))
+    if len(report["skipped"]) > 0:
+        print("%s keys are skipped, they have less than %d keys, use --extend to add synthetic ones" % (
+            ", ".join(report["skipped"]), report["min_keys"]))
+    print("%-9s %-7s %-6s %8s %8s %8s %10s %10s %6s %8s %7s %7s %7s" % (
+        "keys", "hash", "policy", "live", "buckets", "resizes", "rehashed", "max work", "load", "largest",
+        "empty", "hit", "miss"))
+    for result in report["results"]:
+        print("%-9s %-7s %-6s %8d %8d %8d %10d %10d %6.2f %8d %6.1f%% %7.2f %7.2f" % (
+            result["keys"], result["hash"], result["policy"], result["peak_live"], result["buckets"],
+            result["resizes"], result["rehashed"], result["max_resize_work"], result["load"],
+            result["largest_bucket"], result["empty"] * 100, result["probe_hit"], result["probe_miss"]))
+    print("")
+    print("bucket length distribution at peak, % of buckets")
+    header = ["%5d" % length for length in range(BUCKET_LENGTHS)] + ["%4d+" % BUCKET_LENGTHS]
+    print("%-9s %-7s %-6s %s %10s %9s" % ("keys", "hash", "policy", " ".join(header), "Mkeys/s", "distinct"))
+    for result in report["results"]:
+        buckets = float(result["buckets"])
+        shares = ["%5.1f" % (count * 100 / buckets) for count in result["distribution"]]
+        print("%-9s %-7s %-6s %s %10.2f %8.2f%%" % (result["keys"], result["hash"], result["policy"],
+                                                    " ".join(shares), result["hash_mkeys_per_sec"],
+                                                    result["distinct_hashes"] * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default=DATA_FILE, help="recorded ARI events (jsonl or event log)")
+    parser.add_argument("--extend", type=int, default=20000, help="add synthetic keys up to calls, 0 - recorded only")
+    parser.add_argument("--min-keys", type=int, default=1000, help="skip key kinds with less keys")
+    parser.add_argument("--live", type=int, default=2000, help="simultaneous calls")
+    parser.add_argument("--initial", type=int, default=17, help="initial buckets of a table")
+    parser.add_argument("--hashes", default=",".join(HASHES), help="hash functions to compare")
+    parser.add_argument("--policies", default=",".join(POLICIES), help="resize policies to compare")
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    if numpy is None:
+        print("bench_hashtab requires NumPy: pip3 install numpy")
+        sys.exit(1)
+    report = run(args.events, args.extend, args.live, args.initial,
+                 args.hashes.split(","), args.policies.split(","), args.min_keys)
+    if args.json:
+        print(json.dumps(report))
+        return
+    print_tables(report)
+
+
+if __name__ == '__main__':
+    main()
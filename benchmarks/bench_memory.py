@@ -0,0 +1,86 @@
+"""
+Memory of live models per call
+
+Every call of call_sender.py keeps a channel, a snoop channel, two bridges and a playback.
+Models are created from recorded events and measured with tracemalloc.
+
+Usage:
+    python3 -m benchmarks.bench_memory [--calls N] [--json]
+"""
+import argparse
+import gc
+import json
+import logging
+import tracemalloc
+
+from libraries.ari import models
+from libraries.ari.ari import Ari
+from benchmarks.bench_codec import load_frames
+
+
+def call_data():
+    """
+    :return: raw data of channel, snoop channel, bridge and playback from recorded events
+    """
+    data = {}
+    for frame in load_frames():
+        event = json.loads(frame)
+        if event["type"] == "StasisStart":
+            key = "snoop" if event["channel"]["name"].startswith("Snoop") else "channel"
+            data[key] = event["channel"]
+        elif event["type"] == "BridgeCreated":
+            data["bridge"] = event["bridge"]
+        elif event["type"] == "PlaybackStarted":
+            data["playback"] = event["playback"]
+    return data
+
+
+def measure(calls, keep_model_data):
+    ari = Ari("127.0.0.1:1", "user", "secret", "bench", {}, keep_model_data=keep_model_data)
+    ari.ws_running = True
+    template = json.dumps(call_data())
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for num in range(calls):
+        # Every call has its own json from websocket, it is released after events are handled
+        data = json.loads(template)
+        data["channel"]["id"] = "channel-%d" % num
+        data["snoop"]["id"] = "snoop-%d" % num
+        data["bridge"]["id"] = "bridge-%d" % num
+        data["playback"]["id"] = "playback-%d" % num
+        channel = models.Channel.get_or_create(ari, data["channel"])
+        channel.snoop_channels.append(models.Channel.get_or_create(ari, data["snoop"]))
+        models.Bridge.get_or_create(ari, data["bridge"])
+        models.Bridge.get_or_create(ari, dict(data["bridge"], id=data["bridge"]["id"] + "-media"))
+        models.Playback.get_or_create(ari, data["playback"])
+    del data, channel
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    ari.close()
+    return {
+        "calls": calls,
+        "keep_model_data": keep_model_data,
+        "bytes": used,
+        "bytes_per_call": used / float(calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=10000, help="live calls to create")
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    results = [measure(args.calls, True), measure(args.calls, False)]
+    if args.json:
+        print(json.dumps(results))
+        return
+    print("%-16s %12s %14s" % ("keep_model_data", "calls", "bytes/call"))
+    for result in results:
+        print("%-16s %12d %14d" % (result["keep_model_data"], result["calls"], result["bytes_per_call"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Model registry under concurrent access
+
+Threads run Model.get_or_create, get_model and remove_model of random channels,
+like dispatch shards and REST threads of many calls do.
+Every thread count is measured with one lock per model type (stripes=1)
+and with striped locks. Stripe locks are wrapped by profiler.TimedLock, so the run reports
+acquires blocked by a lock held by another thread and acquire waits (they include waits for the GIL).
+No gain of striping is expected on CPython: threads don't run Python code in parallel under the GIL,
+so ops/sec don't grow, and a thread preempted while it holds a stripe lock blocks the others
+on that stripe about as often as on a single lock, they run thousands of operations before it resumes.
+Striping shortens waits only where lock holders run in parallel with other threads.
+
+Usage:
+    python3 -m benchmarks.bench_models [--threads 1,2,4,8] [--json]
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+
+from libraries.ari import models
+from libraries.ari.ari import Ari
+from libraries.ari.cache import ModelCache
+from libraries.ari.profiler import Profiler
+from libraries.ari.stats import Histogram
+from benchmarks.bench_memory import call_data
+
+
+def run(threads, stripes, duration, ids):
+    ari = Ari("127.0.0.1:1", "user", "secret", "bench", keep_model_data=False)
+    ari.ws_running = True
+    ari.models["Channel"] = ModelCache(pinned=ari.is_pinned, stripes=stripes)
+    # Every stripe has its own histogram, so timing doesn't add a lock shared by stripes
+    profiler = Profiler()
+    for index, stripe in enumerate(ari.models["Channel"]._stripes):
+        stripe.cs = profiler.timed_lock(stripe.cs, "stripe %d" % index)
+    template = call_data()["channel"]
+    channels = [dict(template, id="channel-%d" % num) for num in range(ids)]
+    operations = [0] * threads
+    errors = []
+    stop = threading.Event()
+
+    def worker(index):
+        rnd = random.Random(index)
+        count = 0
+        try:
+            while not stop.is_set():
+                for _ in range(100):
+                    data = channels[rnd.randrange(ids)]
+                    action = rnd.random()
+                    if action < 0.8:
+                        models.Channel.get_or_create(ari, data)
+                    elif action < 0.95:
+                        ari.get_model("Channel", data["id"])
+                    else:
+                        ari.remove_model("Channel", data["id"])
+                count += 100
+        except Exception as ex:
+            errors.append(ex)
+        operations[index] = count
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    time.sleep(duration)
+    stop.set()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - started
+    ari.close()
+    timed_locks = [stripe.cs for stripe in ari.models["Channel"]._stripes]
+    waits = Histogram()
+    for histogram in profiler.histograms.values():
+        waits.merge(histogram)
+    wait = waits.get_stat()
+    return {
+        "threads": threads,
+        "stripes": stripes,
+        "ops_per_sec": sum(operations) / elapsed,
+        "lock_acquires": wait["count"],
+        "lock_blocked": sum(lock.blocked for lock in timed_locks),
+        "lock_wait_seconds": wait["avg"] * wait["count"],
+        "lock_wait_avg": wait["avg"],
+        "lock_wait_max": wait["max"],
+        "errors": len(errors),
+        "models": len(ari.models["Channel"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", default="1,2,4,8", help="thread counts to try")
+    parser.add_argument("--stripes", type=int, default=16, help="stripes of striped cache")
+    parser.add_argument("--duration", type=float, default=2, help="seconds of every run")
+    parser.add_argument("--ids", type=int, default=10000, help="distinct channel ids")
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    for threads in [int(value) for value in args.threads.split(",")]:
+        for stripes in (1, args.stripes):
+            results.append(run(threads, stripes, args.duration, args.ids))
+    if args.json:
+        print(json.dumps(results))
+        return
+    print("%8s %8s %14s %10s %12s %12s %12s %8s" % ("threads", "stripes", "ops/sec", "blocked %", "lock wait s",
+                                                    "wait avg us", "wait max ms", "errors"))
+    for result in results:
+        print("%8d %8d %14d %9.3f%% %12.3f %12.2f %12.2f %8d" % (
+            result["threads"], result["stripes"], result["ops_per_sec"],
+            result["lock_blocked"] * 100.0 / max(result["lock_acquires"], 1), result["lock_wait_seconds"],
+            result["lock_wait_avg"] * 1e6, result["lock_wait_max"] * 1000, result["errors"]))
+
+
+if __name__ == '__main__':
+    main()
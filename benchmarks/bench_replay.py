@@ -0,0 +1,110 @@
+"""
+Replay of a recorded event log through Ari.on_message without asterisk
+
+The log is written by Ari(..., record_events=path) (`record_events` in configs/asterisk.ini).
+Every event type of the log has a callback, so events are decoded, models are updated
+and callbacks are called as in the recorded test.
+--record SECONDS records a log of CallManager calls against the mock ARI server first.
+--profile PATH prints decode, dispatch and lock wait timings of all replays
+and saves sampled stacks in flamegraph folded format to PATH.
+
+Usage:
+    python3 -m benchmarks.bench_replay events.log.gz [--speed 0,10,100] [--shards 1,4] [--json]
+    python3 -m benchmarks.bench_replay events.log.gz --record 10 [--calls 50]
+    python3 -m benchmarks.bench_replay events.log.gz --profile replay.folded
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from call_sender import CallManager
+from libraries.ari.profiler import Profiler
+from libraries.ari.recorder import Replayer, read_frames
+from benchmarks.bench_ari import create_ari
+from benchmarks.mock_ari import MockAriServer
+
+
+def record(path, seconds, calls, playback_duration=0.5):
+    """
+    Records events of calls simultaneous calls for seconds to path
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = MockAriServer(playback_duration=playback_duration)
+    server.start()
+    ari = create_ari(server.url, pool_size=max(10, calls // 5), record_events=path)
+    ari.run()
+    while not ari._opened:
+        time.sleep(0.01)
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as config:
+        config.write("[calls]\ncount=%d\ndriver=SIP\nphone=79000000004\ncallerid=79000000003\ntrunk=mock\n" % calls)
+    manager = CallManager(ari, config.name)
+    os.unlink(config.name)
+    manager.run_async()
+    time.sleep(seconds)
+    manager.terminate()
+    ari.terminate()
+    server.stop()
+
+
+def replay(path, speed, shards, lazy_events, profiler=None):
+    ari = create_ari("127.0.0.1:1", dispatch_shards=shards, lazy_events=lazy_events)
+    if profiler is not None:
+        ari.enable_profiler(profiler=profiler)
+    received = [0]
+    received_cs = threading.Lock()
+
+    def on_event(ari, event):
+        with received_cs:
+            received[0] += 1
+    for event_type in set(json.loads(frame)["type"] for frame in read_frames(path)):
+        ari.append_callback(event_type, on_event)
+    result = Replayer(ari, path, speed).run()
+    ari.close()
+    ari.join_threads()
+    result.update({
+        "shards": shards,
+        "lazy_events": lazy_events,
+        "callbacks": received[0],
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="event log")
+    parser.add_argument("--speed", default="0", help="speeds to try, 0 is max speed")
+    parser.add_argument("--shards", default="1", help="dispatch shards to try")
+    parser.add_argument("--record", type=float, default=0, help="record seconds of mock calls first")
+    parser.add_argument("--calls", type=int, default=50, help="simultaneous calls of --record")
+    parser.add_argument("--profile", default="", help="save sampled stacks to the folded file and print timings")
+    parser.add_argument("--json", action="store_true", help="print machine-readable result")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.record > 0:
+        record(args.path, args.record, args.calls)
+    profiler = Profiler(0.005, output=args.profile) if args.profile else None
+    results = []
+    for speed in [float(value) for value in args.speed.split(",")]:
+        for shards in [int(value) for value in args.shards.split(",")]:
+            for lazy_events in (False, True):
+                results.append(replay(args.path, speed, shards, lazy_events, profiler))
+    if args.json:
+        print(json.dumps(results))
+        return
+    print("%8s %7s %5s %9s %10s %10s %12s %9s" % ("speed", "shards", "lazy", "frames", "recorded s", "replay s",
+                                                  "frames/sec", "lag ms"))
+    for result in results:
+        print("%8s %7d %5s %9d %10.2f %10.2f %12d %9.1f" % (
+            result["speed"] or "max", result["shards"], "yes" if result["lazy_events"] else "no", result["frames"],
+            result["recorded_seconds"], result["seconds"], result["frames_per_sec"], result["lag_max"] * 1000))
+    if profiler is not None:
+        print(profiler.format_stat())
+
+
+if __name__ == '__main__':
+    main()
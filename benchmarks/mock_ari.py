@@ -0,0 +1,530 @@
+"""
+Mock Asterisk REST interface for benchmarks
+
+Serves ARI REST requests and /ari/events WebSocket and simulates channel lifecycle:
+ChannelCreated, ChannelStateChange, StasisStart, PlaybackStarted/Finished, StasisEnd, ChannelDestroyed...
+
+Usage:
+    python3 -m benchmarks.mock_ari [--port 8088] [--rest-latency 0.001] [--playback-duration 1]
+"""
+import argparse
+import base64
+import hashlib
+import heapq
+import http.server
+import itertools
+import json
+import logging
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+import urllib.parse
+import uuid
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def timestamp():
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000+0000", time.gmtime())
+
+
+class WsClient:
+
+    def __init__(self, connection, app):
+        self.connection = connection
+        self.app = app
+        self.closed = False
+        self._cs = threading.Lock()
+
+    def send(self, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x81, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x81, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, length)
+        with self._cs:
+            if self.closed:
+                return
+            try:
+                self.connection.sendall(header + payload)
+            except OSError:
+                self.closed = True
+
+
+class MockState:
+    """
+    Channels, bridges and playbacks of mock asterisk and scheduled events
+    """
+
+    def __init__(self, event_latency=0.0, answer_delay=0.0, playback_duration=1.0, noise_rate=0.0):
+        self.event_latency = event_latency
+        self.answer_delay = answer_delay
+        self.playback_duration = playback_duration
+        # Extra ChannelVarset events per second for every live channel
+        self.noise_rate = noise_rate
+        self.asterisk_id = "02:42:ac:11:00:02"
+        self.channels = {}
+        self.bridges = {}
+        self.playbacks = {}
+        self.clients = []
+        # App -> allowed event types
+        self.filters = {}
+        self.stat = {"rest_requests": 0, "events_sent": 0, "events_filtered": 0, "channels_created": 0}
+        self._cs = threading.Lock()
+        self._timers = []
+        self._seq = itertools.count()
+        self._timer_cs = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run_timers, name="mock-ari-events")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._timer_cs:
+            self._running = False
+            self._timer_cs.notify()
+        self._thread.join()
+
+    def schedule(self, delay, func, *args):
+        with self._timer_cs:
+            heapq.heappush(self._timers, (time.monotonic() + delay + self.event_latency, next(self._seq), func, args))
+            self._timer_cs.notify()
+
+    def _run_timers(self):
+        while True:
+            with self._timer_cs:
+                while self._running and (len(self._timers) == 0 or self._timers[0][0] > time.monotonic()):
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._timer_cs.wait(timeout)
+                if not self._running:
+                    return
+                _, _, func, args = heapq.heappop(self._timers)
+            func(*args)
+
+    def emit(self, event_type, fields):
+        event = {"type": event_type, "timestamp": timestamp(), "asterisk_id": self.asterisk_id}
+        event.update(fields)
+        # Channel events are sent to the Stasis app of the channel only, other events to every app
+        app = fields["channel"]["dialplan"]["app_data"] if "channel" in fields else None
+        for client in list(self.clients):
+            if client.closed:
+                self.clients.remove(client)
+                continue
+            if app is not None and client.app != app:
+                continue
+            # Event filter of the app, like asterisk does
+            allowed = self.filters.get(client.app)
+            if allowed is not None and event_type not in allowed:
+                self.stat["events_filtered"] += 1
+                continue
+            event["application"] = client.app
+            client.send(json.dumps(event).encode())
+            self.stat["events_sent"] += 1
+
+    def new_channel(self, channel_id, name, app, caller_number=""):
+        channel = {
+            "id": channel_id,
+            "name": name,
+            "state": "Down",
+            "caller": {"name": "", "number": caller_number},
+            "connected": {"name": "", "number": ""},
+            "accountcode": "",
+            "dialplan": {"context": "default", "exten": "s", "priority": 1,
+                         "app_name": "Stasis", "app_data": app},
+            "creationtime": timestamp(),
+            "language": "en",
+        }
+        with self._cs:
+            self.channels[channel_id] = channel
+            self.stat["channels_created"] += 1
+        return channel
+
+    def originate(self, channel_id, endpoint, app, caller_id):
+        # Dial string SIP/trunk/phone or PJSIP/phone@trunk
+        technology = endpoint.split("/")[0]
+        name = "%s/mock-%08x" % (technology, self.stat["channels_created"] + 1)
+        channel = self.new_channel(channel_id, name, app, caller_id)
+        self.schedule(0, self.emit, "ChannelCreated", {"channel": dict(channel)})
+        self.schedule(self.answer_delay, self.channel_up, channel_id)
+        return channel
+
+    def channel_up(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return
+        channel["state"] = "Up"
+        self.emit("ChannelStateChange", {"channel": dict(channel)})
+        self.emit("StasisStart", {"args": [], "channel": dict(channel)})
+        if self.noise_rate > 0:
+            self.schedule(1.0 / self.noise_rate, self.noise, channel_id)
+
+    def noise(self, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            return
+        self.emit("ChannelVarset", {"variable": "MOCK_NOISE", "value": "1", "channel": dict(channel)})
+        self.schedule(1.0 / self.noise_rate, self.noise, channel_id)
+
+    def snoop(self, channel_id, app):
+        if channel_id not in self.channels:
+            return None
+        snoop_id = "snoop-%s" % uuid.uuid4()
+        channel = self.new_channel(snoop_id, "Snoop/%s-%08x" % (channel_id, len(self.channels)), app)
+        channel["state"] = "Up"
+        self.schedule(0, self.emit, "StasisStart", {"args": [], "channel": dict(channel)})
+        return channel
+
+    def hangup(self, channel_id):
+        with self._cs:
+            channel = self.channels.pop(channel_id, None)
+        if channel is None:
+            return False
+        for bridge in self.bridges.values():
+            if channel_id in bridge["channels"]:
+                bridge["channels"].remove(channel_id)
+        self.schedule(0, self.emit, "StasisEnd", {"channel": dict(channel)})
+        self.schedule(0, self.emit, "ChannelDestroyed",
+                      {"cause": 16, "cause_txt": "Normal Clearing", "channel": dict(channel)})
+        return True
+
+    def create_bridge(self):
+        bridge = {
+            "id": str(uuid.uuid4()),
+            "technology": "simple_bridge",
+            "bridge_type": "mixing",
+            "bridge_class": "stasis",
+            "creator": "Stasis",
+            "name": "",
+            "channels": [],
+            "creationtime": timestamp(),
+        }
+        with self._cs:
+            self.bridges[bridge["id"]] = bridge
+        self.schedule(0, self.emit, "BridgeCreated", {"bridge": dict(bridge)})
+        return bridge
+
+    def add_to_bridge(self, bridge_id, channel_ids):
+        bridge = self.bridges.get(bridge_id)
+        if bridge is None:
+            return False
+        for channel_id in channel_ids:
+            channel = self.channels.get(channel_id)
+            if channel is not None:
+                bridge["channels"].append(channel_id)
+                self.schedule(0, self.emit, "ChannelEnteredBridge",
+                              {"bridge": dict(bridge), "channel": dict(channel)})
+        return True
+
+    def destroy_bridge(self, bridge_id):
+        with self._cs:
+            bridge = self.bridges.pop(bridge_id, None)
+        if bridge is None:
+            return False
+        self.schedule(0, self.emit, "BridgeDestroyed", {"bridge": dict(bridge)})
+        return True
+
+    def play(self, target, media):
+        playback = {
+            "id": str(uuid.uuid4()),
+            "media_uri": media,
+            "target_uri": target,
+            "language": "en",
+            "state": "playing",
+        }
+        with self._cs:
+            self.playbacks[playback["id"]] = playback
+        self.schedule(0, self.emit, "PlaybackStarted", {"playback": dict(playback)})
+        self.schedule(self.playback_duration, self.finish_playback, playback["id"])
+        return dict(playback, state="queued")
+
+    def finish_playback(self, playback_id):
+        with self._cs:
+            playback = self.playbacks.pop(playback_id, None)
+        if playback is None:
+            return False
+        playback["state"] = "done"
+        self.emit("PlaybackFinished", {"playback": playback})
+        return True
+
+
+class MockAriHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle would delay every response
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        ("GET", r"/ari/events", "events"),
+        ("GET", r"/ari/applications", "list_apps"),
+        ("PUT", r"/ari/applications/([^/]+)/eventFilter", "event_filter"),
+        ("GET", r"/ari/channels", "list_channels"),
+        ("POST", r"/ari/channels/([^/]+)/answer", "no_content"),
+        ("POST", r"/ari/channels/([^/]+)/ring", "no_content"),
+        ("DELETE", r"/ari/channels/([^/]+)/ring", "no_content"),
+        ("POST", r"/ari/channels/([^/]+)/record", "record"),
+        ("POST", r"/ari/channels/([^/]+)/snoop", "snoop"),
+        ("POST", r"/ari/channels/([^/]+)/play", "play_channel"),
+        ("POST", r"/ari/channels/([^/]+)", "create_channel"),
+        ("DELETE", r"/ari/channels/([^/]+)", "hangup"),
+        ("GET", r"/ari/bridges", "list_bridges"),
+        ("POST", r"/ari/bridges", "create_bridge"),
+        ("POST", r"/ari/bridges/([^/]+)/addChannel", "add_channel"),
+        ("POST", r"/ari/bridges/([^/]+)/removeChannel", "no_content"),
+        ("POST", r"/ari/bridges/([^/]+)/record", "record"),
+        ("POST", r"/ari/bridges/([^/]+)/play", "play_bridge"),
+        ("POST", r"/ari/bridges/([^/]+)/moh", "no_content"),
+        ("DELETE", r"/ari/bridges/([^/]+)/moh", "no_content"),
+        ("DELETE", r"/ari/bridges/([^/]+)", "destroy_bridge"),
+        ("GET", r"/ari/playbacks/([^/]+)", "get_playback"),
+        ("POST", r"/ari/playbacks/([^/]+)/control", "no_content"),
+        ("DELETE", r"/ari/playbacks/([^/]+)", "stop_playback"),
+    ]
+    ROUTES = [(method, re.compile("^%s$" % path), name) for method, path, name in ROUTES]
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections.add(self.connection)
+
+    def finish(self):
+        self.server.connections.discard(self.connection)
+        super().finish()
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def route(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        self.query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length", 0))
+        self.body = self.rfile.read(length) if length else b""
+        self.state.stat["rest_requests"] += 1
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match is not None:
+                if name != "events" and self.server.rest_latency > 0:
+                    time.sleep(self.server.rest_latency)
+                getattr(self, name)(*match.groups())
+                return
+        self.respond(404, {"message": "Resource not found"})
+
+    def respond(self, status, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.respond(404, {"message": "Object not found"})
+
+    def events(self):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        client = WsClient(self.connection, self.query.get("app", ""))
+        self.state.clients.append(client)
+        self.close_connection = True
+        # Read client frames until close
+        while not client.closed:
+            try:
+                head = self.rfile.read(2)
+                if len(head) < 2:
+                    break
+                length = head[1] & 0x7f
+                if length == 126:
+                    length = struct.unpack("!H", self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self.rfile.read(8))[0]
+                self.rfile.read(4 + length if head[1] & 0x80 else length)
+                if head[0] & 0x0f == 0x8:
+                    break
+            except OSError:
+                break
+        client.closed = True
+
+    def list_apps(self):
+        self.respond(200, [])
+
+    def event_filter(self, app):
+        allowed = json.loads(self.body or b"{}").get("allowed", [])
+        self.state.filters[app] = set(item["type"] for item in allowed) if allowed else None
+        self.respond(200, {"name": app, "events_allowed": allowed})
+
+    def list_channels(self):
+        self.respond(200, list(self.state.channels.values()))
+
+    def get_playback(self, playback_id):
+        playback = self.state.playbacks.get(playback_id)
+        if playback is None:
+            self.not_found()
+            return
+        self.respond(200, playback)
+
+    def list_bridges(self):
+        self.respond(200, list(self.state.bridges.values()))
+
+    def no_content(self, *args):
+        self.respond(204)
+
+    def create_channel(self, channel_id):
+        channel = self.state.originate(channel_id, self.query.get("endpoint", "SIP/mock"),
+                                       self.query.get("app", ""), self.query.get("callerId", ""))
+        self.respond(200, channel)
+
+    def hangup(self, channel_id):
+        if self.state.hangup(channel_id):
+            self.respond(204)
+        else:
+            self.not_found()
+
+    def snoop(self, channel_id):
+        channel = self.state.snoop(channel_id, self.query.get("app", ""))
+        if channel is None:
+            self.not_found()
+        else:
+            self.respond(200, channel)
+
+    def record(self, target_id):
+        self.respond(201, {"name": self.query.get("name", ""), "format": self.query.get("format", "wav"),
+                           "state": "queued", "target_uri": target_id})
+
+    def play_channel(self, channel_id):
+        if channel_id not in self.state.channels:
+            self.not_found()
+            return
+        self.respond(201, self.state.play("channel:%s" % channel_id, self.query.get("media", "")))
+
+    def create_bridge(self):
+        self.respond(200, self.state.create_bridge())
+
+    def add_channel(self, bridge_id):
+        if self.state.add_to_bridge(bridge_id, self.query.get("channel", "").split(",")):
+            self.respond(204)
+        else:
+            self.not_found()
+
+    def play_bridge(self, bridge_id):
+        if bridge_id not in self.state.bridges:
+            self.not_found()
+            return
+        self.respond(201, self.state.play("bridge:%s" % bridge_id, self.query.get("media", "")))
+
+    def destroy_bridge(self, bridge_id):
+        if self.state.destroy_bridge(bridge_id):
+            self.respond(204)
+        else:
+            self.not_found()
+
+    def stop_playback(self, playback_id):
+        if self.state.finish_playback(playback_id):
+            self.respond(204)
+        else:
+            self.not_found()
+
+
+class MockAriServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Usage:
+        server = MockAriServer(port=0, playback_duration=0.5)
+        server.start()
+        ari = Ari(server.url, "user", "secret", "app")
+        ...
+        server.stop()
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, rest_latency=0.0, event_latency=0.0, answer_delay=0.0,
+                 playback_duration=1.0, noise_rate=0.0):
+        super().__init__((host, port), MockAriHandler)
+        self.rest_latency = rest_latency
+        self.state = MockState(event_latency, answer_delay, playback_duration, noise_rate)
+        self.connections = set()
+        self._thread = None
+
+    @property
+    def url(self):
+        return "%s:%d" % self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-ari")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def drop_websockets(self):
+        """
+        Closes event websockets, events are lost until clients reconnect
+        """
+        for client in list(self.state.clients):
+            client.closed = True
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stop(self):
+        for client in list(self.state.clients):
+            client.closed = True
+        self.shutdown()
+        self.server_close()
+        # Open websockets and keep-alive connections are dropped like on asterisk crash
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.state.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="seconds before every REST response")
+    parser.add_argument("--event-latency", type=float, default=0.0, help="seconds before every event")
+    parser.add_argument("--answer-delay", type=float, default=0.0, help="seconds from originate to StasisStart")
+    parser.add_argument("--playback-duration", type=float, default=1.0, help="seconds of every playback")
+    parser.add_argument("--noise-rate", type=float, default=0.0, help="extra events per second per channel")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = MockAriServer(args.host, args.port, args.rest_latency, args.event_latency, args.answer_delay,
+                           args.playback_duration, args.noise_rate)
+    logging.info("mock ari listening on %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.state.stop()
+
+
+if __name__ == '__main__':
+    main()
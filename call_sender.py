@@ -1,5 +1,8 @@
+import logging
+import multiprocessing
 import ntpath
 import os
+import queue
 import signal
 import configparser
 import string
@@ -7,8 +10,30 @@ import sys
 import threading
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 from libraries.ari.ari import Ari
+from libraries.ari.cluster import AriCluster
+from libraries.ari.originate import OriginateReport
+from libraries.ari.profiler import Profiler
+from libraries.ari.stats import Histogram, Timeline
+from libraries.ari.tracing import CallTracer
+from libraries.cdr import CdrWriter
+from libraries.media import MediaCatalog, parse_mix
+from libraries.scenario import Scenario, format_timeline, merge_timelines, window_counts, write_timeline
+
+# Call lifecycle spans: name -> (start phase, end phase)
+CALL_SPANS = {
+    "create_channel_to_stasis_start": ("create_channel_sent", "stasis_start"),
+    "answer_to_bridge_ready": ("answer_done", "bridge_ready"),
+    "play_to_playback_started": ("play_sent", "playback_started"),
+    "play_to_playback_finished": ("play_sent", "playback_finished"),
+    "teardown": ("playback_finished", "teardown_done"),
+    "call": ("stasis_start", "teardown_done"),
+}
+# Phases saved in call detail records
+CDR_PHASES = ("create_channel_sent", "stasis_start", "answer_done", "bridge_ready", "play_sent",
+              "playback_started", "playback_finished", "teardown_done", "destroyed")
 
 
 def get_random_string(length):
@@ -19,131 +44,474 @@ def get_random_string(length):
 
 
 class Call:
+    """
+    Call scenario as a state machine, steps run on the Ari executor:
+    * originating - the channel entered Stasis, answer, bridges and snoop channel are requested at once
+    * answered - the channel is added to the sound bridge
+    * bridged - recording and playback of the bridge are requested
+    * recording - waits for the recording and playback responses
+    * playing - waits for PlaybackFinished
+    * tearing_down - channels and bridges are closed
+    * finished
+    A step is sent by pipeline.then() of the previous one, so no thread waits for a call
+    and a call is a small object whatever the count of simultaneous calls.
+    A failed step and ChannelDestroyed tear the call down, bridges and snoop channel
+    created after the teardown start are closed at once
+    """
+
+    STAT_KEYS = ("playback_started", "playback_finished", "answered", "bridge_created", "channel_added", "finished")
+    STATES = ("originating", "answered", "bridged", "recording", "playing", "tearing_down", "finished")
 
-    def __init__(self, channel, ari):
+    __slots__ = ("channel", "ari", "tracer", "media", "on_finish", "stat", "state", "bridges", "sound_bridge",
+                 "snoop_spy_channel", "started", "destroyed", "hung_up", "cause", "_state_cs")
+
+    def __init__(self, channel, ari, tracer, media, on_finish=None):
+        """
+        :param media: libraries.media.MediaFile to play
+        """
         self.channel = channel
         self.ari = ari
-        self.stat = {
-            "playback_started": 0,
-            "playback_finished": 0,
-            "answered": 0,
-            "bridge_created": 0,
-            "channel_added": 0,
-            "finished": 0,
-        }
-        self.start_thread = threading.Thread(target=self._start)
-        self.start_thread.daemon = True
+        self.tracer = tracer
+        self.media = media
+        self.on_finish = on_finish
+        self.stat = dict.fromkeys(self.STAT_KEYS, 0)
+        self.state = "originating"
         self.bridges = []
+        self.sound_bridge = None
         self.snoop_spy_channel = None
+        self.started = time.monotonic()
+        # Set by ChannelDestroyed, hung_up if it came before the teardown
+        self.destroyed = False
+        self.hung_up = False
+        self.cause = 0
+        self._state_cs = threading.Lock()
+
+    @property
+    def teardown_started(self):
+        return self.state in ("tearing_down", "finished")
+
+    def transition(self, state, expected=None):
+        """
+        :param expected: states the call may leave, e.g. a call in teardown is not set up further
+        :return: True if the call is switched to state
+        """
+        with self._state_cs:
+            if expected is not None and self.state not in expected:
+                return False
+            self.state = state
+            return True
+
+    def step(self, func, state):
+        """
+        :return: pipeline.then() callback which calls func(pipeline) in state
+        if the previous step succeeded and the call is not torn down
+        """
+        def run(pipeline):
+            if self.teardown_started:
+                # Errors of requests to a hung up channel are expected
+                return
+            try:
+                errors = pipeline.errors()
+                if len(errors) > 0:
+                    raise errors[0]
+                if self.transition(state, self.STATES[:self.STATES.index(state)]):
+                    func(pipeline)
+            except Exception as ex:
+                self.fail(ex)
+        return run
+
+    def fail(self, error):
+        logging.error("call %s error in %s: %s" % (self.channel.id, self.state, str(error)))
+        try:
+            self.teardown()
+        except Exception as ex:
+            # The executor is shut down on exit
+            logging.error("teardown error: %s" % str(ex))
+
+    def playback_started(self, ari, event, playback):
+        self.mark("playback_started")
 
     def playback_finished(self, ari, event, playback):
-        print("playback finished")
+        logging.debug("call %s playback finished" % self.channel.id)
+        self.mark("playback_finished")
         self.stat["playback_finished"] = 1
-        self.channel.close()
-        self.snoop_spy_channel.close()
+        self.teardown()
+
+    def teardown(self):
+        """
+        Closes channels and bridges of the call once, on playback finish, on hangup by a scenario or on error
+        """
+        if not self.transition("tearing_down", self.STATES[:self.STATES.index("tearing_down")]):
+            return
+        # Teardown requests are sent at once and the dispatch thread doesn't wait for them
+        pipeline = self.ari.pipeline()
+        if not self.destroyed:
+            pipeline.submit(self.timed, "close_channel", self.channel.close)
+        if self.snoop_spy_channel is not None:
+            pipeline.submit(self.timed, "close_snoop", self.snoop_spy_channel.close)
         for bridge in self.bridges:
-            bridge.close()
+            pipeline.submit(self.timed, "close_bridge", bridge.close)
+        pipeline.then(self.teardown_done)
+
+    def teardown_done(self, pipeline):
+        for error in pipeline.errors():
+            logging.error("teardown error: %s" % str(error))
+        self.mark("teardown_done")
         self.stat["finished"] = 1
+        self.transition("finished")
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def mark(self, phase):
+        # The trace is started by StasisStart, marks after it is recorded (e.g. of late responses) are dropped
+        self.tracer.mark(self.channel.id, phase, create=False)
+
+    def timed(self, name, func, *args):
+        with self.tracer.timed(self.channel.id, name, create=False):
+            return func(*args)
+
+    def create(self, name, func, *args):
+        """
+        Runs timed func which creates a bridge or the snoop channel.
+        The result is closed by teardown or at once if the teardown has already started
+        """
+        model = self.timed(name, func, *args)
+        if model is None:
+            return model
+        with self._state_cs:
+            late = self.teardown_started
+            if not late and name == "snoop":
+                self.snoop_spy_channel = model
+            elif not late:
+                self.bridges.append(model)
+        if late:
+            self.timed("close_snoop" if name == "snoop" else "close_bridge", model.close)
+        return model
 
     def start(self):
-        self.start_thread.start()
+        # Bridges and snoop channel don't depend on the answer, so they are created together
+        pipeline = self.ari.pipeline()
+        pipeline.submit(self.timed, "answer", self.channel.answer)
+        pipeline.submit(self.create, "create_bridge", self.ari.create_bridge)
+        pipeline.submit(self.create, "create_bridge", self.ari.create_bridge)
+        pipeline.submit(self.create, "snoop", self.channel.snoop)
+        pipeline.then(self.step(self._answered, "answered"))
 
-    def _start(self):
-        self.channel.answer()
+    def _answered(self, pipeline):
+        self.sound_bridge = pipeline.futures[1].result()
         self.stat["answered"] = 1
-        sound_bridge = self.ari.create_bridge()
-        self.bridges.append(sound_bridge)
         self.stat["bridge_created"] = 1
-        sound_bridge.add_channels([self.channel.id])
+        pipeline = self.ari.pipeline()
+        pipeline.submit(self.timed, "add_channels", self.sound_bridge.add_channels, [self.channel.id])
+        pipeline.then(self.step(self._bridged, "bridged"))
+
+    def _bridged(self, pipeline):
+        self.mark("bridge_ready")
         self.stat["channel_added"] = 1
-        file_name = "mid_sound"
-        storage_path = os.path.dirname(os.path.abspath(__file__)) + '/sounds'
-        sound = "%s/%s" % (storage_path, file_name)
+        if not self.transition("recording", ("bridged",)):
+            return
         record_name = get_random_string(20)
-        sound_bridge.record("test_" + record_name)
-        media_bridge = self.ari.create_bridge()
-        self.bridges.append(media_bridge)
-        self.snoop_spy_channel = self.channel.snoop()
-        playback = sound_bridge.play("sound:%s" % sound)
+        pipeline = self.ari.pipeline()
+        pipeline.submit(self.timed, "record", self.sound_bridge.record, "test_" + record_name)
+        pipeline.submit(self.timed, "play", self.sound_bridge.play, self.media.uri)
+        pipeline.then(self.step(self._playing, "playing"))
+
+    def _playing(self, pipeline):
+        playback = pipeline.futures[1].result()
         self.stat["playback_started"] = 1
+        playback.append_callback("PlaybackStarted", self.playback_started)
         playback.append_callback("PlaybackFinished", self.playback_finished)
 
 
 class CallManager:
 
-    def __init__(self, ari):
+    def __init__(self, ari, config_file="configs/calls.ini", worker=0, workers=1):
+        """
+        :param worker: index of worker process, see CallSupervisor
+        :param workers: count of worker processes, every worker keeps its share of calls
+        and creates every workers-th channel id
+        """
         self.ari = ari
-        config_file = "configs/calls.ini"
         config_obj = configparser.ConfigParser()
         config_obj.readfp(open(config_file))
-        self.calls_count = int(config_obj.get("calls", "count"))
+        count = int(config_obj.get("calls", "count"))
+        self.worker = worker
+        self.workers = workers
+        self.calls_count = count // workers + (1 if worker < count % workers else 0)
         self.semaphore = threading.Semaphore(int(self.calls_count))
         self.driver = config_obj.get("calls", "driver")
         self.trunk = config_obj.get("calls", "trunk")
         self.phone = config_obj.get("calls", "phone")
         self.callerid = config_obj.get("calls", "callerid")
-        self.calls = []
+        # Calls per second, 0 is unlimited
+        self.cps = config_obj.getfloat("calls", "cps", fallback=0)
+        self.originate_concurrency = config_obj.getint("calls", "originate_concurrency", fallback=10)
+        self.originate_report = None
+        self.tracer = CallTracer(CALL_SPANS)
+        # Seconds between latency dumps, 0 - only at exit
+        self.trace_interval = config_obj.getfloat("calls", "trace_interval", fallback=0)
+        # Port of Prometheus /metrics endpoint and seconds between stats lines, 0 - disabled
+        self.metrics_port = config_obj.getint("calls", "metrics_port", fallback=0)
+        if self.metrics_port > 0:
+            self.metrics_port += worker
+        self.stats_interval = config_obj.getfloat("calls", "stats_interval", fallback=0)
+        # Load scenario of all workers instead of count simultaneous calls, see libraries.scenario
+        self.scenario = Scenario.from_config(config_obj, "calls", count)
+        self.timeline = None
+        self.timeline_interval = config_obj.getfloat("calls", "timeline_interval", fallback=1)
+        self.timeline_file = self.worker_file(config_obj.get("calls", "timeline_file", fallback=""))
+        # Channel ids sent by the scenario and not destroyed yet
+        self.channels = set()
+        self.destroyed_calls = 0
+        # Sounds are scanned once, calls get a file of the mix and its uri without filesystem access
+        sounds_dir = config_obj.get("calls", "sounds_dir",
+                                    fallback=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds"))
+        self.media = MediaCatalog(sounds_dir, parse_mix(config_obj.get("calls", "media", fallback="mid_sound")))
+        self.metrics = ari.metrics
+        self._sent_counter = self.metrics.counter("calls_sent_total", "Channels created")
+        self._started_counter = self.metrics.counter("calls_started_total", "Calls entered Stasis")
+        self._finished_counter = self.metrics.counter("calls_finished_total", "Calls finished")
+        self.metrics.gauge("calls_target", "Simultaneous calls to keep", func=lambda: self.calls_count)
+        self.metrics.gauge("calls_active", "Calls entered Stasis and not finished yet",
+                           func=lambda: self._started_counter.get() - self._finished_counter.get())
+        self.metrics.gauge("calls_expected_hold_seconds", "Mean playback duration of the media mix",
+                           func=self.media.expected_duration)
+        # Call detail records of finished calls, see libraries.cdr
+        self.cdr = None
+        cdr_file = self.worker_file(config_obj.get("calls", "cdr_file", fallback=""))
+        if cdr_file:
+            self.cdr = CdrWriter(cdr_file, CDR_PHASES)
+        # Live calls by channel id, finished calls are dropped and only their stat is kept
+        self.calls = {}
+        self._calls_cs = threading.Lock()
+        self._finished_stat = dict.fromkeys(Call.STAT_KEYS, 0)
         self.sent_calls = 0
         self._terminate = False
         self.run_thread = None
 
+    def worker_file(self, path):
+        """
+        :return: path with "-<worker>" before the extension if there are several workers
+        """
+        if not path or self.workers == 1:
+            return path
+        name, extension = os.path.splitext(path)
+        return "%s-%d%s" % (name, self.worker, extension)
+
     def start_call(self, ari, event):
         channel = event.channel
         if channel.protocol in ["PJSIP", "SIP"]:
-            call = Call(channel, ari)
-            self.calls.append(call)
+            self.tracer.mark(channel.id, "stasis_start")
+            self._started_counter.inc()
+            call = Call(channel, ari, self.tracer, self.media.choose(), self.call_finished)
+            with self._calls_cs:
+                self.calls[channel.id] = call
             call.start()
 
+    def call_finished(self, call):
+        # Teardown may finish before or after ChannelDestroyed, the call is recorded after both
+        with self._calls_cs:
+            destroyed = call.destroyed
+        if destroyed:
+            self.drop_call(call, "hangup" if call.hung_up else "completed")
+
     def end_call(self, ari, event):
         channel = event.channel
         if channel.protocol in ["PJSIP", "SIP"]:
+            self.tracer.mark(channel.id, "destroyed")
             self.semaphore.release()
+            with self._calls_cs:
+                self.destroyed_calls += 1
+                self.channels.discard(channel.id)
+                call = self.calls.get(channel.id)
+                if call is not None:
+                    call.destroyed = True
+                    call.cause = event.cause
+            if call is None:
+                self.record(channel.id, "unanswered", event.cause)
+            elif call.stat["finished"]:
+                self.drop_call(call, "completed")
+            elif not call.teardown_started:
+                # Remaining setup steps are not sent, bridges and snoop channel of the dead channel are closed.
+                # The call is recorded by call_finished after teardown_done, so its trace is finished last
+                call.hung_up = True
+                call.teardown()
+
+    def drop_call(self, call, outcome):
+        """
+        Records the finished call and forgets it, only once per call
+        """
+        with self._calls_cs:
+            if self.calls.pop(call.channel.id, None) is None:
+                return
+            for key in Call.STAT_KEYS:
+                self._finished_stat[key] += call.stat[key]
+        self._finished_counter.inc()
+        self.record(call.channel.id, outcome, call.cause, call.media.name)
+
+    def record(self, channel_id, outcome, cause=0, media=""):
+        marks = self.tracer.finish(str(channel_id))
+        if self.cdr is not None:
+            self.cdr.write(channel_id, outcome, marks, cause, media)
 
     def create_channel(self, channel_id, dial_string, caller_id):
         try:
-            self.ari.create_channel(channel_id, dial_string, caller_id)
+            with self.tracer.timed(str(channel_id), "create_channel"):
+                self.ari.create_channel(channel_id, dial_string, caller_id)
             self.sent_calls += 1
+            self._sent_counter.inc()
         except Exception as ex:
-            print("create channel error: %s" % str(ex))
+            logging.error("create channel error: %s" % str(ex))
+            with self._calls_cs:
+                self.channels.discard(str(channel_id))
+            self.record(channel_id, "failed")
             self.semaphore.release()
 
-    def send_call(self, channel_id, driver, trunk, phone, caller_id):
+    @staticmethod
+    def get_dial_string(driver, trunk, phone):
         if driver == "PJSIP":
-            dial_string = "%s/%s@%s" % (driver, phone, trunk)
+            return "%s/%s@%s" % (driver, phone, trunk)
         else:
-            dial_string = "%s/%s/%s" % (driver, trunk, phone)
-        sending_thread = threading.Thread(target=self.create_channel,
-                                          args=(channel_id,
-                                                dial_string,
-                                                caller_id))
-        sending_thread.daemon = True
+            return "%s/%s/%s" % (driver, trunk, phone)
+
+    def send_call(self, executor, channel_id, driver, trunk, phone, caller_id):
+        """
+        :param executor: executor of channel creation, its size limits requests at once
+        :return: concurrent.futures.Future of the request
+        """
+        dial_string = self.get_dial_string(driver, trunk, phone)
         self.semaphore.acquire()
-        sending_thread.start()
-        return sending_thread
+        return executor.submit(self.create_channel, channel_id, dial_string, caller_id)
+
+    def plan(self):
+        """
+        :return: expected hold time of a call and finished calls per second the calls count can sustain
+        """
+        hold_time = self.media.expected_duration()
+        return {
+            "hold_time": hold_time,
+            "max_cps": self.calls_count / hold_time,
+            "concurrency_needed": self.cps * hold_time,
+        }
 
     def run_async(self):
-        self.run_thread = threading.Thread(target=self.run)
+        plan = self.plan()
+        logging.info("media mix %s, expected hold time %.2f s, %d calls sustain %.2f cps" % (
+            self.media.mix, plan["hold_time"], self.calls_count, plan["max_cps"]))
+        if 0 < self.calls_count < plan["concurrency_needed"]:
+            logging.warning("cps %.2f needs %d simultaneous calls, count %d limits it to %.2f cps" % (
+                self.cps, plan["concurrency_needed"] + 1, self.calls_count, plan["max_cps"]))
+        self.tracer.start_dump(self.trace_interval)
+        if self.metrics_port > 0:
+            self.metrics.start_server(self.metrics_port)
+        if self.stats_interval > 0:
+            self.metrics.start_log(self.stats_interval)
+        self.run_thread = threading.Thread(target=self.run, name="call-manager")
         self.run_thread.daemon = True
         self.run_thread.start()
 
     def run(self):
         self.ari.append_callback("StasisStart", self.start_call)
         self.ari.append_callback("ChannelDestroyed", self.end_call)
-        call_num = 1
-        while not self._terminate:
-            self.send_call(call_num, self.driver, self.trunk, self.phone, self.callerid)
-            call_num += 1
-            
+        if self.scenario is not None:
+            self.run_scenario()
+            return
+        if self.cps > 0:
+            self.originate_report = OriginateReport()
+            self.ari.originate_many(self.generate_calls(), self.cps, self.originate_concurrency,
+                                    self.call_originated, self.originate_report)
+            return
+        call_num = self.worker + 1
+        with ThreadPoolExecutor(max_workers=self.originate_concurrency) as executor:
+            while not self._terminate:
+                self.send_call(executor, call_num, self.driver, self.trunk, self.phone, self.callerid)
+                call_num += self.workers
+
+    def run_scenario(self, tick=0.05):
+        """
+        Keeps live channels at the scenario target of this worker:
+        creates missing channels, hangs up calls above the target and calls older than scenario hold.
+        REST latency and live channels are saved to timeline
+        """
+        logging.info("scenario %s for %d seconds, peak %d calls" % (
+            self.scenario.profile, self.scenario.duration, self.scenario.peak))
+        self.timeline = Timeline(self.timeline_interval)
+        self.ari.rest_timeline = self.timeline
+        dial_string = self.get_dial_string(self.driver, self.trunk, self.phone)
+        call_num = self.worker + 1
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.originate_concurrency) as executor:
+            while not self._terminate:
+                now = time.monotonic()
+                if self.scenario.finished(now - started):
+                    break
+                target = self.scenario.target(now - started)
+                target = target // self.workers + (1 if self.worker < target % self.workers else 0)
+                with self._calls_cs:
+                    live = len(self.channels)
+                    calls = list(self.calls.values())
+                # Calls in teardown are live until ChannelDestroyed
+                excess = live - target - sum(1 for call in calls if call.teardown_started)
+                for call in calls:
+                    # Calls are hung up after setup, so teardown closes all their bridges
+                    if call.teardown_started or not call.stat["playback_started"]:
+                        continue
+                    if excess > 0 or 0 < self.scenario.hold < now - call.started:
+                        call.teardown()
+                        excess -= 1
+                for _ in range(target - live):
+                    with self._calls_cs:
+                        self.channels.add(str(call_num))
+                    executor.submit(self.create_channel, call_num, dial_string, self.callerid)
+                    call_num += self.workers
+                self.timeline.set("target", target)
+                self.timeline.set("live", live)
+                self.timeline.set("created", self._sent_counter.get())
+                self.timeline.set("destroyed", self.destroyed_calls)
+                time.sleep(tick)
+        logging.info("scenario %s is finished" % self.scenario.profile)
+        if self.timeline_file:
+            write_timeline(self.timeline_file, self.timeline_rows())
+
+    def timeline_rows(self):
+        """
+        :return: scenario timeline with created and destroyed channels of every window
+        """
+        if self.timeline is None:
+            return None
+        return window_counts(self.timeline.rows())
+
+    def finished(self):
+        """
+        :return: True when the scenario is finished, calls of count mode are never finished
+        """
+        return self.scenario is not None and self.run_thread is not None and not self.run_thread.is_alive()
+
+    def generate_calls(self):
+        dial_string = self.get_dial_string(self.driver, self.trunk, self.phone)
+        call_num = self.worker + 1
+        while True:
+            self.semaphore.acquire()
+            if self._terminate:
+                return
+            self.tracer.mark(str(call_num), "create_channel_sent")
+            yield {"channel_id": call_num, "endpoint": dial_string, "caller_id": self.callerid}
+            call_num += self.workers
+
+    def call_originated(self, call, channel, error):
+        if error is None:
+            self.sent_calls += 1
+            self._sent_counter.inc()
+        else:
+            logging.error("create channel error: %s" % str(error))
+            self.record(call["channel_id"], "failed")
+            self.semaphore.release()
+
     def get_stat(self):
-        result = {
-            "playback_started": 0,
-            "playback_finished": 0,
-            "answered": 0,
-            "bridge_created": 0,
-            "channel_added": 0,
-            "finished": 0,
-        }
-        for call in self.calls:
+        with self._calls_cs:
+            result = dict(self._finished_stat)
+            calls = list(self.calls.values())
+        for call in calls:
             for stat_key in result.keys():
                 result[stat_key] += call.stat[stat_key]
         return result
@@ -153,33 +521,259 @@ class CallManager:
         self.semaphore.release()
         if self.run_thread:
             self.run_thread.join()
+        self.tracer.stop_dump()
+        self.metrics.stop()
+        if self.cdr is not None:
+            self.cdr.close()
+
+    def get_report(self):
+        """
+        :return: picklable stat, reports of worker processes are merged by merge_reports
+        """
+        report = {
+            "sent_calls": self.sent_calls,
+            "stat": self.get_stat(),
+            "spans": dict(self.tracer.histograms),
+            "originate": None,
+            "timeline": self.timeline_rows(),
+        }
+        if self.originate_report is not None:
+            stat = self.originate_report.get_stat()
+            report["originate"] = {
+                "failed": stat["failed"],
+                "cps": stat["cps"],
+                "latency": self.originate_report.latency,
+            }
+        return report
 
     def print_stat(self):
-        stat = self.get_stat()
-        print("sent_calls:\t%d" % self.sent_calls)
-        for key, value in stat.items():
-            print("%s:\t%d" % (key, value))
+        print_report(self.get_report())
 
 
-def main():
-    global terminate
-    terminate = False
-    config_file = "configs/asterisk.ini"
+def merge_reports(reports):
+    result = {
+        "sent_calls": 0,
+        "stat": {},
+        "spans": {},
+        "originate": None,
+        "timeline": None,
+    }
+    timelines = []
+    for report in reports:
+        result["sent_calls"] += report["sent_calls"]
+        for key, value in report["stat"].items():
+            result["stat"][key] = result["stat"].get(key, 0) + value
+        for name, histogram in report["spans"].items():
+            result["spans"].setdefault(name, Histogram()).merge(histogram)
+        if report["originate"] is not None:
+            if result["originate"] is None:
+                result["originate"] = {"failed": 0, "cps": 0.0, "latency": Histogram()}
+            result["originate"]["failed"] += report["originate"]["failed"]
+            result["originate"]["cps"] += report["originate"]["cps"]
+            result["originate"]["latency"].merge(report["originate"]["latency"])
+        if report.get("timeline") is not None:
+            timelines.append(report["timeline"])
+    if len(timelines) > 0:
+        result["timeline"] = merge_timelines(timelines)
+    return result
+
+
+def print_report(report):
+    print("sent_calls:\t%d" % report["sent_calls"])
+    for key, value in report["stat"].items():
+        print("%s:\t%d" % (key, value))
+    if report["originate"] is not None:
+        print("originate_failed:\t%d" % report["originate"]["failed"])
+        print("originate_cps:\t%.2f" % report["originate"]["cps"])
+        for percent in (50, 95, 99):
+            print("originate_latency_p%d:\t%.3f" % (percent, report["originate"]["latency"].percentile(percent)))
+    tracer = CallTracer(CALL_SPANS)
+    tracer.merge(report["spans"])
+    print(tracer.format_stat())
+    if report.get("timeline") is not None:
+        print("scenario timeline:")
+        print(format_timeline(report["timeline"]))
+
+
+class CallSupervisor:
+    """
+    Runs CallManager in forked worker processes, so event parsing and callbacks
+    of different workers don't share one GIL.
+    Every worker has its own Ari connection and Stasis app "<app>-<worker>",
+    its share of calls count and every workers-th channel id.
+    Workers send reports to the supervisor by a queue every stats_interval seconds and on exit
+    """
+
+    def __init__(self, workers, ari_config="configs/asterisk.ini", calls_config="configs/calls.ini",
+                 stats_interval=0):
+        self.workers = workers
+        self.stats_interval = stats_interval
+        context = multiprocessing.get_context("fork")
+        self._stop = context.Event()
+        self._reports = context.Queue()
+        self.processes = []
+        for worker in range(workers):
+            process = context.Process(target=run_worker, name="call-worker-%d" % worker,
+                                      args=(worker, workers, ari_config, calls_config, stats_interval,
+                                            self._stop, self._reports))
+            process.daemon = True
+            self.processes.append(process)
+        self.reports = {}
+        self._finished = set()
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def poll(self, timeout):
+        """
+        Receives reports of workers for timeout seconds
+        :return: True if any report is received
+        """
+        received = False
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                kind, worker, report = self._reports.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return received
+            self.reports[worker] = report
+            if kind == "final":
+                self._finished.add(worker)
+            received = True
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        while len(self._finished) < self.workers and time.monotonic() < deadline:
+            if not any(process.is_alive() for process in self.processes) and self._reports.empty():
+                break
+            self.poll(0.5)
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.error("%s doesn't stop, terminate it" % process.name)
+                process.terminate()
+        missing = set(range(self.workers)) - self._finished
+        if len(missing) > 0:
+            logging.error("no final report from workers %s" % sorted(missing))
+
+    def running(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def get_report(self):
+        return merge_reports(self.reports.values())
+
+
+def run_worker(worker, workers, ari_config, calls_config, stats_interval, stop, reports):
+    # The supervisor stops workers by stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    ari_client = create_ari(ari_config, worker if workers > 1 else None)
+    ari_client.run()
+    call_manager = CallManager(ari_client, calls_config, worker, workers)
+    call_manager.run_async()
+    # A worker stops by itself when its scenario is finished
+    last_report = time.monotonic()
+    while not stop.wait(1) and not call_manager.finished():
+        if stats_interval > 0 and time.monotonic() - last_report >= stats_interval:
+            last_report = time.monotonic()
+            reports.put(("stat", worker, call_manager.get_report()))
+    call_manager.terminate()
+    reports.put(("final", worker, call_manager.get_report()))
+    ari_client.close()
+    if ari_client.profiler is not None:
+        logging.info("worker %d profile:\n%s" % (worker, ari_client.profiler.format_stat()))
+
+
+def create_ari(config_file="configs/asterisk.ini", worker=None):
+    """
+    :param worker: index of worker process, its Stasis app is "<app>-<worker>"
+    :return: Ari or AriCluster if several hosts are set
+    """
     config_obj = configparser.ConfigParser()
     config_obj.readfp(open(config_file))
-    ari_host = config_obj.get("ari", "host")
-    ari_port = config_obj.get("ari", "port")
     ari_user = config_obj.get("ari", "username")
     ari_secret = config_obj.get("ari", "secret")
     ari_app = config_obj.get("ari", "app")
-    ari_client = Ari("%s:%s" % (ari_host, ari_port), ari_user, ari_secret, ari_app)
+    if worker is not None:
+        ari_app = "%s-%d" % (ari_app, worker)
+    dispatch_shards = config_obj.getint("ari", "dispatch_shards", fallback=1)
+    lazy_events = config_obj.getboolean("ari", "lazy_events", fallback=False)
+    keep_model_data = config_obj.getboolean("ari", "keep_model_data", fallback=True)
+    models_ttl = config_obj.getfloat("ari", "models_ttl", fallback=3600)
+    models_max_size = config_obj.getint("ari", "models_max_size", fallback=100000)
+    # Log of raw events for recorder.Replayer, empty disables it
+    record_events = config_obj.get("ari", "record_events", fallback="")
+    if record_events and worker is not None:
+        name, extension = os.path.splitext(record_events)
+        record_events = "%s-%d%s" % (name, worker, extension)
+    profiler = None
+    if config_obj.getboolean("ari", "profile", fallback=False):
+        # Folded stacks for flamegraph.pl or speedscope, empty disables sampling
+        profile_output = config_obj.get("ari", "profile_output", fallback="")
+        if profile_output and worker is not None:
+            name, extension = os.path.splitext(profile_output)
+            profile_output = "%s-%d%s" % (name, worker, extension)
+        sample_interval = config_obj.getfloat("ari", "profile_sample_interval", fallback=0.01)
+        profiler = Profiler(sample_interval if profile_output else 0, output=profile_output)
+    # Comma separated host:port with optional *weight of cluster nodes
+    hosts = config_obj.get("ari", "hosts", fallback="")
+    if hosts:
+        nodes = []
+        for host in hosts.split(","):
+            url, _, weight = host.strip().partition("*")
+            nodes.append((url, int(weight or 1)))
+        strategy = config_obj.get("ari", "strategy", fallback="least_active")
+        ari_client = AriCluster(nodes, ari_user, ari_secret, ari_app, strategy=strategy,
+                                dispatch_shards=dispatch_shards, lazy_events=lazy_events,
+                                keep_model_data=keep_model_data, models_ttl=models_ttl,
+                                models_max_size=models_max_size, record_events=record_events)
+    else:
+        ari_host = config_obj.get("ari", "host")
+        ari_port = config_obj.get("ari", "port")
+        ari_client = Ari("%s:%s" % (ari_host, ari_port), ari_user, ari_secret, ari_app,
+                         dispatch_shards=dispatch_shards, lazy_events=lazy_events, keep_model_data=keep_model_data,
+                         models_ttl=models_ttl, models_max_size=models_max_size, record_events=record_events)
+    if profiler is not None:
+        ari_client.enable_profiler(profiler=profiler)
+    return ari_client
+
+
+def main():
+    global terminate
+    terminate = False
+    calls_config = "configs/calls.ini"
+    config_obj = configparser.ConfigParser()
+    config_obj.readfp(open(calls_config))
+    # DEBUG logs every event and response payload, it is slow under load
+    logging.basicConfig(format=u'%(filename)s[LINE:%(lineno)d]# %(levelname)-8s [%(asctime)s]  %(message)s',
+                        level=config_obj.get("calls", "log_level", fallback="INFO").upper())
+    # Worker processes, 1 runs calls in this process
+    workers = config_obj.getint("calls", "workers", fallback=1)
+    if workers > 1:
+        stats_interval = config_obj.getfloat("calls", "stats_interval", fallback=0)
+        supervisor = CallSupervisor(workers, calls_config=calls_config, stats_interval=stats_interval)
+        supervisor.start()
+        while not terminate and supervisor.running():
+            if supervisor.poll(3) and stats_interval > 0:
+                report = supervisor.get_report()
+                logging.info("workers: %d sent_calls: %d finished: %d" % (
+                    workers, report["sent_calls"], report["stat"].get("finished", 0)))
+        supervisor.stop()
+        print_report(supervisor.get_report())
+        return
+    ari_client = create_ari()
     ari_client.run()
-    call_manager = CallManager(ari_client)
+    call_manager = CallManager(ari_client, calls_config)
     call_manager.run_async()
-    while not terminate:
-        time.sleep(3)
+    while not terminate and not call_manager.finished():
+        time.sleep(1)
     call_manager.terminate()
     call_manager.print_stat()
+    if ari_client.profiler is not None:
+        ari_client.profiler.stop()
+        print(ari_client.profiler.format_stat())
 
 
 def exit_gracefully(signum, frame):
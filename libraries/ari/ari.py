@@ -1,20 +1,45 @@
 import base64
 import json
-import queue
+import random
 import sys
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import websocket
 import threading
-import http.client
 import logging
 
 from . import models
 from . import events
+from .cache import ModelCache
+from .codec import get_codec
+from .dispatcher import ShardedDispatcher
+from .metrics import Registry
+from .originate import originate_many
+from .pipeline import Pipeline
+from .profiler import Profiler, endpoint
+from .pool import ConnectionPool
+from .recorder import EventRecorder
+
+
+class Backoff:
+    """
+    Jittered exponential delays: every delay is random in [delay / 2, delay], delay doubles up to max_delay
+    """
+
+    def __init__(self, min_delay, max_delay):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._delay = min_delay
 
-logging.basicConfig(format=u'%(filename)s[LINE:%(lineno)d]# %(levelname)-8s [%(asctime)s]  %(message)s',
-                    level=logging.DEBUG)
+    def next(self):
+        delay = self._delay
+        self._delay = min(self._delay * 2, self.max_delay)
+        return random.uniform(delay / 2.0, delay)
+
+    def reset(self):
+        self._delay = self.min_delay
 
 
 class Ari:
@@ -28,7 +53,11 @@ class Ari:
 
     RETRY_TIMEOUT = 1
     MAX_RETRIES = 10
-    # If you want to add new event handler - you have to first add it here
+    REQUEST_TIMEOUT = 10
+    # WebSocket reconnect delays
+    RECONNECT_MIN_TIMEOUT = 0.01
+    RECONNECT_MAX_TIMEOUT = 5
+    # Events of the server filter are taken from callbacks, this list is kept for compatibility
     AVAILABLE_EVENTS = [
             "StasisStart",
             "Dial",
@@ -40,66 +69,175 @@ class Ari:
             "ChannelDtmfReceived"
         ]
 
-    def __init__(self, url, user, password, app, event_callbacks={}):
+    def __init__(self, url, user, password, app, event_callbacks=None, pool_size=10, pool_idle_timeout=30,
+                 dispatch_shards=1, lazy_events=False, codec=None, keep_model_data=True, metrics=None,
+                 models_ttl=3600, models_max_size=100000, record_events=None):
         self.url = url
         self.user = user
         self.password = password
         self.app = app
         self._opened = False
+        self._open_count = 0
         self._closed = False
+        self._close_event = threading.Event()
         self._run_thread = None
-        self._cb_thread = None
+        # Lazy events are parsed only if some callback uses them
+        self.lazy_events = lazy_events
+        # Models don't keep raw json if False
+        self.keep_model_data = keep_model_data
+        self.codec = get_codec(codec) if codec is None or isinstance(codec, str) else codec
+        # Events of callbacks and finish events of models, asterisk sends only them
         self._allowed_events = set()
-        self._cb_queue = queue.Queue()
-        for event in event_callbacks:
-            self.add_filter(event)
-        for event in self.AVAILABLE_EVENTS:
+        self._synced_events = None
+        self._filter_cs = threading.Lock()
+        self._filter_sync_cs = threading.Lock()
+        self._init_transport(pool_size, pool_idle_timeout, dispatch_shards)
+        for event in event_callbacks or ():
             self.add_filter(event)
-        self._event_callbacks = event_callbacks
+        # Own copy, so Ari instances don't share callbacks of a default or caller's dict
+        self._event_callbacks = dict((event, list(funcs)) for event, funcs in (event_callbacks or {}).items())
+        # event -> model id -> callbacks and reverse index model id -> events
         self._models_callbacks = {}
+        self._models_callbacks_index = {}
         self._callback_cs = threading.Lock()
-        self.models = {"Channel": {},
-                       "Bridge": {},
-                       "Playback": {}}
-        for model in self.models.keys():
-            cls = getattr(models, model)
-            for event in cls.finish_events:
-                self.add_filter(event)
+        # Models are evicted after models_ttl idle seconds or above models_max_size of a type,
+        # models with callbacks are kept
+        self.models = dict((name, ModelCache(models_ttl, models_max_size, self.is_pinned))
+                           for name in ("Channel", "Bridge", "Playback"))
+        for event in models.FINISH_ROUTES:
+            self.add_filter(event)
         self._auth_header = "Basic %s" % (base64.b64encode(
             ("%s:%s" % (self.user, self.password)).encode()).decode())
         self._ws = None
         self.ws_running = False
+        self.metrics = metrics if metrics is not None else Registry()
+        # stats.Timeline of REST latency, e.g. of a load scenario
+        self.rest_timeline = None
+        # Raw WebSocket frames are saved to record_events log, see recorder.Replayer
+        self.recorder = EventRecorder(record_events) if record_events else None
+        # profiler.Profiler of decode, dispatch, REST and lock waits, see enable_profiler
+        self.profiler = None
+        self._init_metrics()
+
+    def _init_transport(self, pool_size, pool_idle_timeout, dispatch_shards):
+        """
+        Creates REST connection pool and event dispatcher, AsyncAri creates asyncio ones instead
+        """
+        self._dispatcher = ShardedDispatcher(self.send_callback, dispatch_shards)
+        self._pool = ConnectionPool(self.url, pool_size, pool_idle_timeout, self.REQUEST_TIMEOUT)
+        # Runs pipelined requests, one worker per pooled connection
+        self._executor = None
+        self._executor_size = pool_size
+        self._executor_cs = threading.Lock()
+
+    def _init_metrics(self):
+        self._events_counter = self.metrics.counter("ari_events_total", "Events received from websocket", ("type",))
+        self._reconnects_counter = self.metrics.counter("ari_ws_reconnects_total", "Websocket reconnects")
+        self._resync_counter = self.metrics.counter("ari_resync_finished_total",
+                                                    "Models finished by resync after reconnect", ("model",))
+        self._requests_counter = self.metrics.counter("ari_rest_requests_total", "REST requests sent")
+        self._request_errors_counter = self.metrics.counter("ari_rest_errors_total", "REST requests failed")
+        self._filter_counter = self.metrics.counter("ari_filter_updates_total", "Server event filter updates")
+        self._in_flight_gauge = self.metrics.gauge("ari_rest_in_flight", "REST requests waiting for response")
+        if self._dispatcher is not None:
+            self.metrics.gauge("ari_dispatch_queue_depth", "Events waiting for dispatch", func=self._dispatcher.depth)
+        live_models = self.metrics.gauge("ari_models", "Live models", ("model",))
+        cache_stat = self.metrics.gauge("ari_model_cache", "Model cache counters", ("model", "stat"))
+        for name in self.models.keys():
+            live_models.set_function(self.models[name].__len__, name)
+            for stat in ("hits", "misses", "evicted_ttl", "evicted_lru", "pinned"):
+                cache_stat.set_function(lambda name=name, stat=stat: self.models[name].stat[stat], name, stat)
+        pool = self.metrics.gauge("ari_pool_connections", "REST pool connections", ("state",))
+        for state in ("open", "idle"):
+            pool.set_function(lambda state=state: self._pool.get_stat()[state], state)
+
+    @property
+    def connected(self):
+        """
+        True while events WebSocket is open
+        """
+        return self._opened
 
     def add_filter(self, event):
-        self._allowed_events.add(event)
+        """
+        Adds event to the server event filter.
+        While connected the filter is updated before return, so no event of a new callback is dropped.
+        Subscriptions of concurrent threads waiting for a running update are sent by the next one request.
+        Events are never removed, so callbacks of every call don't update the filter
+        """
+        if event in self._allowed_events:
+            return
+        with self._filter_cs:
+            self._allowed_events.add(event)
+        if self._opened:
+            self.sync_filter()
+
+    def sync_filter(self):
+        """
+        Sends allowed events to the server event filter if they changed
+        """
+        with self._filter_sync_cs:
+            with self._filter_cs:
+                allowed = sorted(self._allowed_events)
+            if allowed == self._synced_events:
+                return
+            try:
+                self.filter_events(allowed)
+                self._synced_events = allowed
+                self._filter_counter.inc()
+            except Exception as ex:
+                logging.error("event filter update error: %s" % str(ex))
 
     def get_model(self, name, model_id):
-        if model_id in self.models[name].keys():
-            return self.models[name][model_id]
-        else:
-            return None
+        return self.models[name].get(model_id)
 
     def append_model(self, name, model):
         if self.ws_running:
             self.models[name][model.id] = model
 
+    def enable_profiler(self, sample_interval=0, profiler=None):
+        """
+        Starts timings of decode, dispatch and REST requests by event type and endpoint.
+        Locks of callbacks and model caches are replaced by profiler.TimedLock, so their waits are timed too.
+        Nothing is timed until the profiler is enabled
+        :param sample_interval: seconds between stack samples of threads, 0 disables sampling
+        :param profiler: shared profiler, e.g. of cluster nodes
+        :return: profiler.Profiler
+        """
+        if profiler is None:
+            profiler = self.profiler or Profiler(sample_interval)
+        self.profiler = profiler
+        self._callback_cs = profiler.timed_lock(self._callback_cs, "_callback_cs")
+        for name, cache in self.models.items():
+            for stripe in cache._stripes:
+                stripe.cs = profiler.timed_lock(stripe.cs, "%s cache" % name)
+        profiler.start()
+        return profiler
+
+    def is_pinned(self, model):
+        """
+        Models with callbacks are never evicted from cache
+        """
+        return model.has_callbacks() or model.id in self._models_callbacks_index
+
+    def models_stat(self):
+        """
+        :return: dict model name -> cache size, hits, misses and evictions
+        """
+        return dict((name, cache.get_stat()) for name, cache in self.models.items())
+
     def remove_model(self, name, model_id):
-        if model_id in self.models[name].keys():
-            self.models[name].pop(model_id, None)
-        event_keys = list(self._models_callbacks.keys())
-        for event in event_keys:
-            if model_id in self._models_callbacks[event].keys():
+        self.models[name].pop(model_id, None)
+        with self._callback_cs:
+            for event in self._models_callbacks_index.pop(model_id, ()):
                 self._models_callbacks[event].pop(model_id, None)
 
     def clear_models(self, event):
-        models_name = self.models.keys()
-        for model in models_name:
-            cls = getattr(models, model)
-            if event.type in cls.finish_events:
-                fields = cls.finish_events[event.type]
-                for field in fields:
-                    obj = getattr(event, field)
-                    self.remove_model(obj.__class__.__name__, obj.id)
+        for cls, fields in models.FINISH_ROUTES.get(event.type, ()):
+            for field in fields:
+                model_id = event.get_model_id(field)
+                if model_id is not None:
+                    self.remove_model(cls.__name__, model_id)
 
     def append_callback(self, event, func, model_id=None):
         self.add_filter(event)
@@ -116,10 +254,12 @@ class Ari:
                     self._models_callbacks[event][model_id] = []
                 if func not in self._models_callbacks[event][model_id]:
                     self._models_callbacks[event][model_id].append(func)
+                self._models_callbacks_index.setdefault(model_id, set()).add(event)
 
     def remove_event_callback(self, event, func):
-        if event in self._event_callbacks.keys() and func in self._event_callbacks[event]:
-            self._event_callbacks[event].remove(func)
+        with self._callback_cs:
+            if event in self._event_callbacks.keys() and func in self._event_callbacks[event]:
+                self._event_callbacks[event].remove(func)
 
     def terminate(self):
         self.close()
@@ -128,28 +268,34 @@ class Ari:
     def close(self):
         self.ws_running = False
         self._closed = True
+        self._close_event.set()
         if self._ws is not None:
             self._ws.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._pool.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def join_threads(self):
         if self._run_thread is not None:
             logging.debug("wait for ari WS stop")
             self._run_thread.join()
             logging.debug("ari WS closed")
-        self._cb_queue.put(None)
-        if self._cb_thread is not None:
-            logging.debug("wait for queue thread stop")
-            self._cb_thread.join()
-            logging.debug("queue thread stopped")
+        if self._dispatcher.running:
+            self._dispatcher.stop()
+            if not self._closed:
+                logging.error("ari dispatch terminated unexpectedly")
 
     def run(self):
         self.ws_running = True
-        self._run_thread = threading.Thread(target=self._run)
+        self._run_thread = threading.Thread(target=self._run, name="ari-websocket")
         self._run_thread.daemon = True
         self._run_thread.start()
-        self._cb_thread = threading.Thread(target=self._cb_sender)
-        self._cb_thread.daemon = True
-        self._cb_thread.start()
+        self._dispatcher.start()
 
     def _run(self):
         self._ws = websocket.WebSocketApp("ws://%s/ari/events?app=%s" % (self.url, self.app),
@@ -159,90 +305,271 @@ class Ari:
                                           on_open=self.on_open,
                                           header=["Authorization: %s" % self._auth_header])
         logging.info("start ari websocket")
+        backoff = Backoff(self.RECONNECT_MIN_TIMEOUT, self.RECONNECT_MAX_TIMEOUT)
         while not self._closed:
             logging.info("start running websocket")
+            open_count = self._open_count
             self._ws.run_forever()
             if not self._closed:
                 logging.error("websocket stop running")
-                time.sleep(5)
-
-    def _cb_sender(self):
-        terminated = False
-        while not terminated:
-            item = self._cb_queue.get()
-            if item is None:
-                terminated = True
-                logging.info("ari queue handler terminated")
-                if not self._closed:
-                    logging.error("ari queue handler terminated unexpectedly")
-            else:
-                self.send_callback(item)
+                self._reconnects_counter.inc()
+                if self._open_count != open_count:
+                    # The connection was up, so reconnect fast
+                    backoff.reset()
+                self._close_event.wait(backoff.next())
 
     def on_message(self, ws, message):
-        data = json.loads(message)
-        logging.debug("Received event %s with payload: %s" % (data["type"], json.dumps(data, indent=4)))
+        event = self.read_message(message)
+        if event is not None:
+            self._events_counter.inc(event.type)
+            self._dispatcher.put(self.get_shard_key(event), event)
+
+    def get_shard_key(self, event):
+        """
+        Events of the same channel/bridge/playback have the same key,
+        so they are dispatched in order by one shard
+        """
+        for _, fields in models.EVENT_ROUTES.get(event.type, ()):
+            for field in fields:
+                model_id = event.get_model_id(field)
+                if model_id is not None:
+                    return model_id
+        return event.type
+
+    def read_message(self, message):
+        """
+        Records and decodes WebSocket message
+        :return: events.Event or None if the event is filtered
+        """
+        if self.recorder is not None:
+            self.recorder.record(message)
+        profiler = self.profiler
+        if profiler is None:
+            return self.decode_event(message)
+        started = time.perf_counter()
+        event = self.decode_event(message)
+        profiler.record("decode", event.type if event is not None else "filtered", time.perf_counter() - started)
+        return event
+
+    def decode_event(self, message):
+        data = self.codec.loads(message)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Received event %s with payload: %s" % (data["type"], json.dumps(data, indent=4)))
         if data["type"] in self._allowed_events:
             if hasattr(events, data["type"]):
-                event = self.create_event(data)
-                self._cb_queue.put(event)
+                return self.create_event(data)
+        return None
 
     def on_error(self, ws, error):
         if not self._closed:
             logging.error("WebSocket app error on close: %s" % error)
 
-    def on_close(self, ws):
+    def on_close(self, ws, *args):
+        # websocket-client >= 1.0 also passes close status code and message
+        self._opened = False
         if not self._closed:
             logging.error("WebSocket app closed")
 
     def on_open(self, ws):
         self._opened = True
-        self.filter_events(self.AVAILABLE_EVENTS)
+        self._open_count += 1
+        # Filter of the previous connection may be lost with asterisk restart
+        self._synced_events = None
+        self.sync_filter()
+        if self._open_count > 1:
+            # Events were lost while websocket was closed
+            resync_thread = threading.Thread(target=self.resync, name="ari-resync")
+            resync_thread.daemon = True
+            resync_thread.start()
+
+    # model name -> (finish event, event field, extra event fields)
+    SYNTHETIC_FINISH = {
+        "Channel": ("ChannelDestroyed", "channel", {"cause": 0, "cause_txt": "Unknown"}),
+        "Bridge": ("BridgeDestroyed", "bridge", {}),
+        "Playback": ("PlaybackFinished", "playback", {}),
+    }
+
+    def resync(self):
+        """
+        Reconciles models with channels, bridges and playbacks of asterisk.
+        Vanished models get synthetic ChannelDestroyed, BridgeDestroyed and PlaybackFinished events,
+        so callbacks see them finished. Synthetic events have "synthetic" field in event.raw
+        :return: dict model name -> count of finished models
+        """
+        known = dict((name, set(self.models[name].keys())) for name in self.SYNTHETIC_FINISH)
+        try:
+            # Asterisk has no list of playbacks, every live playback is requested
+            with self.pipeline() as pipeline:
+                channels = pipeline.submit(self.channels)
+                bridges = pipeline.submit(self.bridges)
+                playbacks = [pipeline.submit(self.get_playback, playback_id) for playback_id in known["Playback"]]
+        except Exception as ex:
+            logging.error("resync error: %s" % str(ex))
+            return {}
+        # Lists are None on 401, 503... responses, they don't mean that nothing is alive.
+        # Only a missing playback means that it is finished
+        if channels.result() is None or bridges.result() is None:
+            logging.error("resync error: channels or bridges are not listed")
+            return {}
+        return self.reconcile(known, {
+            "Channel": channels.result(),
+            "Bridge": bridges.result(),
+            "Playback": [future.result() for future in playbacks],
+        })
+
+    def reconcile(self, known, alive):
+        """
+        :param known: dict model name -> model ids before asterisk was requested
+        :param alive: dict model name -> list of data from asterisk, models of missing lists are not reconciled
+        :return: dict model name -> count of finished models
+        """
+        result = {}
+        for name, (event_type, field, fields) in self.SYNTHETIC_FINISH.items():
+            if alive.get(name) is None:
+                continue
+            alive_data = dict((item["id"], item) for item in alive[name] if item is not None)
+            result[name] = 0
+            for model_id in known[name]:
+                data = alive_data.get(model_id)
+                if data is not None:
+                    self.models[name].update(model_id, data)
+                    continue
+                model = self.get_model(name, model_id)
+                if model is None:
+                    continue
+                self.send_synthetic(event_type, field, model, fields)
+                result[name] += 1
+            if result[name] > 0:
+                self._resync_counter.inc(name, amount=result[name])
+        logging.info("resync finished models: %s" % result)
+        return result
+
+    def send_synthetic(self, event_type, field, model, fields, model_fields=None):
+        """
+        Dispatches event which asterisk would send if websocket was open
+        """
+        event = self.synthetic_event(event_type, field, model, fields, model_fields)
+        self._dispatcher.put(self.get_shard_key(event), event)
+        return event
+
+    def synthetic_event(self, event_type, field, model, fields, model_fields=None):
+        model_data = dict(model.as_dict())
+        model_data.update(model_fields or {})
+        data = {
+            "type": event_type,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000+0000", time.gmtime()),
+            "application": self.app,
+            field: model_data,
+            "synthetic": [model.__class__.__name__, model.id],
+        }
+        data.update(fields)
+        # Lazy, so the model is not created again if the real event has already removed it
+        return getattr(events, event_type).lazy(self, data)
+
+    def is_stale(self, event):
+        """
+        :return: True for synthetic event of a model which is already finished by the real event
+        """
+        synthetic = event.raw.get("synthetic")
+        return synthetic is not None and self.get_model(*synthetic) is None
 
     def create_event(self, data):
-        event = getattr(events, data["type"])(self, data)
+        cls = getattr(events, data["type"])
+        if self.lazy_events:
+            return cls.lazy(self, data)
+        event = cls(self, data)
         return event
 
     def send_callback(self, event):
+        if self.is_stale(event):
+            return
+        profiler = self.profiler
+        if profiler is not None:
+            started = time.perf_counter()
+            self._send_callback(event)
+            profiler.record("dispatch", event.type, time.perf_counter() - started)
+        else:
+            self._send_callback(event)
+
+    def _send_callback(self, event):
         try:
             class_name = event.type
             logging.debug("start sending callbacks for %s" % class_name)
-            if class_name in self._event_callbacks.keys():
-                # I made this tmp because this array may changing in another thread
-                tmp_callbacks = self._event_callbacks[class_name][:]
-                for cb in tmp_callbacks:
-                    cb(self, event)
-            for model in self.models.keys():
-                model_cls = getattr(models, model)
-                if class_name in model_cls.related_events.keys():
-                    fields = model_cls.related_events[class_name]
-                    for field in fields:
-                        obj = getattr(event, field)
-                        if obj is not None:
-                            obj.callback(self, event)
+            for cb, args in self.get_event_handlers(event):
+                cb(*args)
             logging.debug("finish sending callbacks for %s" % class_name)
             self.clear_models(event)
         except Exception as ex:
             logging.error("Error on send callback %s" % str(ex))
 
+    def get_event_handlers(self, event):
+        """
+        Generates (callback, args) for every callback subscribed to event
+        :param event: events.Event
+        """
+        class_name = event.type
+        if class_name in self._event_callbacks.keys():
+            # I made this tmp because this array may changing in another thread
+            tmp_callbacks = self._event_callbacks[class_name][:]
+            for cb in tmp_callbacks:
+                yield cb, (self, event)
+        models_callbacks = self._models_callbacks.get(class_name, {})
+        for cls, fields in models.EVENT_ROUTES.get(class_name, ()):
+            for field in fields:
+                if self.lazy_events:
+                    # Don't parse the event if its model has no callbacks
+                    model_id = event.get_model_id(field)
+                    model = self.get_model(cls.__name__, model_id)
+                    if model_id not in models_callbacks and (model is None or not model.has_callbacks(class_name)):
+                        continue
+                obj = getattr(event, field)
+                if obj is not None:
+                    for cb in obj.get_callbacks(class_name):
+                        yield cb, (self, event, obj)
+                    for cb in models_callbacks.get(obj.id, [])[:]:
+                        yield cb, (self, event, obj)
+
     def send_request(self, method, uri, params=None, body=None):
+        # Profiler may be enabled while the request is sent
+        profiler = self.profiler
+        if profiler is not None:
+            key = endpoint(method, uri)
         if params is not None:
             params = urllib.parse.urlencode(params)
             uri = "%s?%s" % (uri, params)
+        self._requests_counter.inc()
+        self._in_flight_gauge.inc()
+        started = time.monotonic()
         try:
-            connection = http.client.HTTPConnection(self.url, timeout=10)
-            connection.request(method, uri,
-                               headers={"Authorization": self._auth_header, "Content-Type": "application/json"},
-                               body=body)
-            res = connection.getresponse()
-            data = res.read().decode()
+            res = self._pool.request(method, uri,
+                                     headers={"Authorization": self._auth_header, "Content-Type": "application/json"},
+                                     body=body)
         except Exception as ex:
+            self._request_errors_counter.inc()
             logging.error("send request %s error in line %s: %s" % (uri, str(sys.exc_info()[-1].tb_lineno), str(ex)))
             raise ex
-        if len(data) > 0 and (res.status == 200 or res.status == 201):
-            result = json.loads(data)
-            logging.debug("Response from %s: %s" % (uri, data))
+        finally:
+            self._in_flight_gauge.dec()
+            if self.rest_timeline is not None:
+                self.rest_timeline.record(time.monotonic() - started)
+            if profiler is not None:
+                profiler.record("rest", key, time.monotonic() - started)
+        return self.parse_response(uri, res)
+
+    def parse_response(self, uri, res):
+        """
+        :param uri: string
+        :param res: pool.Response
+        :return: decoded body or None
+        """
+        if len(res.data) > 0 and (res.status == 200 or res.status == 201):
+            # Codec decodes bytes directly, body is decoded to string only for logs
+            result = self.codec.loads(res.data)
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Response from %s: %s" % (uri, res.data.decode()))
             return result
         else:
+            data = res.data.decode()
             logging.debug("Response status from %s: %s %s %s" % (uri, res.status, res.reason, data))
             if res.status == 500:
                 raise Exception("Response status from %s: %s %s %s" % (uri, res.status, res.reason, data))
@@ -260,13 +587,25 @@ class Ari:
             "callerId": caller_id,
             "timeout": timeout
         }
-        body = json.dumps({
+        body = self.codec.dumps({
             "variables": variables
         })
         response = self.send_request("POST", '/ari/channels/%s' % channel_id, data, body)
         channel = models.Channel.get_or_create(self, response)
         return channel
 
+    def originate_many(self, calls, cps, concurrency=10, callback=None, report=None):
+        """
+        Creates channels with token bucket rate limit, see originate.originate_many
+        :param calls: iterable of dicts with create_channel arguments
+        :param cps: calls per second, 0 is unlimited
+        :param concurrency: max create_channel requests at once
+        :param callback: func(call, channel, error)
+        :param report: originate.OriginateReport
+        :return: originate.OriginateReport with achieved cps, latency percentiles and failures
+        """
+        return originate_many(self, calls, cps, concurrency, callback, report)
+
     def record_channel(self, channel_id, record_name, record_format="wav"):
         data = {"name": record_name, "format": record_format}
         response = self.send_request("POST", '/ari/channels/%s/record' % channel_id, data)
@@ -281,16 +620,16 @@ class Ari:
     def ring_channel(self, channel_id):
         """
         :param channel_id: string
-        :return: void
+        :return: Response (decoded body or None)
         """
-        self.send_request("POST", "/ari/channels/%s/ring" % channel_id)
+        return self.send_request("POST", "/ari/channels/%s/ring" % channel_id)
 
     def stop_ring_channel(self, channel_id):
         """
         :param channel_id: string
-        :return: void
+        :return: Response (decoded body or None)
         """
-        self.send_request("DELETE", "/ari/channels/%s/ring" % channel_id)
+        return self.send_request("DELETE", "/ari/channels/%s/ring" % channel_id)
 
     def close_channel(self, channel_id):
         response = self.send_request("DELETE", '/ari/channels/%s' % channel_id)
@@ -372,27 +711,66 @@ class Ari:
         playback = models.Playback.get_or_create(self, response)
         return playback
 
+    def get_playback(self, playback_id):
+        """
+        :return: playback data or None if it is finished
+        """
+        return self.send_request("GET", "/ari/playbacks/%s" % playback_id)
+
     def close_playback(self, playback_id):
-        self.send_request("DELETE", "/ari/playbacks/%s" % playback_id)
+        return self.send_request("DELETE", "/ari/playbacks/%s" % playback_id)
 
     def control_playback(self, playback_id, operation):
         """
         :param playback_id: string
         :param operation: List["restart", "pause", "unpause", "reverse", "forward"]
-        :return: void
+        :return: Response (decoded body or None)
         """
         data = {"operation": operation}
-        self.send_request("POST", "/ari/playbacks/%s/control" % playback_id, data)
+        return self.send_request("POST", "/ari/playbacks/%s/control" % playback_id, data)
 
     def filter_events(self, events):
         data = []
         for event in events:
             data.append({"type": event})
-        body = json.dumps({
+        body = self.codec.dumps({
             "allowed": data
         })
-        self.send_request("PUT", "/ari/applications/%s/eventFilter" % self.app, None, body)
+        return self.send_request("PUT", "/ari/applications/%s/eventFilter" % self.app, None, body)
 
     def list_apps(self):
         response = self.send_request("GET", "/ari/applications")
         return response
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Runs func (usually a REST method) in the request executor
+        :return: concurrent.futures.Future
+        """
+        if self._executor is None:
+            with self._executor_cs:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._executor_size)
+        return self._executor.submit(func, *args, **kwargs)
+
+    def pipeline(self):
+        """
+        :return: pipeline.Pipeline which sends its operations at once
+        """
+        return Pipeline(self)
+
+    def then(self, response, func):
+        """
+        Applies func to the result of REST request.
+        Models use it so the same code works for Ari and AsyncAri
+        """
+        return func(response)
+
+    def pool_stat(self):
+        return self._pool.get_stat()
+
+    def dispatch_stat(self):
+        """
+        :return: list of dicts with queue depth and dispatch lag in seconds for every shard
+        """
+        return self._dispatcher.get_stat()
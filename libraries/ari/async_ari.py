@@ -0,0 +1,588 @@
+import asyncio
+import base64
+import collections
+import inspect
+import logging
+import os
+import struct
+import sys
+import time
+import urllib.parse
+
+import websocket
+
+from . import models
+from .ari import Ari, Backoff
+from .pipeline import Pipeline
+from .pool import ConnectionPool, Response
+from .profiler import endpoint
+
+
+class AsyncConnectionPool:
+    """
+    Pool of persistent HTTP/1.1 connections built on asyncio streams.
+    Has the same counters, idle eviction and repeat rules as pool.ConnectionPool
+    """
+
+    STALE_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+    IDEMPOTENT_METHODS = ConnectionPool.IDEMPOTENT_METHODS
+
+    def __init__(self, host, size=10, idle_timeout=30, timeout=10):
+        self.host, _, port = host.partition(":")
+        self.port = int(port or 80)
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._created = 0
+        self._semaphore = None
+        self.stat = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "reconnects": 0,
+            "evicted": 0,
+        }
+
+    def _evict(self, streams):
+        streams[1].close()
+        self._created -= 1
+        self.stat["evicted"] += 1
+
+    def _evict_idle(self):
+        # Idle connections are appended to the right, so the oldest are on the left
+        deadline = time.monotonic() - self.idle_timeout
+        while len(self._idle) > 0 and self._idle[0][1] < deadline:
+            self._evict(self._idle.popleft()[0])
+
+    async def _acquire(self):
+        # Semaphore is created lazily to bind it to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        if self._semaphore.locked():
+            self.stat["waits"] += 1
+        await self._semaphore.acquire()
+        self._evict_idle()
+        while len(self._idle) > 0:
+            streams, _ = self._idle.pop()
+            # Reader of an idle connection is at eof if the server closed it
+            if streams[0].at_eof():
+                self._evict(streams)
+                continue
+            self.stat["hits"] += 1
+            return streams, True
+        self.stat["misses"] += 1
+        self._created += 1
+        try:
+            streams = await asyncio.open_connection(self.host, self.port)
+        except Exception:
+            self._created -= 1
+            self._semaphore.release()
+            raise
+        return streams, False
+
+    def _release(self, streams, reuse=True):
+        if reuse:
+            self._idle.append((streams, time.monotonic()))
+        else:
+            streams[1].close()
+            self._created -= 1
+        self._semaphore.release()
+
+    async def request(self, method, uri, headers=None, body=None):
+        streams, reused = await self._acquire()
+        try:
+            sent = [False]
+            try:
+                response, keep_alive = await asyncio.wait_for(
+                    self._request(streams, method, uri, headers, body, sent), self.timeout)
+            except self.STALE_ERRORS:
+                # The server may have got the request already, so it is repeated only if that is harmless
+                if not reused or (sent[0] and method not in self.IDEMPOTENT_METHODS):
+                    raise
+                streams[1].close()
+                self.stat["reconnects"] += 1
+                streams = await asyncio.open_connection(self.host, self.port)
+                response, keep_alive = await asyncio.wait_for(
+                    self._request(streams, method, uri, headers, body, sent), self.timeout)
+        except Exception:
+            self._release(streams, False)
+            raise
+        self._release(streams, keep_alive)
+        return response
+
+    async def _request(self, streams, method, uri, headers, body, sent):
+        reader, writer = streams
+        if isinstance(body, str):
+            body = body.encode()
+        lines = ["%s %s HTTP/1.1" % (method, uri), "Host: %s:%d" % (self.host, self.port)]
+        for name, value in (headers or {}).items():
+            lines.append("%s: %s" % (name, value))
+        lines.append("Content-Length: %d" % (len(body) if body else 0))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        if body:
+            writer.write(body)
+        await writer.drain()
+        sent[0] = True
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        _, status, reason = status_line.decode().rstrip("\r\n").split(" ", 2)
+        response_headers = await read_headers(reader)
+        if response_headers.get("transfer-encoding", "") == "chunked":
+            data = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                data += chunk[:-2]
+        else:
+            data = await reader.readexactly(int(response_headers.get("content-length", 0)))
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        return Response(int(status), reason, data), keep_alive
+
+    def close(self):
+        while len(self._idle) > 0:
+            self._idle.pop()[0][1].close()
+            self._created -= 1
+
+    def get_stat(self):
+        result = dict(self.stat)
+        result["size"] = self.size
+        result["open"] = self._created
+        result["idle"] = len(self._idle)
+        return result
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().rstrip("\r\n")
+        if not line:
+            return headers
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+class EventStream:
+    """
+    Async iterator over events of /ari/events WebSocket.
+    Stops when the socket is closed
+    """
+
+    def __init__(self, ari, reader, writer):
+        self._ari = ari
+        self._reader = reader
+        self._writer = writer
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            message = await self._read_message()
+            if message is None:
+                raise StopAsyncIteration
+            event = self._ari.read_message(message)
+            if event is not None:
+                return event
+
+    async def _read_frame(self):
+        head = await self._reader.readexactly(2)
+        fin = head[0] & 0x80
+        opcode = head[0] & 0x0f
+        length = head[1] & 0x7f
+        if length == 126:
+            length = struct.unpack("!H", await self._reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self._reader.readexactly(8))[0]
+        mask = None
+        if head[1] & 0x80:
+            mask = await self._reader.readexactly(4)
+        payload = await self._reader.readexactly(length)
+        if mask is not None:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return fin, opcode, payload
+
+    async def _read_message(self):
+        message = b""
+        try:
+            while True:
+                fin, opcode, payload = await self._read_frame()
+                if opcode == websocket.ABNF.OPCODE_PING:
+                    self.send_frame(payload, websocket.ABNF.OPCODE_PONG)
+                    continue
+                if opcode == websocket.ABNF.OPCODE_PONG:
+                    continue
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    self.close()
+                    return None
+                message += payload
+                if fin:
+                    # Codec decodes bytes directly
+                    return message
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def send_frame(self, payload, opcode):
+        # ABNF masks client frames as RFC 6455 requires
+        self._writer.write(websocket.ABNF.create_frame(payload, opcode).format())
+
+    def close(self):
+        if not self._writer.transport.is_closing():
+            self.send_frame(b"", websocket.ABNF.OPCODE_CLOSE)
+            self._writer.close()
+
+
+class AsyncPipeline(Pipeline):
+    """
+    Pipeline of AsyncAri, operations run as tasks of the event loop.
+
+    Usage:
+        async with ari.pipeline() as pipeline:
+            bridge = pipeline.submit(ari.create_bridge)
+            snoop = pipeline.submit(channel.snoop)
+        bridge.result().add_channels([channel.id])
+    """
+
+    async def wait(self, timeout=None):
+        """
+        :return: results in submit order, raises the first error
+        """
+        if len(self.futures) > 0:
+            _, not_done = await asyncio.wait(self.futures, timeout=timeout)
+            if len(not_done) > 0:
+                raise asyncio.TimeoutError("%d of %d operations are not finished" % (len(not_done),
+                                                                                     len(self.futures)))
+        return [future.result() for future in self.futures]
+
+    def __enter__(self):
+        raise TypeError("use async with for pipeline of AsyncAri")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.wait()
+
+
+class AsyncAri(Ari):
+    """
+    asyncio version of Ari.
+    All REST methods are coroutines, callbacks may be plain functions or coroutines.
+    Models and events are shared with Ari, so model methods (channel.answer(),
+    bridge.play(), ...) return awaitables when the model belongs to AsyncAri
+
+    Usage:
+        ari = AsyncAri(url, user, password, app)
+        ari.append_callback("StasisStart", on_start)
+        await ari.run()
+    """
+
+    def __init__(self, url, user, password, app, event_callbacks=None, pool_size=10, pool_idle_timeout=30,
+                 lazy_events=False, codec=None, metrics=None, models_ttl=3600, models_max_size=100000,
+                 record_events=None):
+        # Ari.__init__ subscribes finish events with add_filter, which checks the task
+        self._filter_task = None
+        super().__init__(url, user, password, app, event_callbacks, pool_size, pool_idle_timeout,
+                         lazy_events=lazy_events, codec=codec, metrics=metrics,
+                         models_ttl=models_ttl, models_max_size=models_max_size, record_events=record_events)
+        self._stream = None
+        self._tasks = set()
+
+    def _init_transport(self, pool_size, pool_idle_timeout, dispatch_shards):
+        # Events are dispatched by the event loop, so there are no dispatch threads
+        self._dispatcher = None
+        self._pool = AsyncConnectionPool(self.url, pool_size, pool_idle_timeout, self.REQUEST_TIMEOUT)
+
+    async def connect(self):
+        """
+        Opens /ari/events WebSocket
+        :return: EventStream
+        """
+        host, _, port = self.url.partition(":")
+        reader, writer = await asyncio.open_connection(host, int(port or 80))
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = ["GET /ari/events?%s HTTP/1.1" % urllib.parse.urlencode({"app": self.app}),
+                   "Host: %s" % self.url,
+                   "Upgrade: websocket",
+                   "Connection: Upgrade",
+                   "Sec-WebSocket-Key: %s" % key,
+                   "Sec-WebSocket-Version: 13",
+                   "Authorization: %s" % self._auth_header]
+        writer.write(("\r\n".join(request) + "\r\n\r\n").encode())
+        status_line = (await reader.readline()).decode()
+        await read_headers(reader)
+        if " 101 " not in status_line:
+            writer.close()
+            raise ConnectionError("WebSocket handshake failed: %s" % status_line.strip())
+        self._stream = EventStream(self, reader, writer)
+        self.ws_running = True
+        self._opened = True
+        self._open_count += 1
+        self._synced_events = None
+        await self.sync_filter()
+        return self._stream
+
+    async def events(self):
+        """
+        :return: EventStream, use it with async for
+        """
+        if self._stream is None:
+            await self.connect()
+        return self._stream
+
+    async def run(self):
+        """
+        Receives events and sends callbacks until close() is called
+        """
+        logging.info("start ari websocket")
+        backoff = Backoff(self.RECONNECT_MIN_TIMEOUT, self.RECONNECT_MAX_TIMEOUT)
+        while not self._closed:
+            try:
+                stream = await self.events()
+                backoff.reset()
+                if self._open_count > 1:
+                    # Events were lost while websocket was closed
+                    await self.resync()
+                async for event in stream:
+                    self._events_counter.inc(event.type)
+                    await self.send_callback(event)
+            except Exception as ex:
+                logging.error("websocket error: %s" % ex)
+            self._stream = None
+            self._opened = False
+            if not self._closed:
+                logging.error("websocket stop running")
+                self._reconnects_counter.inc()
+                await asyncio.sleep(backoff.next())
+
+    def close(self):
+        self.ws_running = False
+        self._closed = True
+        if self._filter_task is not None:
+            self._filter_task.cancel()
+            self._filter_task = None
+        if self._stream is not None:
+            self._stream.close()
+        self._pool.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def terminate(self):
+        self.close()
+
+    def add_filter(self, event):
+        """
+        Adds event to the server event filter, the update is sent by the event loop.
+        Subscriptions made before the update task runs are sent by one request
+        """
+        if event in self._allowed_events:
+            return
+        self._allowed_events.add(event)
+        if self._filter_task is None and self._opened:
+            self._filter_task = asyncio.ensure_future(self.sync_filter())
+
+    async def sync_filter(self):
+        self._filter_task = None
+        allowed = sorted(self._allowed_events)
+        if allowed == self._synced_events:
+            return
+        try:
+            await self.filter_events(allowed)
+            self._synced_events = allowed
+            self._filter_counter.inc()
+        except Exception as ex:
+            logging.error("event filter update error: %s" % str(ex))
+
+    async def resync(self):
+        """
+        Coroutine version of Ari.resync
+        """
+        known = dict((name, set(self.models[name].keys())) for name in self.SYNTHETIC_FINISH)
+        try:
+            channels, bridges, *playbacks = await asyncio.gather(
+                self.channels(), self.bridges(),
+                *[self.get_playback(playback_id) for playback_id in known["Playback"]])
+        except Exception as ex:
+            logging.error("resync error: %s" % str(ex))
+            return {}
+        if channels is None or bridges is None:
+            logging.error("resync error: channels or bridges are not listed")
+            return {}
+        return self.reconcile(known, {"Channel": channels, "Bridge": bridges, "Playback": playbacks})
+
+    def send_synthetic(self, event_type, field, model, fields, model_fields=None):
+        event = self.synthetic_event(event_type, field, model, fields, model_fields)
+        task = asyncio.ensure_future(self.send_callback(event))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return event
+
+    async def send_callback(self, event):
+        """
+        Calls plain callbacks in place and starts coroutine callbacks as tasks,
+        so a long call scenario doesn't block events of other calls
+        """
+        if self.is_stale(event):
+            return
+        profiler = self.profiler
+        if profiler is not None:
+            # Coroutine callbacks run as tasks, only their start is timed
+            started = time.perf_counter()
+            self._send_callback(event)
+            profiler.record("dispatch", event.type, time.perf_counter() - started)
+        else:
+            self._send_callback(event)
+
+    def _send_callback(self, event):
+        try:
+            class_name = event.type
+            logging.debug("start sending callbacks for %s" % class_name)
+            for cb, args in self.get_event_handlers(event):
+                result = cb(*args)
+                if inspect.isawaitable(result):
+                    task = asyncio.ensure_future(result)
+                    self._tasks.add(task)
+                    task.add_done_callback(self._task_done)
+            logging.debug("finish sending callbacks for %s" % class_name)
+            self.clear_models(event)
+        except Exception as ex:
+            logging.error("Error on send callback %s" % str(ex))
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Error on send callback %s" % str(task.exception()))
+
+    async def join_tasks(self):
+        """
+        Waits for running coroutine callbacks
+        """
+        while len(self._tasks) > 0:
+            await asyncio.wait(list(self._tasks))
+
+    async def send_request(self, method, uri, params=None, body=None):
+        # Profiler may be enabled while the request is sent
+        profiler = self.profiler
+        if profiler is not None:
+            key = endpoint(method, uri)
+        if params is not None:
+            params = urllib.parse.urlencode(params)
+            uri = "%s?%s" % (uri, params)
+        self._requests_counter.inc()
+        self._in_flight_gauge.inc()
+        started = time.monotonic()
+        try:
+            res = await self._pool.request(method, uri,
+                                           headers={"Authorization": self._auth_header,
+                                                    "Content-Type": "application/json"},
+                                           body=body)
+        except Exception as ex:
+            self._request_errors_counter.inc()
+            logging.error("send request %s error in line %s: %s" % (uri, str(sys.exc_info()[-1].tb_lineno), str(ex)))
+            raise ex
+        finally:
+            self._in_flight_gauge.dec()
+            if self.rest_timeline is not None:
+                self.rest_timeline.record(time.monotonic() - started)
+            if profiler is not None:
+                profiler.record("rest", key, time.monotonic() - started)
+        return self.parse_response(uri, res)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Runs func (usually a REST coroutine) as a task of the event loop
+        :return: asyncio.Future
+        """
+        try:
+            result = func(*args, **kwargs)
+        except Exception as ex:
+            future = asyncio.get_event_loop().create_future()
+            future.set_exception(ex)
+            return future
+        if inspect.isawaitable(result):
+            return asyncio.ensure_future(result)
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(result)
+        return future
+
+    def pipeline(self):
+        """
+        :return: AsyncPipeline, use it with async with
+        """
+        return AsyncPipeline(self)
+
+    def dispatch_stat(self):
+        return []
+
+    def then(self, response, func):
+        async def wrapper():
+            return func(await response)
+        return wrapper()
+
+    async def create_channel(self, channel_id, endpoint, caller_id, variables={}, timeout=30):
+        data = {
+            "endpoint": endpoint,
+            "app": self.app,
+            "callerId": caller_id,
+            "timeout": timeout
+        }
+        body = self.codec.dumps({
+            "variables": variables
+        })
+        response = await self.send_request("POST", '/ari/channels/%s' % channel_id, data, body)
+        channel = models.Channel.get_or_create(self, response)
+        return channel
+
+    async def play_channel(self, channel_id, media):
+        data = {"media": media}
+        response = await self.send_request("POST", '/ari/channels/%s/play' % channel_id, data)
+        playback = models.Playback.get_or_create(self, response)
+        return playback
+
+    async def external_media(self, media_port=56432, media_host="127.0.0.1", media_format="slin16", channel_id=None):
+        data = {
+            "external_host": "%s:%d" % (media_host, media_port),
+            "app": self.app,
+            "format": media_format
+        }
+        if channel_id is not None:
+            data["channelId"] = channel_id
+        response = await self.send_request("POST", '/ari/channels/externalMedia', data)
+        channel = models.Channel.get_or_create(self, response)
+        return channel
+
+    async def start_snoop(self, channel_id, type='spy', direction="in"):
+        data = {
+            "app": self.app,
+            type: direction
+        }
+        response = await self.send_request("POST", '/ari/channels/%s/snoop' % channel_id, data)
+        if response is None:
+            return None
+        channel = models.Channel.get_or_create(self, response)
+        return channel
+
+    async def create_bridge(self):
+        response = await self.send_request("POST", '/ari/bridges')
+        bridge = models.Bridge.get_or_create(self, response)
+        return bridge
+
+    async def play_bridge(self, bridge_id, media):
+        data = {"media": media}
+        response = await self.send_request("POST", '/ari/bridges/%s/play' % bridge_id, data)
+        playback = models.Playback.get_or_create(self, response)
+        return playback
+
+    async def play_silence(self, bridge_id, seconds):
+        data = {"media": "sound:silence/%d" % int(seconds)}
+        response = await self.send_request("POST", '/ari/bridges/%s/play' % bridge_id, data)
+        playback = models.Playback.get_or_create(self, response)
+        return playback
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Stripe:
+    """
+    Part of ModelCache with its own lock and LRU order
+    """
+
+    __slots__ = ("items", "cs", "stat")
+
+    def __init__(self):
+        self.items = OrderedDict()
+        self.cs = threading.Lock()
+        self.stat = {
+            "hits": 0,
+            "misses": 0,
+            "evicted_ttl": 0,
+            "evicted_lru": 0,
+            "pinned": 0,
+        }
+
+
+class ModelCache:
+    """
+    Models of one type by id with idle TTL and max size LRU eviction.
+
+    Models are split into stripes by id hash, every stripe has its own lock,
+    so threads handling different calls rarely wait for each other.
+    Models of a stripe are ordered by the last access, so expired and least recently used
+    models are at the front and eviction checks only them.
+    Models for which pinned(model) is True (e.g. with callbacks) are never evicted.
+    ttl = 0 and max_size = 0 disable eviction, max_size is split between stripes.
+    The last access time is kept in model._accessed, so the cache adds no objects per model
+    """
+
+    def __init__(self, ttl=0, max_size=0, pinned=None, stripes=16):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.pinned = pinned
+        self._stripes = [Stripe() for _ in range(stripes)]
+        self._stripe_max_size = -(-max_size // stripes) if max_size > 0 else 0
+
+    def _stripe(self, model_id):
+        return self._stripes[hash(model_id) % len(self._stripes)]
+
+    @property
+    def stat(self):
+        result = dict.fromkeys(self._stripes[0].stat, 0)
+        for stripe in self._stripes:
+            for key, value in stripe.stat.items():
+                result[key] += value
+        return result
+
+    def get(self, model_id, default=None):
+        stripe = self._stripe(model_id)
+        with stripe.cs:
+            return self._get(stripe, model_id, default)
+
+    def _get(self, stripe, model_id, default=None):
+        model = stripe.items.get(model_id)
+        if model is None:
+            stripe.stat["misses"] += 1
+            return default
+        stripe.stat["hits"] += 1
+        model._accessed = time.monotonic()
+        stripe.items.move_to_end(model_id)
+        return model
+
+    def get_or_create(self, cls, ari, data, insert=True):
+        """
+        Atomically updates the model with data or creates cls(ari, data)
+        :param insert: False creates the model without adding it to cache
+        """
+        model_id = data["id"]
+        stripe = self._stripe(model_id)
+        with stripe.cs:
+            model = self._get(stripe, model_id)
+            if model is not None:
+                model.update_from_data(data)
+                return model
+            model = cls(ari, data)
+            if insert:
+                self._set(stripe, model_id, model)
+            return model
+
+    def update(self, model_id, data):
+        """
+        Updates the model with data if it is in cache
+        :return: the model or None
+        """
+        stripe = self._stripe(model_id)
+        with stripe.cs:
+            model = stripe.items.get(model_id)
+            if model is not None:
+                model.update_from_data(data)
+            return model
+
+    def __getitem__(self, model_id):
+        model = self.get(model_id)
+        if model is None:
+            raise KeyError(model_id)
+        return model
+
+    def __setitem__(self, model_id, model):
+        stripe = self._stripe(model_id)
+        with stripe.cs:
+            self._set(stripe, model_id, model)
+
+    def _set(self, stripe, model_id, model):
+        model._accessed = time.monotonic()
+        stripe.items[model_id] = model
+        stripe.items.move_to_end(model_id)
+        self._evict(stripe)
+
+    def pop(self, model_id, default=None):
+        stripe = self._stripe(model_id)
+        with stripe.cs:
+            return stripe.items.pop(model_id, default)
+
+    def __contains__(self, model_id):
+        return model_id in self._stripe(model_id).items
+
+    def __len__(self):
+        return sum(len(stripe.items) for stripe in self._stripes)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        result = []
+        for stripe in self._stripes:
+            with stripe.cs:
+                result.extend(stripe.items.keys())
+        return result
+
+    def values(self):
+        result = []
+        for stripe in self._stripes:
+            with stripe.cs:
+                result.extend(stripe.items.values())
+        return result
+
+    def items(self):
+        result = []
+        for stripe in self._stripes:
+            with stripe.cs:
+                result.extend(stripe.items.items())
+        return result
+
+    def expire(self):
+        """
+        Evicts idle models, it is also done on every insert
+        :return: count of evicted models
+        """
+        evicted = 0
+        for stripe in self._stripes:
+            with stripe.cs:
+                evicted += self._evict(stripe)
+        return evicted
+
+    def _evict(self, stripe):
+        items = stripe.items
+        evicted = 0
+        deadline = time.monotonic() - self.ttl if self.ttl > 0 else None
+        # Pinned models at the front are moved to the end, every model is checked once
+        checks = len(items)
+        while checks > 0 and len(items) > 0:
+            model_id, model = next(iter(items.items()))
+            over_size = 0 < self._stripe_max_size < len(items)
+            expired = deadline is not None and model._accessed < deadline
+            if not over_size and not expired:
+                break
+            checks -= 1
+            if self.pinned is not None and self.pinned(model):
+                # Checked again after ttl
+                stripe.stat["pinned"] += 1
+                model._accessed = time.monotonic()
+                items.move_to_end(model_id)
+                continue
+            del items[model_id]
+            stripe.stat["evicted_lru" if over_size else "evicted_ttl"] += 1
+            evicted += 1
+        return evicted
+
+    def get_stat(self):
+        result = self.stat
+        result["size"] = len(self)
+        result["stripes"] = len(self._stripes)
+        return result
@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+import time
+
+from .ari import Ari
+from .metrics import Registry
+from .originate import originate_many
+
+
+class Node:
+    """
+    Asterisk server of the cluster with its own Ari (WebSocket and connection pool)
+    """
+
+    def __init__(self, ari, weight=1):
+        self.ari = ari
+        self.weight = weight
+        self.asterisk_id = None
+        # Channels created by the cluster on this node and not destroyed yet
+        self.active = set()
+        self.failures = 0
+        self.drained_until = 0
+        # Smooth weighted round-robin state
+        self.current_weight = 0
+
+    @property
+    def url(self):
+        return self.ari.url
+
+    def available(self, now):
+        return self.ari.connected and now >= self.drained_until
+
+    def get_stat(self):
+        return {
+            "url": self.url,
+            "asterisk_id": self.asterisk_id,
+            "weight": self.weight,
+            "active": len(self.active),
+            "failures": self.failures,
+            "connected": self.ari.connected,
+            "drained": time.monotonic() < self.drained_until,
+        }
+
+
+class AriCluster:
+    """
+    Client of several Asterisk servers.
+
+    Every node has its own Ari, so events and models of a channel stay on the node
+    which owns it and model methods (channel.answer(), bridge.play()...) are sent to that node.
+    create_channel picks a node by strategy:
+    * least_active - node with the least active calls per weight
+    * round_robin - smooth weighted round-robin
+    A node is drained (gets no new channels) while its WebSocket is closed
+    and for drain_timeout seconds after max_failures failed requests in a row.
+
+    Usage:
+        cluster = AriCluster(["10.0.0.1:8088", ("10.0.0.2:8088", 2)], user, password, app)
+        cluster.append_callback("StasisStart", on_start)
+        cluster.run()
+        cluster.create_channel(channel_id, endpoint, caller_id)
+    """
+
+    STRATEGIES = ("least_active", "round_robin")
+
+    def __init__(self, nodes, user, password, app, event_callbacks=None, strategy="least_active",
+                 max_failures=3, drain_timeout=30, metrics=None, **ari_kwargs):
+        """
+        :param nodes: list of "host:port" or ("host:port", weight)
+        :param ari_kwargs: Ari arguments of every node (pool_size, dispatch_shards...)
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError("unknown strategy %s, use one of %s" % (strategy, ", ".join(self.STRATEGIES)))
+        self.app = app
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.drain_timeout = drain_timeout
+        self.nodes = []
+        # Client metrics of every node go to the cluster registry with node label
+        self.metrics = metrics if metrics is not None else Registry()
+        record_events = ari_kwargs.pop("record_events", None)
+        for index, node in enumerate(nodes):
+            url, weight = (node, 1) if isinstance(node, str) else node
+            if record_events:
+                # Every node records its own event log
+                name, extension = os.path.splitext(record_events)
+                ari_kwargs["record_events"] = "%s-%d%s" % (name, index, extension)
+            ari = Ari(url, user, password, app, event_callbacks, metrics=self.metrics.labelled(("node",), (url,)),
+                      **ari_kwargs)
+            self.nodes.append(Node(ari, weight))
+        self._nodes_by_id = {}
+        self._cs = threading.Lock()
+        for node in self.nodes:
+            node.ari.append_callback("StasisStart", lambda ari, event, node=node: self._learn(node, event))
+            node.ari.append_callback("ChannelDestroyed", lambda ari, event, node=node: self._destroyed(node, event))
+        active = self.metrics.gauge("ari_cluster_active_calls", "Active calls of node", ("node",))
+        available = self.metrics.gauge("ari_cluster_node_available", "1 if node gets new calls", ("node",))
+        for node in self.nodes:
+            active.set_function(node.active.__len__, node.url)
+            available.set_function(lambda node=node: int(node.available(time.monotonic())), node.url)
+
+    def _learn(self, node, event):
+        if node.asterisk_id is None and event.asterisk_id is not None:
+            node.asterisk_id = event.asterisk_id
+            with self._cs:
+                self._nodes_by_id[event.asterisk_id] = node
+
+    def _destroyed(self, node, event):
+        self._learn(node, event)
+        model_id = event.get_model_id("channel")
+        with self._cs:
+            node.active.discard(model_id)
+
+    @property
+    def rest_timeline(self):
+        return self.nodes[0].ari.rest_timeline
+
+    @rest_timeline.setter
+    def rest_timeline(self, timeline):
+        # REST latency of all nodes goes to one timeline
+        for node in self.nodes:
+            node.ari.rest_timeline = timeline
+
+    @property
+    def profiler(self):
+        return self.nodes[0].ari.profiler
+
+    def enable_profiler(self, sample_interval=0, profiler=None):
+        # Timings of all nodes go to one profiler
+        for node in self.nodes:
+            profiler = node.ari.enable_profiler(sample_interval, profiler)
+        return profiler
+
+    def append_callback(self, event, func, model_id=None):
+        for node in self.nodes:
+            node.ari.append_callback(event, func, model_id)
+
+    def remove_event_callback(self, event, func):
+        for node in self.nodes:
+            node.ari.remove_event_callback(event, func)
+
+    def run(self):
+        for node in self.nodes:
+            node.ari.run()
+
+    def close(self):
+        for node in self.nodes:
+            node.ari.close()
+
+    def join_threads(self):
+        for node in self.nodes:
+            node.ari.join_threads()
+
+    def terminate(self):
+        self.close()
+        self.join_threads()
+
+    def node_for(self, owner):
+        """
+        :param owner: asterisk_id, event or model
+        :return: Node which owns it or None
+        """
+        if isinstance(owner, str):
+            return self._nodes_by_id.get(owner)
+        if getattr(owner, "asterisk_id", None) is not None and owner.asterisk_id in self._nodes_by_id:
+            return self._nodes_by_id[owner.asterisk_id]
+        ari = getattr(owner, "_ari", None)
+        for node in self.nodes:
+            if node.ari is ari:
+                return node
+        return None
+
+    def ari_for(self, owner):
+        """
+        :return: Ari of the node which owns asterisk_id, event or model
+        """
+        node = self.node_for(owner)
+        return node.ari if node is not None else None
+
+    def pick_node(self, exclude=()):
+        """
+        :param exclude: nodes which already failed the request
+        :return: Node for a new channel or None if all nodes are drained
+        """
+        now = time.monotonic()
+        with self._cs:
+            nodes = [node for node in self.nodes if node not in exclude and node.available(now)]
+            if len(nodes) == 0:
+                return None
+            if self.strategy == "least_active":
+                return min(nodes, key=lambda item: len(item.active) / float(item.weight))
+            total = 0
+            best = None
+            for node in nodes:
+                node.current_weight += node.weight
+                total += node.weight
+                if best is None or node.current_weight > best.current_weight:
+                    best = node
+            best.current_weight -= total
+            return best
+
+    def create_channel(self, channel_id, endpoint, caller_id, variables={}, timeout=30):
+        """
+        Creates channel on the picked node, the next node is tried if it fails
+        :return: models.Channel of the node Ari
+        """
+        failed = []
+        while True:
+            node = self.pick_node(failed)
+            if node is None:
+                raise Exception("no available asterisk for channel %s, failed: %s" % (
+                    channel_id, ", ".join(item.url for item in failed) or "none"))
+            # Channel is counted before the request, so parallel requests see it
+            with self._cs:
+                node.active.add(str(channel_id))
+            try:
+                channel = node.ari.create_channel(channel_id, endpoint, caller_id, variables, timeout)
+            except Exception as ex:
+                with self._cs:
+                    node.active.discard(str(channel_id))
+                self._fail(node, ex)
+                failed.append(node)
+                continue
+            node.failures = 0
+            return channel
+
+    def _fail(self, node, error):
+        node.failures += 1
+        logging.error("asterisk %s request error (%d in a row): %s" % (node.url, node.failures, str(error)))
+        if node.failures >= self.max_failures:
+            node.drained_until = time.monotonic() + self.drain_timeout
+            node.failures = 0
+            logging.error("asterisk %s is drained for %d seconds" % (node.url, self.drain_timeout))
+
+    def originate_many(self, calls, cps, concurrency=10, callback=None, report=None):
+        """
+        Creates channels on cluster nodes, see originate.originate_many.
+        cps is the rate of the whole cluster
+        """
+        return originate_many(self, calls, cps, concurrency, callback, report)
+
+    def get_stat(self):
+        return [node.get_stat() for node in self.nodes]
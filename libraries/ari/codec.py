@@ -0,0 +1,81 @@
+import json
+
+
+class JsonCodec:
+    """
+    Standard library json, always available
+    """
+
+    name = "json"
+
+    def loads(self, data):
+        # json.loads accepts bytes only since python 3.6
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode()
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+class OrjsonCodec:
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj).decode()
+
+
+class UjsonCodec:
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj)
+
+
+CODECS = {
+    "orjson": OrjsonCodec,
+    "ujson": UjsonCodec,
+    "json": JsonCodec,
+}
+# The fastest installed codec is used by default
+PREFERRED_CODECS = ["orjson", "ujson", "json"]
+
+
+def get_codec(name=None):
+    """
+    :param name: codec name from CODECS or None for the fastest installed one
+    :return: codec object with loads(str or bytes) and dumps(obj) -> str
+    """
+    if name is not None:
+        return CODECS[name]()
+    for name in PREFERRED_CODECS:
+        try:
+            return CODECS[name]()
+        except ImportError:
+            continue
+
+
+def available_codecs():
+    result = []
+    for name in PREFERRED_CODECS:
+        try:
+            result.append(CODECS[name]())
+        except ImportError:
+            continue
+    return result
@@ -0,0 +1,95 @@
+import logging
+import queue
+import threading
+import time
+
+
+class Shard:
+
+    def __init__(self, index):
+        self.index = index
+        self.queue = queue.Queue()
+        self.thread = None
+        self.dispatched = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+
+    def get_stat(self):
+        return {
+            "depth": self.queue.qsize(),
+            "dispatched": self.dispatched,
+            "lag_last": self.lag_last,
+            "lag_max": self.lag_max,
+            "lag_avg": self.lag_total / self.dispatched if self.dispatched else 0.0,
+        }
+
+
+class ShardedDispatcher:
+    """
+    Sends items to handler from N worker threads.
+    Items with the same key always go to the same shard, so they are handled
+    strictly in order, items with different keys are handled in parallel.
+    Every shard has its own queue, so shards never wait for each other
+    """
+
+    def __init__(self, handler, shards=1, name="ari"):
+        self._handler = handler
+        self.name = name
+        self.shards = [Shard(i) for i in range(max(1, shards))]
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for shard in self.shards:
+            shard.thread = threading.Thread(target=self._run, args=(shard,),
+                                            name="%s-dispatch-%d" % (self.name, shard.index))
+            shard.thread.daemon = True
+            shard.thread.start()
+
+    def put(self, key, item):
+        shard = self.shards[hash(key) % len(self.shards)]
+        shard.queue.put((time.monotonic(), item))
+
+    def stop(self):
+        for shard in self.shards:
+            shard.queue.put(None)
+        for shard in self.shards:
+            if shard.thread is not None:
+                logging.debug("wait for %s thread stop" % shard.thread.name)
+                shard.thread.join()
+                logging.debug("%s thread stopped" % shard.thread.name)
+        self.running = False
+
+    def _run(self, shard):
+        while True:
+            item = shard.queue.get()
+            if item is None:
+                shard.queue.task_done()
+                logging.info("%s dispatch shard %d terminated" % (self.name, shard.index))
+                return
+            put_time, item = item
+            lag = time.monotonic() - put_time
+            shard.lag_last = lag
+            shard.lag_total += lag
+            if lag > shard.lag_max:
+                shard.lag_max = lag
+            shard.dispatched += 1
+            try:
+                self._handler(item)
+            finally:
+                # join() returns only after the handler of the last item is finished
+                shard.queue.task_done()
+
+    def join(self):
+        """
+        Waits until all put items are handled, shard threads must be running
+        """
+        for shard in self.shards:
+            shard.queue.join()
+
+    def depth(self):
+        return sum(shard.queue.qsize() for shard in self.shards)
+
+    def get_stat(self):
+        return [shard.get_stat() for shard in self.shards]
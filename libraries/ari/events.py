@@ -5,9 +5,43 @@ class Message(object):
 
     def __init__(self, ari, data):
         self._ari = ari
+        self._parsed = True
+        self.raw = data
         self.type = data["type"]
         self.asterisk_id = data.get("asterisk_id", None)
 
+    @classmethod
+    def lazy(cls, ari, data):
+        """
+        Creates event without parsing its fields.
+        Fields (and models in them) are parsed on the first access to any of them
+        """
+        event = cls.__new__(cls)
+        event._ari = ari
+        event._parsed = False
+        event.raw = data
+        event.type = data["type"]
+        event.asterisk_id = data.get("asterisk_id", None)
+        return event
+
+    def __getattr__(self, name):
+        # Called only for missing attributes, so parsed events never get here
+        if name.startswith("__") or self.__dict__.get("_parsed", True):
+            raise AttributeError(name)
+        self._parsed = True
+        self.__init__(self._ari, self.raw)
+        return getattr(self, name)
+
+    def get_model_id(self, field):
+        """
+        :param field: event field with model, e.g. "channel"
+        :return: model id from raw data without creating the model
+        """
+        data = self.raw.get(field, None)
+        if isinstance(data, dict):
+            return data.get("id", None)
+        return None
+
 
 class Event(Message):
 
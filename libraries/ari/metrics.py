@@ -0,0 +1,265 @@
+import http.server
+import logging
+import socketserver
+import threading
+
+
+class Metric:
+    """
+    Metric with optional labels, children are created on the first use of label values
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        # Metric without labels is exposed as 0 before the first update
+        self._values = {} if self.labels else {(): 0}
+        self._cs = threading.Lock()
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError("metric %s has labels %s" % (self.name, self.labels))
+        return tuple(label_values)
+
+    def samples(self):
+        """
+        :return: list of (label values, value)
+        """
+        with self._cs:
+            return list(self._values.items())
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self._cs:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(self._key(label_values), 0)
+
+
+class Gauge(Metric):
+    """
+    Gauge is set in hot paths or read from func(label values) on every scrape
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None, label_values=()):
+        super().__init__(name, help_text, labels)
+        self._funcs = {}
+        if func is not None:
+            self.set_function(func, *label_values)
+
+    def set(self, value, *label_values):
+        key = self._key(label_values)
+        with self._cs:
+            self._values[key] = value
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self._cs:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def set_function(self, func, *label_values):
+        self._funcs[self._key(label_values)] = func
+
+    def get(self, *label_values):
+        key = self._key(label_values)
+        if key in self._funcs:
+            return self._funcs[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        result = [(key, value) for key, value in super().samples() if key not in self._funcs]
+        for key, func in list(self._funcs.items()):
+            try:
+                result.append((key, func()))
+            except Exception as ex:
+                logging.error("metric %s error: %s" % (self.name, str(ex)))
+        return result
+
+
+class Registry:
+    """
+    Metrics of the process. Exposed in Prometheus text format and as a stats line
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._cs = threading.Lock()
+        self._server = None
+        self._log_thread = None
+        self._stop = threading.Event()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._cs:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=(), func=None, label_values=()):
+        gauge = self._register(Gauge, name, help_text, labels)
+        if func is not None:
+            gauge.set_function(func, *label_values)
+        return gauge
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def labelled(self, labels, label_values):
+        """
+        :return: LabelledRegistry which registers metrics here with extra leading labels,
+        e.g. metrics of cluster nodes with node label
+        """
+        return LabelledRegistry(self, labels, label_values)
+
+    def exposition(self):
+        """
+        :return: metrics in Prometheus text format
+        """
+        lines = []
+        with self._cs:
+            metrics = sorted(self._metrics.values(), key=lambda item: item.name)
+        for metric in metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            for label_values, value in sorted(metric.samples(), key=lambda item: item[0]):
+                labels = ""
+                if len(label_values) > 0:
+                    labels = "{%s}" % ",".join('%s="%s"' % (label, str(label_value).replace('"', '\\"'))
+                                               for label, label_value in zip(metric.labels, label_values))
+                lines.append("%s%s %s" % (metric.name, labels, value))
+        return "\n".join(lines) + "\n"
+
+    def stats_line(self):
+        items = []
+        with self._cs:
+            metrics = sorted(self._metrics.values(), key=lambda item: item.name)
+        for metric in metrics:
+            for label_values, value in sorted(metric.samples(), key=lambda item: item[0]):
+                name = metric.name
+                if len(label_values) > 0:
+                    name = "%s{%s}" % (name, ",".join(str(label_value) for label_value in label_values))
+                if isinstance(value, float):
+                    value = "%.3f" % value
+                items.append("%s=%s" % (name, value))
+        return " ".join(items)
+
+    def start_server(self, port, host="127.0.0.1"):
+        """
+        Serves /metrics on http://host:port in a daemon thread
+        """
+        self._server = MetricsServer((host, port), self)
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics")
+        thread.daemon = True
+        thread.start()
+        logging.info("metrics are served on http://%s:%d/metrics" % self._server.server_address[:2])
+        return self._server
+
+    def start_log(self, interval):
+        """
+        Logs stats line every interval seconds
+        """
+        self._log_thread = threading.Thread(target=self._log, args=(interval,), name="metrics-log")
+        self._log_thread.daemon = True
+        self._log_thread.start()
+
+    def _log(self, interval):
+        while not self._stop.wait(interval):
+            logging.info("stats: %s" % self.stats_line())
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._log_thread is not None:
+            self._log_thread.join()
+
+
+class LabelledMetric:
+    """
+    Metric of LabelledRegistry, label values of the registry are prepended to label values of every call
+    """
+
+    def __init__(self, metric, label_values):
+        self.metric = metric
+        self.label_values = tuple(label_values)
+
+    def inc(self, *label_values, amount=1):
+        self.metric.inc(*(self.label_values + label_values), amount=amount)
+
+    def dec(self, *label_values, amount=1):
+        self.metric.dec(*(self.label_values + label_values), amount=amount)
+
+    def set(self, value, *label_values):
+        self.metric.set(value, *(self.label_values + label_values))
+
+    def set_function(self, func, *label_values):
+        self.metric.set_function(func, *(self.label_values + label_values))
+
+    def get(self, *label_values):
+        return self.metric.get(*(self.label_values + label_values))
+
+
+class LabelledRegistry:
+    """
+    View of a registry with fixed leading labels, it has counter() and gauge() of Registry
+    """
+
+    def __init__(self, registry, labels, label_values):
+        self.registry = registry
+        self.labels = tuple(labels)
+        self.label_values = tuple(label_values)
+
+    def counter(self, name, help_text, labels=()):
+        return LabelledMetric(self.registry.counter(name, help_text, self.labels + tuple(labels)), self.label_values)
+
+    def gauge(self, name, help_text, labels=(), func=None, label_values=()):
+        gauge = LabelledMetric(self.registry.gauge(name, help_text, self.labels + tuple(labels)), self.label_values)
+        if func is not None:
+            gauge.set_function(func, *label_values)
+        return gauge
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, registry):
+        super().__init__(address, MetricsHandler)
+        self.registry = registry
@@ -1,50 +1,96 @@
-import json
-import threading
+import sys
+
+
+def intern(value):
+    """
+    Repeated values like state or technology are stored once for all models
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
 
 
 class Model(object):
 
+    # Models are created for every channel, so they have no __dict__
+    __slots__ = ("_ari", "data", "id", "_event_callbacks", "_accessed")
+
     related_events = {}
     finish_events = {}
-    create_cs = threading.Lock()
+    # Attribute name -> raw data name, if they differ
+    data_names = {}
 
     def __init__(self, ari, data):
         self._ari = ari
-        self.data = data
+        # Raw data is kept only if ari needs it
+        self.data = data if ari.keep_model_data else None
         self.id = data["id"]
-        self._event_callbacks = {}
-        ari.append_model(self.__class__.__name__, self)
+        # Created on the first append_callback
+        self._event_callbacks = None
+        # Last access time, set by ModelCache
+        self._accessed = 0
 
     @classmethod
     def get_or_create(cls, ari, data):
-        name = cls.__name__
-        with cls.create_cs:
-            model = ari.get_model(name, data["id"])
-            if model is not None:
-                model.update_from_data(data)
-                return model
-            else:
-                model = cls(ari, data)
-                return model
+        """
+        Updates the model with data or creates it, models are kept by ari only while websocket is running
+        """
+        return ari.models[cls.__name__].get_or_create(cls, ari, data, ari.ws_running)
 
     def update_from_data(self, data):
-        self.data = data
+        if self._ari.keep_model_data:
+            self.data = data
+
+    def as_dict(self):
+        """
+        :return: raw data or public fields if raw data is not kept
+        """
+        if self.data is not None:
+            return self.data
+        result = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name.startswith("_") or name == "data" or self.data_names.get(name, name) in result:
+                    continue
+                value = getattr(self, name, None)
+                if isinstance(value, CallerID):
+                    value = {"name": value.name, "number": value.number}
+                elif isinstance(value, list) and len(value) > 0 and isinstance(value[0], Model):
+                    value = [item.id for item in value]
+                result[self.data_names.get(name, name)] = value
+        return result
 
     def as_string(self):
-        return json.dumps(self.data)
+        return self._ari.codec.dumps(self.as_dict())
 
-    def callback(self, ari, event):
-        if event.type in self._event_callbacks:
+    def get_callbacks(self, event_type):
+        if self._event_callbacks is not None and event_type in self._event_callbacks:
             # I made this tmp because this array may changing in another thread
-            tmp_callbacks = self._event_callbacks[event.type][:]
-            for cb in tmp_callbacks:
-                cb(ari, event, self)
+            return self._event_callbacks[event_type][:]
+        return []
+
+    def has_callbacks(self, event_type=None):
+        """
+        :param event_type: None checks callbacks of any event
+        """
+        if self._event_callbacks is None:
+            return False
+        if event_type is None:
+            return any(len(funcs) > 0 for funcs in self._event_callbacks.values())
+        return len(self._event_callbacks.get(event_type, ())) > 0
+
+    def callback(self, ari, event):
+        for cb in self.get_callbacks(event.type):
+            cb(ari, event, self)
 
     def append_callback(self, event, func):
         self._ari.add_filter(event)
-        if event not in self._event_callbacks.keys():
-            self._event_callbacks[event] = []
-        self._event_callbacks[event].append(func)
+        with self._ari._callback_cs:
+            if self._event_callbacks is None:
+                self._event_callbacks = {}
+            if event not in self._event_callbacks.keys():
+                self._event_callbacks[event] = []
+            self._event_callbacks[event].append(func)
         return True
 
     def remove_from_ari(self):
@@ -53,6 +99,9 @@ class Model(object):
 
 class Channel(Model):
 
+    __slots__ = ("name", "state", "caller", "connected", "creationtime", "language", "dialplan",
+                 "accountcode", "channelvars", "protocol", "snoop_channels")
+
     related_events = {"ChannelCreated": ["channel"],
                       "ChannelDestroyed": ["channel"],
                       "ChannelEnteredBridge": ["channel"],
@@ -81,57 +130,61 @@ class Channel(Model):
     def __init__(self, ari, data):
         super().__init__(ari, data)
         self.name = data["name"]
-        self.state = data["state"]
+        self.state = intern(data["state"])
         self.caller = CallerID(data["caller"])
         self.connected = CallerID(data["connected"])
         self.creationtime = data["creationtime"]
-        self.language = data["language"]
+        self.language = intern(data["language"])
         self.dialplan = data["dialplan"]
-        self.accountcode = data["accountcode"]
+        self.accountcode = intern(data["accountcode"])
         self.channelvars = []
         if "channelvars" in data.keys():
             self.channelvars = data["channelvars"]
-        self.protocol = self.name.split("/")[0]
+        self.protocol = intern(self.name.split("/")[0])
         self.snoop_channels = []
 
     def update_from_data(self, data):
         super().update_from_data(data)
-        self.state = data["state"]
+        self.state = intern(data["state"])
         self.connected = CallerID(data["connected"])
         self.dialplan = data["dialplan"]
-        self.accountcode = data["accountcode"]
+        self.accountcode = intern(data["accountcode"])
         self.channelvars = []
         if "channelvars" in data.keys():
             self.channelvars = data["channelvars"]
 
     def record(self, record_name, record_format="wav"):
-        self._ari.record_channel(self.id, record_name, record_format)
+        return self._ari.record_channel(self.id, record_name, record_format)
 
     def play(self, media):
         playback = self._ari.play_channel(self.id, media)
         return playback
 
     def close(self):
-        self._ari.close_channel(self.id)
+        return self._ari.close_channel(self.id)
 
     def snoop(self):
-        channel = self._ari.start_snoop(self.id, "spy", "in")
+        return self._ari.then(self._ari.start_snoop(self.id, "spy", "in"), self._append_snoop)
+
+    def _append_snoop(self, channel):
         if channel is not None:
             self.snoop_channels.append(channel)
         return channel
 
     def answer(self):
-        self._ari.answer(self.id)
+        return self._ari.answer(self.id)
 
     def ring(self):
-        self._ari.ring_channel(self.id)
+        return self._ari.ring_channel(self.id)
 
     def stop_ring(self):
-        self._ari.stop_ring_channel(self.id)
+        return self._ari.stop_ring_channel(self.id)
 
 
 class CallerID:
 
+    __slots__ = ("name", "number")
+
     def __init__(self, data):
         self.name = data["name"]
         self.number = data["number"]
@@ -139,6 +192,8 @@ class CallerID:
 
 class Bridge(Model):
 
+    __slots__ = ("technology", "bridge_type", "bridge_class", "creator", "name", "channels_id", "creationtime")
+
     related_events = {"BridgeCreated": ["bridge"],
                       "BridgeDestroyed": ["bridge"],
                       "BridgeMerged": ["bridge"],
@@ -151,12 +206,14 @@ class Bridge(Model):
         "BridgeDestroyed": ["bridge"]
     }
 
+    data_names = {"channels_id": "channels"}
+
     def __init__(self, ari, data):
         super().__init__(ari, data)
-        self.technology = data["technology"]
-        self.bridge_type = data["bridge_type"]
-        self.bridge_class = data["bridge_class"]
-        self.creator = data["creator"]
+        self.technology = intern(data["technology"])
+        self.bridge_type = intern(data["bridge_type"])
+        self.bridge_class = intern(data["bridge_class"])
+        self.creator = intern(data["creator"])
         self.name = data["name"]
         self.channels_id = data["channels"]
         self.creationtime = data["creationtime"]
@@ -166,19 +223,19 @@ class Bridge(Model):
         self.channels_id = data["channels"]
 
     def add_channels(self, channels):
-        self._ari.add_to_bridge(self.id, channels)
+        return self._ari.add_to_bridge(self.id, channels)
 
     def remove_channels(self, channels):
-        self._ari.remove_from_bridge(self.id, channels)
+        return self._ari.remove_from_bridge(self.id, channels)
 
     def record(self, record_name, record_format="wav"):
-        self._ari.record_bridge(self.id, record_name, record_format)
+        return self._ari.record_bridge(self.id, record_name, record_format)
 
     def moh(self, moh_class):
-        self._ari.moh_bridge(self.id, moh_class)
+        return self._ari.moh_bridge(self.id, moh_class)
 
     def stop_moh(self):
-        self._ari.stop_moh_bridge(self.id)
+        return self._ari.stop_moh_bridge(self.id)
 
     def play(self, media):
         playback = self._ari.play_bridge(self.id, media)
@@ -189,12 +246,15 @@ class Bridge(Model):
         return playback
 
     def close(self):
-        self._ari.close_bridge(self.id)
+        response = self._ari.close_bridge(self.id)
         self.remove_from_ari()
+        return response
 
 
 class Playback(Model):
 
+    __slots__ = ("media_uri", "target_uri", "language", "state")
+
     related_events = {"PlaybackStarted": ["playback"],
                       "PlaybackContinuing": ["playback"],
                       "PlaybackFinished": ["playback"],
@@ -206,33 +266,54 @@ class Playback(Model):
 
     def __init__(self, ari, data):
         super().__init__(ari, data)
-        self.media_uri = data["media_uri"]
+        self.media_uri = intern(data["media_uri"])
         self.target_uri = data["target_uri"]
-        self.language = data["language"]
-        self.state = data["state"]
+        self.language = intern(data["language"])
+        self.state = intern(data["state"])
 
     def update_from_data(self, data):
         super().update_from_data(data)
-        self.media_uri = data["media_uri"]
+        self.media_uri = intern(data["media_uri"])
         self.target_uri = data["target_uri"]
-        self.language = data["language"]
-        self.state = data["state"]
+        self.language = intern(data["language"])
+        self.state = intern(data["state"])
 
     def close(self):
-        self._ari.close_playback(self.id)
+        response = self._ari.close_playback(self.id)
         self.remove_from_ari()
+        return response
 
     def restart(self):
-        self._ari.control_playback(self.id, "restart")
+        return self._ari.control_playback(self.id, "restart")
 
     def pause(self):
-        self._ari.control_playback(self.id, "pause")
+        return self._ari.control_playback(self.id, "pause")
 
     def unpause(self):
-        self._ari.control_playback(self.id, "unpause")
+        return self._ari.control_playback(self.id, "unpause")
 
     def reverse(self):
-        self._ari.control_playback(self.id, "reverse")
+        return self._ari.control_playback(self.id, "reverse")
 
     def forward(self):
-        self._ari.control_playback(self.id, "forward")
\ No newline at end of file
+        return self._ari.control_playback(self.id, "forward")
+
+
+MODELS = (Channel, Bridge, Playback)
+
+
+def build_routes(attribute):
+    """
+    :param attribute: "related_events" or "finish_events"
+    :return: dict event type -> list of (model class, event fields)
+    """
+    routes = {}
+    for cls in MODELS:
+        for event, fields in getattr(cls, attribute).items():
+            routes.setdefault(event, []).append((cls, fields))
+    return routes
+
+
+# Precomputed so dispatch doesn't scan every model for every event
+EVENT_ROUTES = build_routes("related_events")
+FINISH_ROUTES = build_routes("finish_events")
\ No newline at end of file
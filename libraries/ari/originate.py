@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .stats import Histogram
+
+
+class TokenBucket:
+    """
+    Allows rate acquires per second on average and up to burst at once
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._cs = threading.Lock()
+
+    def acquire(self):
+        with self._cs:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) / self.rate)
+
+
+class OriginateReport:
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.latency = Histogram()
+        self._cs = threading.Lock()
+
+    def add(self, latency, error=None):
+        with self._cs:
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+        if error is None:
+            self.latency.record(latency)
+
+    def get_stat(self):
+        with self._cs:
+            sent = self.sent
+            failed = self.failed
+        duration = (self.finished or time.monotonic()) - self.started
+        return {
+            "sent": sent,
+            "failed": failed,
+            "duration": duration,
+            "cps": sent / duration if duration > 0 else 0.0,
+            "latency_p50": self.latency.percentile(50),
+            "latency_p95": self.latency.percentile(95),
+            "latency_p99": self.latency.percentile(99),
+        }
+
+
+def originate_many(ari, calls, cps, concurrency=10, callback=None, report=None):
+    """
+    Creates channels with a sustained calls per second rate
+    :param ari: Ari
+    :param calls: iterable of dicts with create_channel arguments
+    (channel_id, endpoint, caller_id and optional variables, timeout)
+    :param cps: calls per second, 0 is unlimited
+    :param concurrency: max create_channel requests at once
+    :param callback: func(call, channel, error) called after every request
+    :param report: OriginateReport to fill, pass it to watch the stat while calls are sent
+    :return: OriginateReport
+    """
+    if report is None:
+        report = OriginateReport()
+    bucket = TokenBucket(cps) if cps > 0 else None
+    in_flight = threading.Semaphore(concurrency)
+
+    def originate(call):
+        started = time.monotonic()
+        channel = None
+        error = None
+        try:
+            channel = ari.create_channel(**call)
+        except Exception as ex:
+            error = ex
+            logging.error("originate %s error: %s" % (call.get("channel_id"), str(ex)))
+        report.add(time.monotonic() - started, error)
+        in_flight.release()
+        if callback is not None:
+            callback(call, channel, error)
+
+    calls = iter(calls)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            in_flight.acquire()
+            # The next call is taken when it can be sent right away
+            call = next(calls, None)
+            if call is None:
+                break
+            executor.submit(originate, call)
+    report.finished = time.monotonic()
+    return report
@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import wait, TimeoutError
+
+
+class Pipeline:
+    """
+    Sends independent REST operations at once over pooled connections.
+
+    Usage:
+        with ari.pipeline() as pipeline:
+            bridge = pipeline.submit(ari.create_bridge)
+            snoop = pipeline.submit(channel.snoop)
+        # both requests are finished here
+        bridge.result().add_channels([channel.id])
+
+    then(func) calls func(pipeline) when all operations are finished, so the caller
+    (e.g. an event callback) doesn't wait for them
+    """
+
+    def __init__(self, ari):
+        self._ari = ari
+        self.futures = []
+
+    def submit(self, func, *args, **kwargs):
+        """
+        :return: concurrent.futures.Future of func(*args, **kwargs)
+        """
+        future = self._ari.submit(func, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self, timeout=None):
+        """
+        :return: results in submit order, raises the first error
+        """
+        _, not_done = wait(self.futures, timeout)
+        if len(not_done) > 0:
+            raise TimeoutError("%d of %d operations are not finished" % (len(not_done), len(self.futures)))
+        return [future.result() for future in self.futures]
+
+    def errors(self):
+        return [future.exception() for future in self.futures if future.exception() is not None]
+
+    def then(self, func):
+        """
+        Calls func(pipeline) in the thread which finishes the last operation
+        """
+        futures = self.futures[:]
+        if len(futures) == 0:
+            func(self)
+            return
+        remaining = [len(futures)]
+        remaining_cs = threading.Lock()
+
+        def done(future):
+            with remaining_cs:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                func(self)
+        for future in futures:
+            future.add_done_callback(done)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.wait()
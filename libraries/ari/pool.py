@@ -0,0 +1,151 @@
+import collections
+import http.client
+import select
+import threading
+import time
+
+
+Response = collections.namedtuple("Response", ["status", "reason", "data"])
+
+
+class ConnectionPool:
+    """
+    Bounded thread-safe pool of persistent HTTP/1.1 connections to one host.
+
+    Connections are returned to the pool after every request and reused by the
+    next caller. Idle connections older than idle_timeout or already closed by the
+    server are dropped before reuse. If a reused connection still turns out to be
+    closed, the request is repeated once on a fresh socket when it was not sent yet
+    or when its method is idempotent, e.g. POST of a new channel is never repeated.
+    """
+
+    # Errors which mean that a kept-alive socket was closed by the other side
+    STALE_ERRORS = (http.client.RemoteDisconnected,
+                    http.client.BadStatusLine,
+                    ConnectionResetError,
+                    ConnectionAbortedError,
+                    BrokenPipeError)
+    # Methods which may be repeated after the server got them
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+    def __init__(self, host, size=10, idle_timeout=30, timeout=10):
+        self.host = host
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._created = 0
+        self._closed = False
+        self._cs = threading.Condition()
+        self.stat = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "reconnects": 0,
+            "evicted": 0,
+        }
+
+    def _new_connection(self):
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _evict_idle(self):
+        # Idle connections are appended to the right, so the oldest are on the left
+        deadline = time.monotonic() - self.idle_timeout
+        while len(self._idle) > 0 and self._idle[0][1] < deadline:
+            connection, _ = self._idle.popleft()
+            connection.close()
+            self._created -= 1
+            self.stat["evicted"] += 1
+
+    @staticmethod
+    def _is_dropped(connection):
+        # Idle socket is readable only if the server closed it or sent garbage
+        if connection.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return len(readable) > 0
+
+    def acquire(self):
+        """
+        :return: (HTTPConnection, bool) connection and True if it was reused
+        """
+        with self._cs:
+            while True:
+                self._evict_idle()
+                if len(self._idle) > 0:
+                    connection, _ = self._idle.pop()
+                    if self._is_dropped(connection):
+                        connection.close()
+                        self._created -= 1
+                        self.stat["evicted"] += 1
+                        continue
+                    self.stat["hits"] += 1
+                    return connection, True
+                if self._created < self.size:
+                    self._created += 1
+                    self.stat["misses"] += 1
+                    return self._new_connection(), False
+                self.stat["waits"] += 1
+                self._cs.wait()
+
+    def release(self, connection, reuse=True):
+        with self._cs:
+            if reuse and not self._closed:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                connection.close()
+                self._created -= 1
+            self._cs.notify()
+
+    def request(self, method, uri, headers=None, body=None):
+        """
+        :return: Response(status, reason, data) where data is bytes
+        """
+        connection, reused = self.acquire()
+        try:
+            sent = False
+            try:
+                connection.request(method, uri, headers=headers or {}, body=body)
+                sent = True
+                response = self._read_response(connection)
+            except self.STALE_ERRORS:
+                # The server may have got the request already, so it is repeated only if that is harmless
+                if not reused or (sent and method not in self.IDEMPOTENT_METHODS):
+                    raise
+                # HTTPConnection opens a new socket on the next request after close
+                connection.close()
+                with self._cs:
+                    self.stat["reconnects"] += 1
+                connection.request(method, uri, headers=headers or {}, body=body)
+                response = self._read_response(connection)
+        except Exception:
+            self.release(connection, False)
+            raise
+        self.release(connection, not response[1])
+        return response[0]
+
+    @staticmethod
+    def _read_response(connection):
+        res = connection.getresponse()
+        data = res.read()
+        return Response(res.status, res.reason, data), res.will_close
+
+    def close(self):
+        with self._cs:
+            self._closed = True
+            while len(self._idle) > 0:
+                connection, _ = self._idle.pop()
+                connection.close()
+                self._created -= 1
+            self._cs.notify_all()
+
+    def get_stat(self):
+        with self._cs:
+            result = dict(self.stat)
+            result["size"] = self.size
+            result["open"] = self._created
+            result["idle"] = len(self._idle)
+        return result
@@ -0,0 +1,181 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from .stats import Histogram
+
+# Path segments after these ones are ids, e.g. /ari/bridges/{id}/play
+_ID_COLLECTIONS = ("channels", "bridges", "playbacks", "applications", "live", "stored", "sounds",
+                   "deviceStates", "mailboxes", "variable")
+_ACTIONS = ("create", "externalMedia")
+# Numbers of thread names, e.g. ari-dispatch-0, ThreadPoolExecutor-0_3, Thread-5 (run)
+_THREAD_NUMBER = re.compile(r"[-_]?\d+")
+
+
+def endpoint(method, uri):
+    """
+    :return: "METHOD path" with ids replaced by {id}, e.g. "POST /ari/bridges/{id}/play"
+    """
+    parts = uri.split("?", 1)[0].split("/")
+    for index in range(1, len(parts)):
+        if parts[index - 1] in _ID_COLLECTIONS and parts[index] not in _ACTIONS:
+            parts[index] = "{id}"
+    return "%s %s" % (method, "/".join(parts))
+
+
+class TimedLock:
+    """
+    Lock which records acquire wait to a histogram, it replaces a lock while profiling.
+    blocked counts acquires which found the lock held by another thread
+    """
+
+    def __init__(self, lock, histogram):
+        self.lock = lock
+        self.histogram = histogram
+        self.blocked = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(False)
+        if not acquired and blocking:
+            acquired = self.lock.acquire(True, timeout)
+            if acquired:
+                # Counted under the lock, so increments of waiting threads are not lost
+                self.blocked += 1
+        self.histogram.record(time.perf_counter() - started)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class Profiler:
+    """
+    Opt-in timings of Ari hot paths by sections:
+    * decode - Ari.decode_event by event type
+    * dispatch - callbacks of Ari.send_callback by event type
+    * rest - Ari.send_request by endpoint
+    * lock - waits for locks of callbacks and model caches
+    With sample_interval > 0 a sampler thread saves stacks of threads
+    in flamegraph folded format, they are saved to output when the profiler stops.
+
+    Usage:
+        profiler = ari.enable_profiler(sample_interval=0.01)
+        ...
+        ari.close()
+        print(profiler.format_stat())
+    """
+
+    def __init__(self, sample_interval=0, thread_prefixes=(), output=None):
+        """
+        :param thread_prefixes: names of sampled threads start with one of them, all threads if empty
+        :param output: path of folded stacks, e.g. profile.folded
+        """
+        self.sample_interval = sample_interval
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.output = output
+        self.histograms = {}
+        self.stacks = {}
+        self.samples = 0
+        self._cs = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def histogram(self, section, key):
+        histogram = self.histograms.get((section, key))
+        if histogram is None:
+            with self._cs:
+                histogram = self.histograms.setdefault((section, key), Histogram())
+        return histogram
+
+    def record(self, section, key, seconds):
+        self.histogram(section, key).record(seconds)
+
+    def timed_lock(self, lock, name):
+        """
+        :return: TimedLock of lock, waits are recorded as lock section by name
+        """
+        if isinstance(lock, TimedLock):
+            return lock
+        return TimedLock(lock, self.histogram("lock", name))
+
+    def start(self):
+        if self.sample_interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="ari-profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            if self.output:
+                self.write_folded(self.output)
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                name = names.get(ident)
+                if ident == own or name is None:
+                    continue
+                if self.thread_prefixes and not name.startswith(self.thread_prefixes):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s)" % (getattr(code, "co_qualname", code.co_name),
+                                              os.path.basename(code.co_filename)))
+                    frame = frame.f_back
+                # Threads of a pool are folded as one thread
+                stack.append(_THREAD_NUMBER.sub("", name))
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            del frames
+            self.samples += 1
+
+    def write_folded(self, path):
+        """
+        Saves sampled stacks as "thread;func (file);... count" lines,
+        the input of flamegraph.pl and speedscope
+        """
+        with open(path, "w") as folded_file:
+            for stack, count in sorted(self.stacks.items()):
+                folded_file.write("%s %d\n" % (stack, count))
+        logging.info("%d samples of %d stacks are saved to %s" % (self.samples, len(self.stacks), path))
+
+    def get_stat(self):
+        """
+        :return: dict section -> key -> histogram stat
+        """
+        result = {}
+        with self._cs:
+            items = list(self.histograms.items())
+        for (section, key), histogram in items:
+            result.setdefault(section, {})[key] = histogram.get_stat()
+        return result
+
+    def format_stat(self):
+        lines = ["%-8s %-44s %8s %10s %9s %9s %9s" % ("section", "key", "count", "total ms", "p50 ms", "p99 ms",
+                                                      "max ms")]
+        for section, keys in sorted(self.get_stat().items()):
+            for key, stat in sorted(keys.items(), key=lambda item: -item[1]["avg"] * item[1]["count"]):
+                lines.append("%-8s %-44s %8d %10.1f %9.3f %9.3f %9.3f" % (
+                    section, key, stat["count"], stat["avg"] * stat["count"] * 1000, stat["p50"] * 1000,
+                    stat["p99"] * 1000, stat["max"] * 1000))
+        return "\n".join(lines)
@@ -0,0 +1,173 @@
+import gzip
+import json
+import logging
+import struct
+import threading
+import time
+
+MAGIC = b"ARIREC1 "
+# Monotonic time of the frame, 1 if the frame was bytes, frame length
+_FRAME = struct.Struct("<dBI")
+
+
+class EventRecorder:
+    """
+    Appends raw WebSocket frames with monotonic timestamps to a gzip log.
+
+    record() only buffers the frame, frames are compressed and written by a writer thread
+    every flush_interval seconds, so the WebSocket thread doesn't wait for the disk.
+    Every flush is a gzip member, so the log of a killed process is readable
+    up to the last flush
+    """
+
+    def __init__(self, path, flush_interval=1.0, compresslevel=6):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compresslevel = compresslevel
+        self.frames = 0
+        self._buffer = []
+        self._cs = threading.Lock()
+        self._stop = threading.Event()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._write([MAGIC + json.dumps({"time": time.time(), "monotonic": time.monotonic()}).encode() + b"\n"])
+        self._thread = threading.Thread(target=self._run, name="ari-recorder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, frame):
+        """
+        :param frame: str or bytes of WebSocket message
+        """
+        item = (time.monotonic(), frame)
+        with self._cs:
+            self._buffer.append(item)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._cs:
+            frames = self._buffer
+            self._buffer = []
+        if len(frames) == 0:
+            return
+        chunks = []
+        for timestamp, frame in frames:
+            is_bytes = isinstance(frame, bytes)
+            data = frame if is_bytes else frame.encode()
+            chunks.append(_FRAME.pack(timestamp, int(is_bytes), len(data)))
+            chunks.append(data)
+        self._write(chunks)
+        self.frames += len(frames)
+
+    def _write(self, chunks):
+        self._file.write(gzip.compress(b"".join(chunks), self.compresslevel))
+        self._file.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+        logging.info("%d events are recorded to %s" % (self.frames, self.path))
+
+
+def read_log(path):
+    """
+    :return: (header dict, generator of (monotonic time, frame))
+    """
+    log_file = gzip.open(path, "rb")
+    line = log_file.readline()
+    if not line.startswith(MAGIC):
+        log_file.close()
+        raise ValueError("%s is not an event log" % path)
+    header = json.loads(line[len(MAGIC):].decode())
+
+    def frames():
+        with log_file:
+            while True:
+                try:
+                    head = log_file.read(_FRAME.size)
+                    if len(head) < _FRAME.size:
+                        return
+                    timestamp, is_bytes, length = _FRAME.unpack(head)
+                    data = log_file.read(length)
+                    truncated = len(data) < length
+                except EOFError:
+                    # gzip member of a flush cut by a killed process
+                    truncated = True
+                if truncated:
+                    logging.warning("%s: truncated frame is skipped" % path)
+                    return
+                yield timestamp, data if is_bytes else data.decode()
+    return header, frames()
+
+
+def read_frames(path):
+    """
+    Yields frames of the event log without timestamps
+    """
+    for _, frame in read_log(path)[1]:
+        yield frame
+
+
+class Replayer:
+    """
+    Feeds an event log to Ari.on_message without asterisk.
+
+    speed 1 keeps recorded intervals between frames, 10 is ten times faster,
+    0 sends frames as fast as Ari takes them. Models and callbacks work as with live events,
+    so throughput of the models/events layer is measured on production-shaped traffic.
+
+    Usage:
+        ari = Ari(url, user, password, app)
+        ari.append_callback("StasisStart", on_start)
+        stat = Replayer(ari, "events.log.gz", speed=10).run()
+    """
+
+    def __init__(self, ari, path, speed=0):
+        self.ari = ari
+        self.path = path
+        self.speed = speed
+
+    def run(self, wait_dispatch=True):
+        """
+        :param wait_dispatch: wait until dispatch threads finish callbacks of all events
+        :return: dict with frames, seconds, frames per second and max lag behind the schedule
+        """
+        ari = self.ari
+        ari.ws_running = True
+        if not ari._dispatcher.running:
+            ari._dispatcher.start()
+        _, frames = read_log(self.path)
+        count = 0
+        lag_max = 0.0
+        first = None
+        started = time.monotonic()
+        for timestamp, frame in frames:
+            if first is None:
+                first = timestamp
+            if self.speed > 0:
+                due = started + (timestamp - first) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    lag_max = max(lag_max, -delay)
+            ari.on_message(None, frame)
+            count += 1
+        sent = time.monotonic()
+        if wait_dispatch:
+            ari._dispatcher.join()
+        finished = time.monotonic()
+        return {
+            "frames": count,
+            "speed": self.speed,
+            "recorded_seconds": timestamp - first if first is not None else 0.0,
+            "send_seconds": sent - started,
+            "seconds": finished - started,
+            "frames_per_sec": count / (finished - started) if finished > started else 0.0,
+            "lag_max": lag_max,
+        }
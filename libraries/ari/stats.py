@@ -0,0 +1,145 @@
+import math
+import threading
+import time
+
+
+class Histogram:
+    """
+    Histogram of positive values in constant memory.
+    Buckets grow exponentially, so percentiles have the same relative error
+    (about 1 / buckets_per_octave) for milliseconds and minutes
+    """
+
+    def __init__(self, min_value=1e-6, max_value=3600.0, buckets_per_octave=16):
+        self.min_value = min_value
+        self.buckets_per_octave = buckets_per_octave
+        self._buckets = [0] * (self._index(max_value) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._cs = threading.Lock()
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return int(math.log2(value / self.min_value) * self.buckets_per_octave) + 1
+
+    def _value(self, index):
+        # Upper bound of the bucket
+        return self.min_value * 2 ** (index / float(self.buckets_per_octave))
+
+    def record(self, value):
+        index = min(self._index(value), len(self._buckets) - 1)
+        with self._cs:
+            self._buckets[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """
+        :param percent: 0..100
+        """
+        with self._cs:
+            if self.count == 0:
+                return 0.0
+            rank = percent / 100.0 * self.count
+            seen = 0
+            for index, count in enumerate(self._buckets):
+                seen += count
+                if seen >= rank and count > 0:
+                    return min(self._value(index), self.max)
+            return self.max
+
+    def merge(self, other):
+        """
+        Adds values of other histogram with the same bounds, e.g. from another process
+        """
+        with self._cs:
+            for index, count in enumerate(other._buckets):
+                self._buckets[index] += count
+            self.count += other.count
+            self.total += other.total
+            if other.min is not None and (self.min is None or other.min < self.min):
+                self.min = other.min
+            if other.max is not None and (self.max is None or other.max > self.max):
+                self.max = other.max
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_cs"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cs = threading.Lock()
+
+    def get_stat(self):
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "min": self.min or 0.0,
+            "max": self.max or 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Timeline:
+    """
+    Latency percentiles and gauges by time windows of interval seconds.
+    Only the current window keeps a Histogram, finished windows are kept as one row,
+    so long runs take little memory
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.started = time.monotonic()
+        self._rows = []
+        self._window = 0
+        self._histogram = Histogram()
+        self._gauges = {}
+        self._cs = threading.Lock()
+
+    def _roll(self, now):
+        window = int((now - self.started) / self.interval)
+        while window > self._window:
+            stat = self._histogram.get_stat()
+            row = {
+                "time": self._window * self.interval,
+                "count": stat["count"],
+                "p50": stat["p50"],
+                "p99": stat["p99"],
+                "max": stat["max"],
+            }
+            row.update(self._gauges)
+            self._rows.append(row)
+            self._window += 1
+            if stat["count"] > 0:
+                self._histogram = Histogram()
+
+    def record(self, value):
+        with self._cs:
+            self._roll(time.monotonic())
+            self._histogram.record(value)
+
+    def set(self, name, value):
+        """
+        Sets gauge of the current window, windows keep the last value
+        """
+        with self._cs:
+            self._roll(time.monotonic())
+            self._gauges[name] = value
+
+    def rows(self):
+        """
+        :return: list of finished windows: time since start, count, p50, p99, max and gauges
+        """
+        with self._cs:
+            self._roll(time.monotonic())
+            return list(self._rows)
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from .stats import Histogram
+
+
+class CallTracer:
+    """
+    Timestamps call phases with monotonic clock and aggregates span durations.
+
+    mark(call_id, phase) saves the time of phase, every span (start phase, end phase)
+    is recorded into its histogram when its end phase is marked.
+    timed(call_id, name) measures a REST request as "rest.<name>" and marks
+    "<name>_sent" and "<name>_done" phases.
+    Only marks of live calls are kept, call finish() when a call ends.
+    Marks with create=False are dropped after finish(), e.g. of late responses.
+    Marks of calls which never finished are dropped after max_age seconds
+    """
+
+    def __init__(self, spans, max_age=3600):
+        """
+        :param spans: dict span name -> (start phase, end phase)
+        """
+        self.spans = spans
+        self.max_age = max_age
+        self._ends = {}
+        for name, (start, end) in spans.items():
+            self._ends.setdefault(end, []).append((name, start))
+        self.histograms = {}
+        self._marks = {}
+        self._cs = threading.Lock()
+        self._dump_thread = None
+        self._stop = threading.Event()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._cs:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def mark(self, call_id, phase, create=True):
+        """
+        :param create: start marks of the call if it has none, else the mark is dropped
+        """
+        now = time.monotonic()
+        with self._cs:
+            marks = self._marks.get(call_id)
+            if marks is None:
+                if not create:
+                    return
+                marks = self._marks[call_id] = {}
+            marks[phase] = now
+            spans = [(name, marks[start]) for name, start in self._ends.get(phase, ()) if start in marks]
+        for name, started in spans:
+            self.histogram(name).record(now - started)
+
+    @contextmanager
+    def timed(self, call_id, name, create=True):
+        self.mark(call_id, name + "_sent", create)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.histogram("rest." + name).record(time.monotonic() - started)
+            self.mark(call_id, name + "_done", create)
+
+    def finish(self, call_id):
+        """
+        :return: dict phase -> time of the finished call, e.g. for its call detail record
+        """
+        with self._cs:
+            return self._marks.pop(call_id, None) or {}
+
+    def live_calls(self):
+        return len(self._marks)
+
+    def expire(self):
+        deadline = time.monotonic() - self.max_age
+        with self._cs:
+            expired = [call_id for call_id, marks in self._marks.items() if max(marks.values()) < deadline]
+            for call_id in expired:
+                del self._marks[call_id]
+        return len(expired)
+
+    def merge(self, histograms):
+        """
+        :param histograms: dict name -> Histogram, e.g. histograms of a tracer in another process
+        """
+        for name, histogram in histograms.items():
+            self.histogram(name).merge(histogram)
+
+    def get_stat(self):
+        with self._cs:
+            names = sorted(self.histograms.keys())
+        return dict((name, self.histograms[name].get_stat()) for name in names)
+
+    def format_stat(self):
+        lines = ["%-32s %8s %9s %9s %9s %9s" % ("span", "count", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+        for name, stat in sorted(self.get_stat().items()):
+            lines.append("%-32s %8d %9.1f %9.1f %9.1f %9.1f" % (name, stat["count"], stat["p50"] * 1000,
+                                                               stat["p95"] * 1000, stat["p99"] * 1000,
+                                                               stat["max"] * 1000))
+        return "\n".join(lines)
+
+    def start_dump(self, interval, expire_interval=60):
+        """
+        Logs stat every interval seconds (never if interval is 0) and expires old marks
+        """
+        self._dump_thread = threading.Thread(target=self._dump, args=(interval, expire_interval))
+        self._dump_thread.daemon = True
+        self._dump_thread.start()
+
+    def _dump(self, interval, expire_interval):
+        wait = min(interval, expire_interval) if interval > 0 else expire_interval
+        last_dump = last_expire = time.monotonic()
+        while not self._stop.wait(wait):
+            now = time.monotonic()
+            if interval > 0 and now - last_dump >= interval:
+                last_dump = now
+                logging.info("call latency:\n%s" % self.format_stat())
+            if now - last_expire >= expire_interval:
+                last_expire = now
+                self.expire()
+
+    def stop_dump(self):
+        self._stop.set()
+        if self._dump_thread is not None:
+            self._dump_thread.join()
@@ -0,0 +1,281 @@
+"""
+Call detail records of load tests in a compact append-only columnar file.
+
+File is a header and blocks of up to block_size records:
+    header: b"CDR1", uint32 length, json {"phases": [...], "outcomes": [...]}
+    block:  uint32 records, uint32 payload length, payload of columns:
+            channel ids and media as utf-8 lines, start time (float64 unix time),
+            every phase as float32 seconds since start (NaN if not reached),
+            outcome (uint8 index of outcomes), hangup cause (uint16)
+Every block is written at once, so a file of a killed process ends with whole blocks
+and a truncated tail which readers skip and the next writer cuts off before appending.
+
+Usage:
+    python3 -m libraries.cdr calls.cdr [calls-1.cdr ...] [--json]
+"""
+import argparse
+import array
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import threading
+import time
+
+from libraries.ari.stats import Histogram
+
+MAGIC = b"CDR1"
+OUTCOMES = ("completed", "hangup", "unanswered", "failed")
+_HEADER = struct.Struct("<4sI")
+_BLOCK = struct.Struct("<II")
+_LENGTH = struct.Struct("<I")
+
+
+def _pack_array(typecode, values):
+    column = array.array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _unpack_array(typecode, data, offset, count):
+    column = array.array(typecode)
+    end = offset + column.itemsize * count
+    column.frombytes(data[offset:end])
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column, end
+
+
+def _pack_strings(values):
+    data = "\n".join(values).encode()
+    return _LENGTH.pack(len(data)) + data
+
+
+def _unpack_strings(data, offset, count):
+    length = _LENGTH.unpack_from(data, offset)[0]
+    offset += _LENGTH.size
+    values = bytes(data[offset:offset + length]).decode().split("\n") if count > 0 else []
+    return values, offset + length
+
+
+class CdrWriter:
+    """
+    Buffers records and appends them by blocks.
+    A block is written when block_size records are buffered, on write() after flush_interval seconds
+    and on close()
+    """
+
+    def __init__(self, path, phases, block_size=256, flush_interval=5):
+        """
+        :param phases: phase names of records, e.g. CallTracer marks
+        """
+        self.path = path
+        self.phases = tuple(phases)
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._buffer = []
+        self._flushed = time.monotonic()
+        self._cs = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            header = json.dumps({"phases": self.phases, "outcomes": OUTCOMES}).encode()
+            self._file.write(_HEADER.pack(MAGIC, len(header)) + header)
+            self._file.flush()
+        elif read_header(path)[0] != list(self.phases):
+            self._file.close()
+            raise ValueError("%s has records of other phases" % path)
+        else:
+            # New blocks would follow a truncated block of a killed writer and become unreadable
+            size = complete_size(path)
+            if size < self._file.tell():
+                logging.warning("%s: truncated block of %d bytes is removed" % (path, self._file.tell() - size))
+                self._file.truncate(size)
+                self._file.seek(size)
+
+    def write(self, channel_id, outcome, marks, cause=0, media=""):
+        """
+        :param outcome: one of OUTCOMES
+        :param marks: dict phase -> time.monotonic() of the phase, see CallTracer.finish
+        """
+        record = (str(channel_id), media or "", OUTCOMES.index(outcome), cause or 0, self._times(marks))
+        with self._cs:
+            self._buffer.append(record)
+            self.records += 1
+            if len(self._buffer) >= self.block_size or time.monotonic() - self._flushed >= self.flush_interval:
+                self._flush()
+
+    def _times(self, marks):
+        marks = marks or {}
+        if len(marks) == 0:
+            return time.time(), [math.nan] * len(self.phases)
+        first = min(marks.values())
+        started = time.time() - (time.monotonic() - first)
+        return started, [marks[phase] - first if phase in marks else math.nan for phase in self.phases]
+
+    def flush(self):
+        with self._cs:
+            self._flush()
+
+    def _flush(self):
+        self._flushed = time.monotonic()
+        records = self._buffer
+        if len(records) == 0:
+            return
+        self._buffer = []
+        columns = [
+            _pack_strings([record[0] for record in records]),
+            _pack_strings([record[1] for record in records]),
+            _pack_array("d", [record[4][0] for record in records]),
+        ]
+        for index in range(len(self.phases)):
+            columns.append(_pack_array("f", [record[4][1][index] for record in records]))
+        columns.append(_pack_array("B", [record[2] for record in records]))
+        columns.append(_pack_array("H", [record[3] for record in records]))
+        payload = b"".join(columns)
+        self._file.write(_BLOCK.pack(len(records), len(payload)) + payload)
+        self._file.flush()
+
+    def close(self):
+        with self._cs:
+            self._flush()
+            self._file.close()
+
+
+def read_header(path):
+    """
+    :return: (phases, outcomes, offset of the first block)
+    """
+    with open(path, "rb") as cdr_file:
+        magic, length = _HEADER.unpack(cdr_file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a CDR file" % path)
+        header = json.loads(cdr_file.read(length).decode())
+    return header["phases"], header["outcomes"], _HEADER.size + length
+
+
+def complete_size(path):
+    """
+    :return: size of the header and whole blocks, a truncated block of a killed writer starts there
+    """
+    offset = read_header(path)[2]
+    size = os.path.getsize(path)
+    with open(path, "rb") as cdr_file:
+        while offset + _BLOCK.size <= size:
+            cdr_file.seek(offset)
+            length = _BLOCK.unpack(cdr_file.read(_BLOCK.size))[1]
+            if offset + _BLOCK.size + length > size:
+                break
+            offset += _BLOCK.size + length
+    return offset
+
+
+def read_blocks(path):
+    """
+    Yields blocks as dicts of columns: channel_id, media, started, phases (dict name -> column),
+    outcome, cause. A truncated last block is skipped
+    """
+    phases, outcomes, offset = read_header(path)
+    with open(path, "rb") as cdr_file:
+        data = cdr_file.read()
+    while offset + _BLOCK.size <= len(data):
+        count, length = _BLOCK.unpack_from(data, offset)
+        offset += _BLOCK.size
+        if offset + length > len(data):
+            logging.warning("%s: truncated block of %d records is skipped" % (path, count))
+            return
+        payload = memoryview(data)[offset:offset + length]
+        offset += length
+        block = {"count": count, "outcomes": outcomes, "phases": {}}
+        position = 0
+        block["channel_id"], position = _unpack_strings(payload, position, count)
+        block["media"], position = _unpack_strings(payload, position, count)
+        block["started"], position = _unpack_array("d", payload, position, count)
+        for phase in phases:
+            block["phases"][phase], position = _unpack_array("f", payload, position, count)
+        block["outcome"], position = _unpack_array("B", payload, position, count)
+        block["cause"], position = _unpack_array("H", payload, position, count)
+        yield block
+
+
+def read_records(path):
+    """
+    Yields records as dicts, phases which were not reached are missing
+    """
+    for block in read_blocks(path):
+        for index in range(block["count"]):
+            phases = dict((name, column[index]) for name, column in block["phases"].items()
+                          if not math.isnan(column[index]))
+            yield {
+                "channel_id": block["channel_id"][index],
+                "media": block["media"][index],
+                "started": block["started"][index],
+                "phases": phases,
+                "outcome": block["outcomes"][block["outcome"][index]],
+                "cause": block["cause"][index],
+            }
+
+
+def summarize(paths):
+    """
+    Summarizes records by columns without building record objects
+    :return: dict with calls, outcomes, causes, media, first/last start, calls per second
+    and percentiles of time from call start to every phase
+    """
+    result = {"calls": 0, "outcomes": {}, "causes": {}, "media": {}, "first": None, "last": None}
+    histograms = {}
+    for path in paths:
+        for block in read_blocks(path):
+            result["calls"] += block["count"]
+            for index in block["outcome"]:
+                name = block["outcomes"][index]
+                result["outcomes"][name] = result["outcomes"].get(name, 0) + 1
+            for cause in block["cause"]:
+                result["causes"][cause] = result["causes"].get(cause, 0) + 1
+            for media in block["media"]:
+                result["media"][media] = result["media"].get(media, 0) + 1
+            if block["count"] > 0:
+                first, last = min(block["started"]), max(block["started"])
+                result["first"] = first if result["first"] is None else min(result["first"], first)
+                result["last"] = last if result["last"] is None else max(result["last"], last)
+            for phase, column in block["phases"].items():
+                histogram = histograms.setdefault(phase, Histogram())
+                for value in column:
+                    if not math.isnan(value):
+                        histogram.record(value)
+    duration = result["last"] - result["first"] if result["calls"] > 0 else 0
+    result["cps"] = result["calls"] / duration if duration > 0 else 0.0
+    result["phases"] = dict((phase, histogram.get_stat()) for phase, histogram in histograms.items())
+    return result
+
+
+def format_summary(summary):
+    lines = ["calls:\t%d" % summary["calls"], "cps:\t%.2f" % summary["cps"]]
+    for title in ("outcomes", "causes", "media"):
+        lines.append("%s:\t%s" % (title, ", ".join("%s=%d" % item for item in sorted(summary[title].items()))))
+    lines.append("%-24s %8s %9s %9s %9s %9s" % ("phase since start", "count", "p50 ms", "p95 ms", "p99 ms",
+                                                 "max ms"))
+    for phase, stat in sorted(summary["phases"].items(), key=lambda item: item[1]["p50"]):
+        lines.append("%-24s %8d %9.1f %9.1f %9.1f %9.1f" % (phase, stat["count"], stat["p50"] * 1000,
+                                                           stat["p95"] * 1000, stat["p99"] * 1000,
+                                                           stat["max"] * 1000))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="CDR files, e.g. of every worker")
+    parser.add_argument("--json", action="store_true", help="print machine-readable summary")
+    args = parser.parse_args()
+    summary = summarize(args.paths)
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(format_summary(summary))
+
+
+if __name__ == '__main__':
+    main()
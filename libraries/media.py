@@ -0,0 +1,154 @@
+import bisect
+import logging
+import mmap
+import os
+import random
+
+# GSM 06.10 frame: 33 bytes of 160 samples at 8 kHz, the first nibble of every frame is 0xD
+GSM_FRAME_SIZE = 33
+GSM_FRAME_DURATION = 0.02
+GSM_MAGIC = 0xD
+
+
+class MediaFile:
+    """
+    Sound file of the catalog with the playback uri and duration
+    """
+
+    __slots__ = ("name", "path", "size", "frames", "duration", "uri")
+
+    def __init__(self, name, path, size, frames):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.frames = frames
+        self.duration = frames * GSM_FRAME_DURATION
+        # Asterisk adds the extension of its format itself
+        self.uri = "sound:%s" % os.path.splitext(path)[0]
+
+    def get_stat(self):
+        return {
+            "path": self.path,
+            "size": self.size,
+            "frames": self.frames,
+            "duration": self.duration,
+        }
+
+
+def read_gsm(path):
+    """
+    Validates GSM file by memory-mapped reads of frame headers, the payload is never copied
+    :return: frame count
+    """
+    with open(path, "rb") as sound_file:
+        size = os.fstat(sound_file.fileno()).st_size
+        if size == 0 or size % GSM_FRAME_SIZE != 0:
+            raise ValueError("%s: size %d is not a multiple of GSM frame %d" % (path, size, GSM_FRAME_SIZE))
+        with mmap.mmap(sound_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            headers = memoryview(data)[::GSM_FRAME_SIZE]
+            try:
+                for frame, header in enumerate(headers):
+                    if header >> 4 != GSM_MAGIC:
+                        raise ValueError("%s: frame %d has no GSM signature" % (path, frame))
+            finally:
+                headers.release()
+    return size // GSM_FRAME_SIZE
+
+
+def parse_mix(value):
+    """
+    :param value: comma separated names with optional *weight, e.g. "mid_sound*3,not_long_sound"
+    :return: dict name -> weight
+    """
+    mix = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.strip().partition("*")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class MediaCatalog:
+    """
+    Sound files scanned once at startup.
+
+    Every file is validated and its duration is taken from the frame count,
+    so calls pick media and know their hold time without filesystem access.
+    choose() picks a file by weights of the media mix.
+
+    Usage:
+        catalog = MediaCatalog("sounds", {"mid_sound": 3, "not_long_sound": 1})
+        media = catalog.choose()
+        bridge.play(media.uri)
+    """
+
+    EXTENSIONS = {".gsm": read_gsm}
+
+    def __init__(self, path, mix=None):
+        """
+        :param mix: dict name -> weight, all files have the same weight if empty
+        """
+        self.path = os.path.abspath(path)
+        self.files = {}
+        self.scan()
+        self.set_mix(mix or dict.fromkeys(self.files, 1))
+
+    def scan(self):
+        """
+        Reads files of path, invalid files are logged and skipped
+        """
+        files = {}
+        for file_name in sorted(os.listdir(self.path)):
+            name, extension = os.path.splitext(file_name)
+            reader = self.EXTENSIONS.get(extension.lower())
+            if reader is None:
+                continue
+            file_path = os.path.join(self.path, file_name)
+            try:
+                frames = reader(file_path)
+            except (OSError, ValueError) as ex:
+                logging.error("media %s is skipped: %s" % (file_path, str(ex)))
+                continue
+            files[name] = MediaFile(name, file_path, os.path.getsize(file_path), frames)
+        self.files = files
+
+    def set_mix(self, mix):
+        """
+        :param mix: dict name -> weight
+        """
+        unknown = [name for name in mix if name not in self.files]
+        if len(unknown) > 0:
+            raise ValueError("unknown media %s, available: %s" % (", ".join(unknown), ", ".join(self.files)))
+        mix = dict((name, weight) for name, weight in mix.items() if weight > 0)
+        if len(mix) == 0:
+            raise ValueError("media mix of %s is empty" % self.path)
+        self.mix = mix
+        self._choices = [self.files[name] for name in sorted(mix)]
+        self._cumulative = []
+        total = 0.0
+        for media in self._choices:
+            total += mix[media.name]
+            self._cumulative.append(total)
+
+    def choose(self, rnd=random):
+        """
+        :return: MediaFile picked by mix weights
+        """
+        index = bisect.bisect_right(self._cumulative, rnd.random() * self._cumulative[-1])
+        return self._choices[min(index, len(self._choices) - 1)]
+
+    def expected_duration(self):
+        """
+        :return: mean playback duration of the mix in seconds
+        """
+        total = self._cumulative[-1]
+        return sum(media.duration * self.mix[media.name] for media in self._choices) / total
+
+    def get_stat(self):
+        return {
+            "path": self.path,
+            "files": dict((name, media.get_stat()) for name, media in self.files.items()),
+            "mix": dict(self.mix),
+            "expected_duration": self.expected_duration(),
+        }
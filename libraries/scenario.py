@@ -0,0 +1,151 @@
+"""
+Load scenarios: simultaneous calls target as a function of time.
+
+Asterisk keeps channels and bridges in hash tables which are rehashed as a whole
+under the write lock when they grow (hashtab.c, _ast_hashtab_resize).
+Scenarios change the count of live channels and bridges by different patterns,
+so latency stalls of table growth show up on the REST latency timeline:
+* ramp - linear growth from base to peak over the whole duration
+* spikes - base with jumps to peak for spike_width of every period
+* sawtooth - linear growth from base to peak over every period and a drop to base
+* plateau - peak all the time, with a short hold calls are created and destroyed rapidly
+"""
+import csv
+
+
+def ramp(elapsed, scenario):
+    progress = min(1.0, elapsed / scenario.duration) if scenario.duration > 0 else 1.0
+    return scenario.base + (scenario.peak - scenario.base) * progress
+
+
+def spikes(elapsed, scenario):
+    if elapsed % scenario.period < scenario.period * scenario.spike_width:
+        return scenario.peak
+    return scenario.base
+
+
+def sawtooth(elapsed, scenario):
+    return scenario.base + (scenario.peak - scenario.base) * (elapsed % scenario.period) / scenario.period
+
+
+def plateau(elapsed, scenario):
+    return scenario.peak
+
+
+PROFILES = {
+    "ramp": ramp,
+    "spikes": spikes,
+    "sawtooth": sawtooth,
+    "plateau": plateau,
+}
+
+
+class Scenario:
+    """
+    Target of simultaneous calls over duration seconds.
+    Calls above the target are hung up, calls older than hold seconds are hung up (0 - never),
+    so hold defines the rate of channel and bridge create/destroy
+    """
+
+    def __init__(self, profile, duration, peak, base=0, period=60, spike_width=0.1, hold=0):
+        if profile not in PROFILES:
+            raise ValueError("unknown scenario %s, use one of %s" % (profile, ", ".join(sorted(PROFILES))))
+        if period <= 0:
+            raise ValueError("scenario period must be positive")
+        self.profile = profile
+        self.duration = duration
+        self.peak = peak
+        self.base = base
+        self.period = period
+        self.spike_width = spike_width
+        self.hold = hold
+        self._target = PROFILES[profile]
+
+    @classmethod
+    def from_config(cls, config_obj, section, peak):
+        """
+        Reads scenario options of section, e.g. [calls] of calls.ini
+        :param peak: default peak, e.g. calls count
+        :return: Scenario or None if scenario is not set
+        """
+        profile = config_obj.get(section, "scenario", fallback="")
+        if not profile:
+            return None
+        return cls(profile,
+                   duration=config_obj.getfloat(section, "scenario_duration", fallback=300),
+                   peak=config_obj.getint(section, "scenario_peak", fallback=peak),
+                   base=config_obj.getint(section, "scenario_base", fallback=0),
+                   period=config_obj.getfloat(section, "scenario_period", fallback=60),
+                   spike_width=config_obj.getfloat(section, "scenario_spike_width", fallback=0.1),
+                   hold=config_obj.getfloat(section, "scenario_hold", fallback=0))
+
+    def target(self, elapsed):
+        """
+        :param elapsed: seconds since the scenario start
+        :return: simultaneous calls to keep
+        """
+        return int(round(self._target(elapsed, self)))
+
+    def finished(self, elapsed):
+        return elapsed >= self.duration
+
+
+def window_counts(rows, names=("created", "destroyed")):
+    """
+    :param rows: stats.Timeline rows with running totals of names
+    :return: rows with counts of every window instead of totals
+    """
+    result = []
+    previous = {}
+    for row in rows:
+        row = dict(row)
+        for name in names:
+            total = row.get(name, 0)
+            row[name] = total - previous.get(name, 0)
+            previous[name] = total
+        result.append(row)
+    return result
+
+
+def merge_timelines(timelines):
+    """
+    Merges timelines of worker processes by windows: gauges and counts are summed,
+    latency percentiles are the worst of workers
+    """
+    result = []
+    for rows in timelines:
+        for index, row in enumerate(rows):
+            if index == len(result):
+                result.append(dict(row))
+                continue
+            merged = result[index]
+            for name, value in row.items():
+                if name == "time":
+                    continue
+                if name in ("p50", "p99", "max"):
+                    merged[name] = max(merged.get(name, 0), value)
+                else:
+                    merged[name] = merged.get(name, 0) + value
+    return result
+
+
+def format_timeline(rows):
+    lines = ["%8s %8s %8s %8s %8s %9s %9s %9s" % ("time", "target", "live", "created", "destroyed",
+                                                  "p50 ms", "p99 ms", "max ms")]
+    for row in rows:
+        lines.append("%8.1f %8d %8d %8d %8d %9.1f %9.1f %9.1f" % (
+            row["time"], row.get("target", 0), row.get("live", 0), row.get("created", 0), row.get("destroyed", 0),
+            row["p50"] * 1000, row["p99"] * 1000, row["max"] * 1000))
+    return "\n".join(lines)
+
+
+def write_timeline(path, rows):
+    """
+    Saves timeline rows as csv, e.g. for plotting latency against live channels
+    """
+    fields = ["time", "target", "live", "created", "destroyed", "count", "p50", "p99", "max"]
+    with open(path, "w", newline="") as timeline_file:
+        writer = csv.DictWriter(timeline_file, fields, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict((field, row.get(field, 0)) for field in fields))